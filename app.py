@@ -1,18 +1,29 @@
-from flask import Flask, request, render_template, url_for, redirect, session, Response
+from flask import Flask, request, render_template, url_for, redirect, session, Response, g, copy_current_request_context
 from urllib.parse import urlparse
-from importlib import import_module
 from mongoengine import *
-from dotmap import DotMap
-from threading import Thread
+from payload import Payload
+import hmac
 import json
 import os
 import sys
 import re
+import time
+import datetime
+import threading
 import requests
-from slackclient import SlackClient
-import pprint
+from concurrent.futures import TimeoutError
 
 import command
+import metrics
+import pd
+import slack
+import service_status
+import open_incidents
+from cache import TTLCache
+from workers import WorkerPool
+from dedupe import SeenEvents
+from dispatcher import Dispatcher
+from commands import lazy_commands
 
 pd_client_id = os.environ.get('PD_CLIENT_ID') or "set your PD_CLIENT_ID environment variable"
 
@@ -29,18 +40,200 @@ class User(EmbeddedDocument):
 	pd_userid = StringField(required=True)
 	pd_token = StringField(required=True)
 	pd_subdomain = StringField(required=True)
+	pd_email = StringField()
+	pd_name = StringField()
 
 class Team(Document):
 	slack_team_id = StringField(required=True)
 	slack_app_token = StringField(required=True)
 	slack_bot_token = StringField(required=True)
 	slack_bot_userid = StringField(required=True)
+	# mappings used to live here; resolve() and migrate_users.py move them
+	# to UserMapping
 	users = EmbeddedDocumentListField(User)
+	meta = {
+		'indexes': ['slack_team_id']
+	}
+
+class UserMapping(Document):
+	# one document per Slack user, so mapping a user is a single upsert
+	# instead of rewriting the team's whole user list
+	slack_team_id = StringField(required=True)
+	slack_userid = StringField(required=True)
+	pd_userid = StringField(required=True)
+	pd_token = StringField(required=True)
+	pd_subdomain = StringField(required=True)
+	pd_email = StringField()
+	pd_name = StringField()
+	meta = {
+		'indexes': [
+			{'fields': ['slack_team_id', 'slack_userid'], 'unique': True}
+		]
+	}
+
+team_fields = ('slack_team_id', 'slack_bot_userid', 'slack_bot_token', 'slack_app_token')
+user_fields = ('slack_userid', 'pd_userid', 'pd_token', 'pd_subdomain', 'pd_email', 'pd_name')
+
+def upsert_user_mapping(slack_team_id, slack_userid, pd_userid, pd_token, pd_subdomain, pd_email=None, pd_name=None):
+	UserMapping.objects(slack_team_id=slack_team_id, slack_userid=slack_userid).update_one(
+		upsert=True,
+		set__pd_userid=pd_userid,
+		set__pd_token=pd_token,
+		set__pd_subdomain=pd_subdomain,
+		set__pd_email=pd_email,
+		set__pd_name=pd_name
+	)
+
+def migrate_user_mapping(slack_team_id, slack_userid):
+	# mappings made before UserMapping existed are still in the team's users
+	# list until migrate_users.py has run; copy one over the first time it's
+	# needed. set_on_insert leaves a mapping made meanwhile alone
+	with metrics.mongo_seconds.time(operation="resolve"):
+		team = Team.objects(slack_team_id=slack_team_id, users__slack_userid=slack_userid).only('users').first()
+	legacy = [user for user in team.users if user.slack_userid == slack_userid] if team else None
+	if not legacy:
+		return None
+	UserMapping.objects(slack_team_id=slack_team_id, slack_userid=slack_userid).update_one(
+		upsert=True,
+		set_on_insert__pd_userid=legacy[0].pd_userid,
+		set_on_insert__pd_token=legacy[0].pd_token,
+		set_on_insert__pd_subdomain=legacy[0].pd_subdomain,
+		set_on_insert__pd_email=legacy[0].pd_email,
+		set_on_insert__pd_name=legacy[0].pd_name
+	)
+	return UserMapping.objects(slack_team_id=slack_team_id, slack_userid=slack_userid).only(*user_fields).first()
+
+#####################
+#
+# Team/user resolution - every Slack request needs the team's tokens and the
+# caller's PD mapping, so keep them in process keyed by slack ids
+#
+resolver_ttl = int(os.environ.get('RESOLVER_TTL', 300))
+resolver_negative_ttl = int(os.environ.get('RESOLVER_NEGATIVE_TTL', 30))
+resolver_size = int(os.environ.get('RESOLVER_SIZE', 10000))
+resolver_sync = float(os.environ.get('RESOLVER_SYNC', 2))
+
+team_cache = TTLCache(maxsize=resolver_size, ttl=resolver_ttl)
+user_cache = TTLCache(maxsize=resolver_size, ttl=resolver_ttl)
+_missing = object()
+
+class ResolverInvalidation(Document):
+	# written when a team or mapping changes, so every worker and dyno drops
+	# its cached copy; kept only as long as a cached copy can live
+	slack_team_id = StringField(required=True)
+	slack_userid = StringField()
+	created_at = DateTimeField(default=datetime.datetime.utcnow)
+	meta = {
+		'indexes': [
+			{'fields': ['created_at'], 'expireAfterSeconds': resolver_ttl}
+		]
+	}
 
-command_names = [re.sub(r"\.py", "", name) for name in os.listdir("commands") if name.endswith('.py') and not name.startswith('__')]
-command_modules = list(map(lambda name: {"name": name.title(), "module": import_module("commands.{}".format(name))}, command_names))
-command_classes = [getattr(module["module"], module["name"]) for module in command_modules]
-commands = [command_class() for command_class in command_classes]
+_synced_at = None
+_sync_lock = threading.Lock()
+
+def sync_invalidations():
+	# applies invalidations other processes wrote since the last look, at
+	# most every resolver_sync seconds. Each one is read a few times because
+	# of the overlap that allows for clock skew, which only costs a cache miss
+	global _synced_at
+	if not _sync_lock.acquire(blocking=False):
+		return
+	try:
+		now = datetime.datetime.utcnow()
+		if _synced_at is not None and (now - _synced_at).total_seconds() < resolver_sync:
+			return
+		since = (_synced_at or now) - datetime.timedelta(seconds=5)
+		with metrics.mongo_seconds.time(operation="resolver_sync"):
+			changes = list(ResolverInvalidation.objects(created_at__gt=since).only('slack_team_id', 'slack_userid'))
+		for change in changes:
+			drop_cached(change.slack_team_id, change.slack_userid)
+		_synced_at = now
+	finally:
+		_sync_lock.release()
+
+def resolve(slack_team_id, slack_userid):
+	# returns (team, user): team is None if the app isn't installed in the
+	# workspace, user is None if the Slack user isn't mapped to PD
+	sync_invalidations()
+	team = team_cache.get(slack_team_id)
+	if team is False:
+		# not installed, cached for resolver_negative_ttl
+		metrics.resolver_lookups.inc(result="hit")
+		return (None, None)
+	user = user_cache.get((slack_team_id, slack_userid), _missing)
+	if team is not None and user is not _missing:
+		metrics.resolver_lookups.inc(result="hit")
+		return (team, user)
+	metrics.resolver_lookups.inc(result="miss")
+
+	if team is None:
+		# only the fields requests need, never the team's other users
+		with metrics.mongo_seconds.time(operation="resolve"):
+			team_record = Team.objects(slack_team_id=slack_team_id).only(*team_fields).first()
+		if not team_record:
+			team_cache.set(slack_team_id, False, ttl=resolver_negative_ttl)
+			return (None, None)
+		team = {
+			"slack_team_id": slack_team_id,
+			"slack_bot_userid": team_record.slack_bot_userid,
+			"slack_bot_token": team_record.slack_bot_token,
+			"slack_app_token": team_record.slack_app_token
+		}
+		team_cache.set(slack_team_id, team)
+
+	with metrics.mongo_seconds.time(operation="resolve"):
+		user = UserMapping.objects(slack_team_id=slack_team_id, slack_userid=slack_userid).only(*user_fields).first()
+	if not user and slack_userid:
+		user = migrate_user_mapping(slack_team_id, slack_userid)
+	user_cache.set((slack_team_id, slack_userid), user, ttl=None if user else resolver_negative_ttl)
+	return (team, user)
+
+def drop_cached(slack_team_id, slack_userid=None):
+	team_cache.delete(slack_team_id)
+	if slack_userid:
+		user_cache.delete((slack_team_id, slack_userid))
+
+def invalidate(slack_team_id, slack_userid=None):
+	# drops the cached team/user here right away and in other processes
+	# within resolver_sync seconds
+	drop_cached(slack_team_id, slack_userid)
+	ResolverInvalidation(slack_team_id=slack_team_id, slack_userid=slack_userid).save()
+
+pool = WorkerPool(
+	name="commands",
+	workers=int(os.environ.get('WORKER_THREADS', 8)),
+	queue_size=int(os.environ.get('WORKER_QUEUE_SIZE', 100))
+)
+seen_events = SeenEvents(shared=os.environ.get('DEDUPE_BACKEND') == 'mongo')
+busy_text = "Sorry, I'm swamped right now. Please try again in a minute."
+slash_command_deadline = float(os.environ.get('SLASH_COMMAND_DEADLINE', 2.0))
+slash_command_error_text = "Sorry, something went wrong. Please try again."
+
+commands = lazy_commands()
+dispatcher = Dispatcher(commands)
+
+def run_handler(command, handler, action, *args):
+	# every command handler runs through here so it's timed per command and action
+	labels = {"command": command.name, "handler": handler, "action": action or ""}
+	try:
+		with metrics.command_seconds.time(**labels):
+			return getattr(command, handler)(*args)
+	except Exception:
+		metrics.command_errors.inc(**labels)
+		raise
+
+
+@app.before_request
+def start_timer():
+	g.started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+	if 'started' in g:
+		route = request.url_rule.rule if request.url_rule else "unmatched"
+		metrics.http_request_seconds.observe(time.perf_counter() - g.started, route=route, method=request.method, status=response.status_code)
+	return response
 
 
 @app.route('/slack_event', methods=['POST'])
@@ -48,9 +241,13 @@ def slack_event():
 	if request.json.get('type') == 'url_verification':
 		return request.json.get('challenge')
 
-	req = DotMap(request.json);
+	req = Payload(request.json)
 	event = req.event
 
+	# Slack retries if we were slow to answer; the first delivery is already being handled
+	if seen_events.seen(req.event_id or None):
+		return ('', 200)
+
 	# don't talk to yourself
 	event_subtype = event.message.subtype or event.subtype
 	if event_subtype == 'bot_message':
@@ -60,22 +257,13 @@ def slack_event():
 	slack_channel = event.channel
 
 	slack_team_id = req.team_id
-	slack_userid = event.user or event.message.user
-	team_record = Team.objects(slack_team_id=slack_team_id).first()
-	if not team_record:
+	slack_userid = event.user or event.message.user or None
+	(team, user) = resolve(slack_team_id, slack_userid)
+	if not team:
 		print("team {} not found".format(slack_team_id))
 		return ('', 200)
-	user = [user for user in team_record.users if user.slack_userid == slack_userid]
-	user = user[0] if user else None
-
-	team = {
-		"slack_team_id": slack_team_id,
-		"slack_bot_userid": team_record.slack_bot_userid,
-		"slack_bot_token": team_record.slack_bot_token,
-		"slack_app_token": team_record.slack_app_token
-	}
 
-	sc = SlackClient(team_record.slack_bot_token)
+	sc = slack.client(team["slack_bot_token"])
 
 	if not user or user["pd_subdomain"] == "pdt-k18":
 		sc.api_call("chat.postEphemeral",
@@ -90,89 +278,89 @@ def slack_event():
 					"url": url_for("me", _external=True, _scheme="https", slack_team_id=slack_team_id, slack_userid=slack_userid)
 				}]
 			}],
-			user=user["slack_userid"])
+			user=slack_userid)
 
 		return ('', 200)
 
-	for command in commands:
-		if command.matches(message_text) and callable(getattr(command, "slack_event")):
-			thread = Thread(target=command.slack_event, args=(team, user, req))
-			thread.start()
+	command = dispatcher.match(message_text, "slack_event")
+	if command and not pool.submit(run_handler, command, "slack_event", None, team, user, req, label="{}.slack_event".format(command.name)):
+		sc.api_call("chat.postEphemeral",
+			channel=slack_channel,
+			text=busy_text,
+			user=slack_userid)
 
 	return ('', 200)
 
 
 @app.route('/slack_action', methods=['POST'])
 def slack_action():
-	req = DotMap(json.loads(request.form.get('payload')))
+	req = Payload(json.loads(request.form.get('payload')))
 
 	slack_team_id = req.team.id
 	slack_userid = req.user.id
 	callback_id = req.callback_id
 
-	team_record = Team.objects(slack_team_id=slack_team_id).first()
-	if not team_record:
+	(team, user) = resolve(slack_team_id, slack_userid)
+	if not team:
 		print("team {} not found".format(slack_team_id))
 		return ('', 200)
 
-	team = {
-		"slack_team_id": slack_team_id,
-		"slack_bot_userid": team_record.slack_bot_userid,
-		"slack_bot_token": team_record.slack_bot_token,
-		"slack_app_token": team_record.slack_app_token
-	}
-
-	user = [user for user in team_record.users if user.slack_userid == slack_userid]
-	user = user[0] if user else None
 	if not user:
 		print("user {} not found in team {}".format(slack_userid, slack_team_id))
 		return ("", 200)
 
 	if req.type == "dialog_submission":
-		for command in commands:
-			if command.matches(callback_id) and hasattr(command, "validate_submission") and callable(getattr(command, "validate_submission")):
-				error = command.validate_submission(team, user, req)
-				if error:
-					return (error, 200)
+		command = dispatcher.match(callback_id, "validate_submission")
+		if command:
+			error = run_handler(command, "validate_submission", None, team, user, req)
+			if error:
+				return (error, 200)
+
+	if seen_events.seen("action {}".format(req.trigger_id or req.action_ts) if (req.trigger_id or req.action_ts) else None):
+		return ('', 200)
 
-	for command in commands:
-		if command.matches(callback_id) and callable(getattr(command, "slack_action")):
-			thread = Thread(target=command.slack_action, args=(team, user, req))
-			thread.start()
+	command = dispatcher.match(callback_id, "slack_action")
+	action = req.actions[0].name if req.actions else req.type
+	if command and not pool.submit(run_handler, command, "slack_action", action, team, user, req, label="{}.slack_action".format(command.name)):
+		busy_response = {
+			"response_type": "ephemeral",
+			"replace_original": False,
+			"text": busy_text
+		}
+		if req.type == "dialog_submission":
+			slack.respond(req.response_url, busy_response)
+		else:
+			return Response(json.dumps(busy_response), mimetype="application/json")
 
 	return ('', 200)
 
 
 @app.route('/slack_load_options', methods=['POST'])
 def slack_load_options():
-	req = DotMap(json.loads(request.form.get('payload')))
+	req = Payload(json.loads(request.form.get('payload')))
 
 	slack_team_id = req.team.id
 	slack_userid = req.user.id
 	callback_id = req.callback_id
 
-	team_record = Team.objects(slack_team_id=slack_team_id).first()
-	if not team_record:
+	(team, user) = resolve(slack_team_id, slack_userid)
+	if not team:
 		print("team {} not found".format(slack_team_id))
 		return ('', 200)
 
-	team = {
-		"slack_team_id": slack_team_id,
-		"slack_bot_userid": team_record.slack_bot_userid,
-		"slack_bot_token": team_record.slack_bot_token,
-		"slack_app_token": team_record.slack_app_token
-	}
-
-	user = [user for user in team_record.users if user.slack_userid == slack_userid]
-	user = user[0] if user else None
 	if not user:
 		print("user {} not found in team {}".format(slack_userid, slack_team_id))
 		return ("", 200)
 
-	for command in commands:
-		if command.matches(callback_id) and callable(getattr(command, "slack_load_options")):
-			r = command.slack_load_options(team, user, req)
-			return Response(r, mimetype="application/json")
+	command = dispatcher.match(callback_id, "slack_load_options")
+	if command:
+		try:
+			r = run_handler(command, "slack_load_options", req.name or None, team, user, req)
+		except pd.PDError as e:
+			print("load options for {} failed: {}".format(callback_id, e))
+			r = json.dumps({"options": [{"text": "PagerDuty didn't answer, please try again.", "label": "PagerDuty didn't answer, please try again.", "value": "nothing"}]})
+		return Response(r, mimetype="application/json")
+	return ('', 200)
 
 
 @app.route('/slack_command', methods=['POST'])
@@ -182,20 +370,11 @@ def slack_command():
 	slack_userid = request.form.get('user_id')
 	slack_channel = request.form.get('channel_id')
 
-	team_record = Team.objects(slack_team_id=slack_team_id).first()
-	if not team_record:
+	(team, user) = resolve(slack_team_id, slack_userid)
+	if not team:
 		print("team {} not found".format(slack_team_id))
 		return ('', 200)
 
-	team = {
-		"slack_team_id": slack_team_id,
-		"slack_bot_userid": team_record.slack_bot_userid,
-		"slack_bot_token": team_record.slack_bot_token,
-		"slack_app_token": team_record.slack_app_token
-	}
-
-	user = [user for user in team_record.users if user.slack_userid == slack_userid]
-	user = user[0] if user else None
 	if not user or user["pd_subdomain"] == "pdt-k18":
 		slack_response = {
 			"response_type": "ephemeral",
@@ -212,19 +391,81 @@ def slack_command():
 			}]
 		}
 		response_url = request.form.get('response_url')
-		r = requests.post(response_url,
-			json=slack_response,
-			headers={'Content-type': 'application/json'}
-		)
+		slack.respond(response_url, slack_response)
 		return ('', 200)
 
-	for command in commands:
-		if command.matches(command_text) and callable(getattr(command, "slack_command")):
-			return command.slack_command(team, user, request.form)
+	command = dispatcher.match(command_text, "slack_command")
+	if not command:
+		return ('', 200)
+	if not command.defer_slash_command:
+		return run_handler(command, "slack_command", None, team, user, request.form)
+
+	# Slack gives up on a slash command after 3 seconds, so run it in the
+	# pool and answer inline only if it's done in time. The handler keeps a
+	# copy of the request context so url_for still works after we've acked
+	response_url = request.form.get('response_url')
+	handler = copy_current_request_context(run_handler)
+	future = pool.submit(handler, command, "slack_command", None, team, user, request.form, label="{}.slack_command".format(command.name))
+	if not future:
+		return slash_command_response({"response_type": "ephemeral", "text": busy_text})
+	try:
+		return slash_command_response(future.result(timeout=slash_command_deadline))
+	except TimeoutError:
+		future.add_done_callback(lambda f: deliver_slash_command(response_url, slack_channel, command, f))
+		if command.slash_command_working_text:
+			return slash_command_response({"response_type": "ephemeral", "text": command.slash_command_working_text})
+		return ('', 200)
+	except Exception:
+		# already logged by the pool
+		return slash_command_response({"response_type": "ephemeral", "text": slash_command_error_text})
+
+def slash_command_response(body):
+	if not body:
+		return ('', 200)
+	return Response(json.dumps(body), mimetype="application/json")
+
+def deliver_slash_command(response_url, channel, command, future):
+	if future.exception():
+		body = {"response_type": "ephemeral", "text": slash_command_error_text}
+	else:
+		body = future.result()
+	if not body:
+		return
+	if command.slash_command_working_text:
+		body = dict(body, replace_original=True)
+	slack.send_response(response_url, body, channel=channel)
+
+
 
+#####################
+#
+# PD v2 webhooks - keep the service status store current between crawls
+#
+@app.route('/pd_webhook', methods=['POST'])
+def pd_webhook():
+	# the stores these feed are shared by everyone in a subdomain, so
+	# without a token to check nobody gets to write to them
+	webhook_token = os.environ.get('PD_WEBHOOK_TOKEN')
+	if not webhook_token:
+		print("refusing PD webhook: PD_WEBHOOK_TOKEN isn't set")
+		return ('', 403)
+	if not hmac.compare_digest(request.args.get('token', ''), webhook_token):
+		return ('', 403)
+	payload = request.get_json(force=True, silent=True) or {}
+	service_status.apply_webhook(payload)
+	open_incidents.apply_webhook(payload)
 	return ('', 200)
 
 
+@app.route('/metrics')
+def metrics_endpoint():
+	return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/stats')
+def stats():
+	return Response(json.dumps(pool.stats()), mimetype="application/json")
+
 
 #####################
 #
@@ -291,28 +532,20 @@ def pdtoken():
 	if all (key in request.args for key in ('access_token', 'subdomain')):
 		if all (key in session for key in ('slack_team_id', 'slack_userid', 'slack_bot_token', 'slack_bot_userid')):
 			# got everything
-			team = Team.objects(slack_team_id=session.get('slack_team_id')).first()
-			if team == None:
-				team = Team()
-
-			team.slack_team_id = session.get('slack_team_id')
-			team.slack_app_token = session.get('slack_app_token')
-			team.slack_bot_token = session.get('slack_bot_token')
-			team.slack_bot_userid = session.get('slack_bot_userid')
+			slack_team_id = session.get('slack_team_id')
+			Team.objects(slack_team_id=slack_team_id).update_one(
+				upsert=True,
+				set__slack_app_token=session.get('slack_app_token'),
+				set__slack_bot_token=session.get('slack_bot_token'),
+				set__slack_bot_userid=session.get('slack_bot_userid')
+			)
 
 			slack_userid = session.get('slack_userid')
 			pd_token = request.args.get('access_token')
-			(pd_userid, pd_subdomain) = pd_me(pd_token)
-
-			new_user = User(slack_userid=slack_userid, pd_userid=pd_userid, pd_token=pd_token, pd_subdomain=pd_subdomain)
+			(pd_userid, pd_subdomain, pd_email, pd_name) = pd_me(pd_token)
+			upsert_user_mapping(slack_team_id, slack_userid, pd_userid, pd_token, pd_subdomain, pd_email, pd_name)
 
-			indices = [i for i, user in enumerate(team.users) if user.slack_userid == slack_userid]
-			if len(indices) == 1:
-				team.users[indices[0]] = new_user
-			elif len(indices) == 0:
-				team.users.append(new_user)
-
-			team.save()
+			invalidate(slack_team_id, slack_userid)
 			session.clear()
 			return redirect("https://slack.com/app_redirect?app={}".format(os.environ['SLACK_APP_ID']))
 		else:
@@ -324,30 +557,17 @@ def pdtoken():
 
 
 def pd_me(token):
-	headers = {
-		"Authorization": "Bearer {}".format(token),
-		"Accept": "application/vnd.pagerduty+json;version=2"
-	}
-	r = requests.get("https://api.pagerduty.com/users/me", headers=headers)
-	user = r.json().get('user')
+	user = pd.me(token)
 	pd_userid = user.get('id');
 	pd_subdomain = urlparse(user.get('html_url')).netloc.split('.')[0]
 
-	return (pd_userid, pd_subdomain)
+	return (pd_userid, pd_subdomain, user.get('email'), user.get('name'))
 
-def update_team_user(slack_team_id, slack_userid, pd_userid, pd_token, pd_subdomain):
-	team = Team.objects(slack_team_id=slack_team_id).first()
-	if team == None:
-		return False
-	new_user = User(slack_userid=slack_userid, pd_userid=pd_userid, pd_token=pd_token, pd_subdomain=pd_subdomain)
-	indices = [i for i, user in enumerate(team.users) if user.slack_userid == slack_userid]
-	if len(indices) == 1:
-		team.users[indices[0]] = new_user
-	elif len(indices) == 0:
-		team.users.append(new_user)
-	else:
+def update_team_user(slack_team_id, slack_userid, pd_userid, pd_token, pd_subdomain, pd_email=None, pd_name=None):
+	if not Team.objects(slack_team_id=slack_team_id).only('id').first():
 		return False
-	team.save()
+	upsert_user_mapping(slack_team_id, slack_userid, pd_userid, pd_token, pd_subdomain, pd_email, pd_name)
+	invalidate(slack_team_id, slack_userid)
 	return True
 
 #####################
@@ -368,9 +588,9 @@ def me():
 		slack_team_id = session.get('slack_team_id')
 		slack_userid = session.get('slack_userid')
 		pd_token = request.args.get('access_token')
-		(pd_userid, pd_subdomain) = pd_me(pd_token)
+		(pd_userid, pd_subdomain, pd_email, pd_name) = pd_me(pd_token)
 		session.clear()
-		if update_team_user(slack_team_id, slack_userid, pd_userid, pd_token, pd_subdomain):
+		if update_team_user(slack_team_id, slack_userid, pd_userid, pd_token, pd_subdomain, pd_email, pd_name):
 			return redirect("https://slack.com/app_redirect?app={}".format(os.environ['SLACK_APP_ID']))
 		else:
 			return "Oops, didn't update user mapping for slack user {}".format(slack_userid)
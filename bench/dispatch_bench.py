@@ -0,0 +1,46 @@
+# Compares the per-command matches() loop with the combined Dispatcher regex
+# as the number of commands grows. Run from the repo root:
+#
+#   python bench/dispatch_bench.py
+#
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from command import Command
+from dispatcher import Dispatcher
+
+
+class Synthetic(Command):
+
+	def __init__(self, i):
+		self.name = "cmd{}".format(i)
+		self.patterns = [re.compile(p) for p in [r"^cmd{}\b".format(i), r"^mbcmd{}".format(i), r"alias{}x".format(i)]]
+
+
+def loop_match(commands, text):
+	for command in commands:
+		if command.matches(text):
+			return command
+
+
+def main():
+	print("{:>8} {:>14} {:>14} {:>8}".format("commands", "loop (us)", "dispatch (us)", "speedup"))
+	for n in (5, 10, 25, 50, 100, 250):
+		commands = [Synthetic(i) for i in range(n)]
+		dispatcher = Dispatcher(commands)
+		# a mix of early, late and missing commands, with and without a mention
+		texts = ["<@U123> cmd0 list", "cmd{} now".format(n - 1), "<@U123> mbcmd{}".format(n // 2), "nothing to see here"]
+		for text in texts:
+			assert loop_match(commands, text) is dispatcher.match(text)
+		number = 2000
+		loop = timeit.timeit(lambda: [loop_match(commands, t) for t in texts], number=number) / (number * len(texts))
+		dispatch = timeit.timeit(lambda: [dispatcher.match(t) for t in texts], number=number) / (number * len(texts))
+		print("{:>8} {:>14.2f} {:>14.2f} {:>7.1f}x".format(n, loop * 1e6, dispatch * 1e6, loop / dispatch))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,101 @@
+# Renders an escalation policy with dozens of rules and on-calls, a long
+# services list and an incident, and times the ISO-8601 fast path against
+# dateparser for the same timestamps. Run from
+# the repo root:
+#
+#   python bench/format_bench.py
+#
+import datetime
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import slack_formatters
+
+
+def make_ep(rules, oncalls_per_rule):
+	now = datetime.datetime(2018, 6, 1, 9, 0, tzinfo=datetime.timezone.utc)
+	escalation_rules = []
+	for i in range(rules):
+		current_oncalls = []
+		for j in range(oncalls_per_rule):
+			start = now + datetime.timedelta(hours=j)
+			current_oncalls.append({
+				"escalation_target": {
+					"type": "schedule_reference",
+					"summary": "Schedule {}-{}".format(i, j),
+					"html_url": "https://acme.pagerduty.com/schedules/S{}{}".format(i, j)
+				},
+				"user": {"id": "U{}{}".format(i, j), "name": "User {}-{}".format(i, j)},
+				"start": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+				"end": (start + datetime.timedelta(days=7)).strftime("%Y-%m-%dT%H:%M:%SZ")
+			})
+		escalation_rules.append({"escalation_delay_in_minutes": 30, "current_oncalls": current_oncalls})
+	return {
+		"summary": "Big EP",
+		"html_url": "https://acme.pagerduty.com/escalation_policies/P1",
+		"num_loops": 2,
+		"escalation_rules": escalation_rules
+	}
+
+
+def make_services(count):
+	statuses = ["active", "warning", "critical", "maintenance", "disabled"]
+	return [{
+		"id": "PS{}".format(i),
+		"summary": "Service {}".format(i),
+		"html_url": "https://acme.pagerduty.com/services/PS{}".format(i),
+		"status": statuses[i % len(statuses)]
+	} for i in range(count)]
+
+
+def make_incident():
+	return {
+		"id": "PI1",
+		"incident_number": 42,
+		"title": "Disk full",
+		"status": "triggered",
+		"html_url": "https://acme.pagerduty.com/incidents/PI1",
+		"created_at": "2018-06-01T09:00:00Z",
+		"service": {"summary": "Service 1", "html_url": "https://acme.pagerduty.com/services/PS1"},
+		"assignments": [{"assignee": {"summary": "User 1", "html_url": "https://acme.pagerduty.com/users/U1"}}]
+	}
+
+
+def main():
+	ep = make_ep(40, 6)
+	timestamps = [o[k] for r in ep["escalation_rules"] for o in r["current_oncalls"] for k in ("start", "end")]
+	print("{} rules, {} on-calls, {} timestamps".format(len(ep["escalation_rules"]), len(timestamps) // 2, len(timestamps)))
+
+	number = 50
+	cold = timeit.timeit(lambda: (slack_formatters.date_token.cache_clear(), slack_formatters.make_ep_text(ep)), number=number) / number
+	warm = timeit.timeit(lambda: slack_formatters.make_ep_text(ep), number=number) / number
+	print("make_ep_text, cold date cache: {:8.2f} ms".format(cold * 1e3))
+	print("make_ep_text, warm date cache: {:8.2f} ms".format(warm * 1e3))
+
+	services = make_services(2000)
+	listed = timeit.timeit(lambda: slack_formatters.make_services_list(services), number=number) / number
+	print("{} services list:            {:8.2f} ms".format(len(services), listed * 1e3))
+
+	incident = make_incident()
+	attachments = timeit.timeit(lambda: slack_formatters.make_incident_attachments(incident), number=10000) / 10000
+	print("make_incident_attachments:     {:8.2f} us".format(attachments * 1e6))
+
+	fast = timeit.timeit(lambda: [slack_formatters.parse_time(t) for t in timestamps], number=number) / number
+	print("parse_time for all timestamps: {:8.2f} ms".format(fast * 1e3))
+
+	try:
+		start = time.perf_counter()
+		import dateparser
+		print("import dateparser:             {:8.2f} ms".format((time.perf_counter() - start) * 1e3))
+		slow = timeit.timeit(lambda: [dateparser.parse(t) for t in timestamps], number=5) / 5
+		print("dateparser for all timestamps: {:8.2f} ms".format(slow * 1e3))
+	except ImportError:
+		print("dateparser not installed, skipping comparison")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,300 @@
+# End-to-end load benchmark: runs the app against local stand-ins for the PD
+# API, the Slack Web API/response_url and Mongo, replays Slack payloads
+# against /slack_event, /slack_action, /slack_load_options and /slack_command,
+# and reports latency, throughput, outbound calls per interaction and thread
+# counts. Run from the repo root:
+#
+#   python bench/load_bench.py --requests 2000 --concurrency 16 --pd-latency 0.05
+#
+# Uses mongomock for the Team collection unless --mongo URI is given
+# (pip install -r requirements-dev.txt).
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import requests
+
+SUBDOMAIN = "bench"
+
+
+class FakeServer:
+	# ThreadingHTTPServer that counts requests per route and adds latency
+
+	def __init__(self, name, handler, latency):
+		self.name = name
+		self.calls = Counter()
+		self.lock = threading.Lock()
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = "HTTP/1.1"
+
+			def respond(self, method):
+				length = int(self.headers.get("Content-Length") or 0)
+				body = self.rfile.read(length) if length else b""
+				url = urlparse(self.path)
+				(status, payload, route) = handler(method, url.path, parse_qs(url.query), body)
+				with server.lock:
+					server.calls[route] += 1
+				if latency:
+					time.sleep(latency)
+				data = json.dumps(payload).encode()
+				self.send_response(status)
+				self.send_header("Content-Type", "application/json")
+				self.send_header("Content-Length", str(len(data)))
+				self.end_headers()
+				self.wfile.write(data)
+
+			def do_GET(self):
+				self.respond("GET")
+
+			def do_POST(self):
+				self.respond("POST")
+
+			def do_PUT(self):
+				self.respond("PUT")
+
+			def log_message(self, *args):
+				pass
+
+		self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		self.httpd.daemon_threads = True
+		self.url = "http://127.0.0.1:{}".format(self.httpd.server_port)
+		threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+	def total(self):
+		with self.lock:
+			return sum(self.calls.values())
+
+
+def make_pd_handler(services, incidents):
+	html = "https://{}.pagerduty.com".format(SUBDOMAIN)
+
+	def page(key, objects, query):
+		offset = int(query.get("offset", [0])[0])
+		limit = int(query.get("limit", [25])[0])
+		if "query" in query:
+			objects = [o for o in objects if query["query"][0].lower() in o["summary"].lower()]
+		return {key: objects[offset:offset + limit], "limit": limit, "offset": offset, "total": len(objects), "more": offset + limit < len(objects)}
+
+	def handler(method, path, query, body):
+		parts = path.strip("/").split("/")
+		route = "{} {}".format(method, parts[0] + ("/{id}" if len(parts) > 1 else ""))
+		if parts[0] == "users" and parts[1:] == ["me"]:
+			return (200, {"user": {"id": "PUSER", "email": "bench@example.com", "name": "Bench", "html_url": html + "/users/PUSER"}}, route)
+		if parts[0] == "services" and len(parts) == 1:
+			return (200, page("services", services, query), route)
+		if parts[0] == "services":
+			return (200, {"service": services[int(parts[1][1:])]}, route)
+		if parts[0] == "escalation_policies":
+			return (200, {"escalation_policy": {"id": parts[1], "summary": "EP", "html_url": html + "/escalation_policies/" + parts[1], "num_loops": 0, "escalation_rules": []}}, route)
+		if parts[0] == "incidents" and method == "PUT":
+			updates = json.loads(body.decode())["incidents"]
+			return (200, {"incidents": [dict(incidents[int(u["id"][1:])], status=u["status"]) for u in updates]}, route)
+		if parts[0] == "incidents" and len(parts) == 1:
+			return (200, page("incidents", incidents, query), route)
+		if parts[0] == "incidents":
+			return (200, {"incident": incidents[int(parts[1][1:])]}, route)
+		if parts[0] == "log_entries":
+			return (200, page("log_entries", [], query), route)
+		return (404, {"error": {"message": "not in the fake"}}, route)
+
+	return handler
+
+
+def slack_handler(method, path, query, body):
+	if path.startswith("/api/"):
+		return (200, {"ok": True}, "POST " + path)
+	return (200, {}, "POST response_url")
+
+
+class Load:
+
+	def __init__(self, app_url, slack_url, seed, channels):
+		self.app_url = app_url
+		self.slack_url = slack_url
+		self.seed = seed
+		self.channels = channels
+		self.session = requests.Session()
+		self.session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=64))
+
+	def post(self, path, data=None, json_body=None):
+		if json_body is not None:
+			body = json.dumps(json_body)
+			headers = {"Content-Type": "application/json"}
+		else:
+			body = urlencode(data)
+			headers = {"Content-Type": "application/x-www-form-urlencoded"}
+		start = time.perf_counter()
+		r = self.session.post(self.app_url + path, data=body, headers=headers)
+		return (time.perf_counter() - start, r.status_code)
+
+	def interaction(self, i):
+		kind = ("slack_event", "slack_action", "slack_load_options", "slack_command")[i % 4]
+		response_url = "{}/hooks/{}".format(self.slack_url, i)
+		channel = "C{}".format(i % self.channels)
+		if kind == "slack_event":
+			return (kind,) + self.post("/slack_event", json_body={
+				"team_id": "TBENCH",
+				"event_id": "Ev{}-{}".format(self.seed, i),
+				"event": {"type": "app_mention", "user": "UBENCH", "channel": channel, "text": "<@UBOT> services crit"}
+			})
+		if kind == "slack_action":
+			return (kind,) + self.post("/slack_action", data={"payload": json.dumps({
+				"type": "interactive_message",
+				"team": {"id": "TBENCH"},
+				"user": {"id": "UBENCH", "name": "bench"},
+				"channel": {"id": channel},
+				"callback_id": "incidents",
+				"action_ts": "{}.{}".format(self.seed, i),
+				"response_url": response_url,
+				"actions": [{"name": "acknowledge", "value": "I{}".format(i % 50)}]
+			})})
+		if kind == "slack_load_options":
+			return (kind,) + self.post("/slack_load_options", data={"payload": json.dumps({
+				"team": {"id": "TBENCH"},
+				"user": {"id": "UBENCH"},
+				"callback_id": "services",
+				"name": "services",
+				"value": "svc 1"
+			})})
+		return (kind,) + self.post("/slack_command", data={
+			"command": "/services",
+			"text": "crit",
+			"team_id": "TBENCH",
+			"user_id": "UBENCH",
+			"channel_id": channel,
+			"response_url": response_url,
+			"trigger_id": "trig{}".format(i)
+		})
+
+
+def percentile(values, p):
+	values = sorted(values)
+	if not values:
+		return 0
+	return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--requests", type=int, default=1000)
+	parser.add_argument("--concurrency", type=int, default=8)
+	parser.add_argument("--services", type=int, default=500)
+	parser.add_argument("--incidents", type=int, default=200)
+	parser.add_argument("--pd-latency", type=float, default=0.02)
+	parser.add_argument("--slack-latency", type=float, default=0.01)
+	parser.add_argument("--channels", type=int, default=50, help="Slack channels the interactions are spread over; Slack allows about one message per second in each")
+	parser.add_argument("--mongo", help="Mongo URI to use instead of mongomock")
+	args = parser.parse_args()
+
+	html = "https://{}.pagerduty.com".format(SUBDOMAIN)
+	services = [{"id": "S{}".format(i), "type": "service", "name": "svc {}".format(i), "summary": "svc {}".format(i), "html_url": "{}/services/S{}".format(html, i), "status": ("active", "warning", "critical")[i % 3], "escalation_policy": {"id": "PEP", "summary": "EP", "html_url": html + "/escalation_policies/PEP"}} for i in range(args.services)]
+	incidents = [{"id": "I{}".format(i), "incident_number": i + 1, "title": "incident {}".format(i), "summary": "incident {}".format(i), "status": "triggered", "html_url": "{}/incidents/I{}".format(html, i), "created_at": "2018-06-01T09:00:00Z", "service": services[i % len(services)], "assignments": []} for i in range(args.incidents)]
+
+	pd_server = FakeServer("pd", make_pd_handler(services, incidents), args.pd_latency)
+	slack_server = FakeServer("slack", slack_handler, args.slack_latency)
+
+	os.environ["SLACK_API_URL"] = slack_server.url + "/api"
+	import mongoengine
+	if args.mongo:
+		connect = mongoengine.connect
+		mongoengine.connect = lambda *a, **k: connect("pymartbot-bench", host=args.mongo)
+	else:
+		import mongomock
+		connect = mongoengine.connect
+		mongoengine.connect = lambda *a, **k: connect("pymartbot-bench", host="mongodb://localhost", mongo_client_class=mongomock.MongoClient)
+
+	import pd
+	import app
+	pd.BASE_URL = pd_server.url
+
+	app.Team.objects(slack_team_id="TBENCH").delete()
+	app.Team(slack_team_id="TBENCH", slack_app_token="xoxp-bench", slack_bot_token="xoxb-bench", slack_bot_userid="UBOT").save()
+	app.upsert_user_mapping("TBENCH", "UBENCH", "PUSER", "pd-bench", SUBDOMAIN, "bench@example.com", "Bench")
+
+	import logging
+	from werkzeug.serving import make_server
+	logging.getLogger("werkzeug").setLevel(logging.ERROR)
+	httpd = make_server("127.0.0.1", 0, app.app, threaded=True)
+	threading.Thread(target=httpd.serve_forever, daemon=True).start()
+	app_url = "http://127.0.0.1:{}".format(httpd.server_port)
+
+	load = Load(app_url, slack_server.url, int(time.time()), args.channels)
+	# warm-up, so connection pools and caches are in the state a running dyno has
+	for i in range(8):
+		load.interaction(args.requests + i)
+	drain(app)
+	pd_before = pd_server.total()
+	slack_before = slack_server.total()
+	pd_server.calls.clear()
+	slack_server.calls.clear()
+
+	latencies = {}
+	statuses = Counter()
+	threads_max = [threading.active_count()]
+	done = threading.Event()
+
+	def sample_threads():
+		while not done.is_set():
+			threads_max[0] = max(threads_max[0], threading.active_count())
+			time.sleep(0.01)
+
+	threading.Thread(target=sample_threads, daemon=True).start()
+	start = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+		for (kind, latency, status) in executor.map(load.interaction, range(args.requests)):
+			latencies.setdefault(kind, []).append(latency)
+			statuses[status] += 1
+	acked = time.perf_counter() - start
+	drain(app)
+	finished = time.perf_counter() - start
+	done.set()
+
+	print("{} interactions, concurrency {}, PD latency {:.0f} ms, Slack latency {:.0f} ms".format(args.requests, args.concurrency, args.pd_latency * 1e3, args.slack_latency * 1e3))
+	print("acked in {:.2f} s ({:.0f}/s), all work done in {:.2f} s ({:.0f}/s)".format(acked, args.requests / acked, finished, args.requests / finished))
+	print("HTTP statuses: {}".format(dict(statuses)))
+	print()
+	print("{:<20} {:>8} {:>10} {:>10} {:>10}".format("route", "count", "p50 ms", "p95 ms", "p99 ms"))
+	everything = []
+	for (kind, values) in sorted(latencies.items()):
+		everything.extend(values)
+		print("{:<20} {:>8} {:>10.1f} {:>10.1f} {:>10.1f}".format(kind, len(values), percentile(values, 50) * 1e3, percentile(values, 95) * 1e3, percentile(values, 99) * 1e3))
+	print("{:<20} {:>8} {:>10.1f} {:>10.1f} {:>10.1f}".format("all", len(everything), percentile(everything, 50) * 1e3, percentile(everything, 95) * 1e3, percentile(everything, 99) * 1e3))
+	print()
+	print("outbound calls per interaction: PD {:.2f}, Slack {:.2f}".format(pd_server.total() / args.requests, slack_server.total() / args.requests))
+	for (server, calls) in (("PD", pd_server.calls), ("Slack", slack_server.calls)):
+		for (route, count) in calls.most_common():
+			print("\t{:<6} {:<32} {:>8}".format(server, route, count))
+	print()
+	print("threads: max {} during the run, {} now".format(threads_max[0], threading.active_count()))
+	print("worker pool: {}".format(json.dumps(app.pool.stats())))
+
+
+def idle(app):
+	stats = app.pool.stats()
+	outbox = app.slack.outbox.stats()
+	return stats["queue_depth"] == 0 and stats["active"] == 0 and outbox["queued"] == 0 and outbox["inflight"] == 0
+
+def drain(app, timeout=60):
+	deadline = time.time() + timeout
+	while time.time() < deadline:
+		if idle(app):
+			time.sleep(0.1)
+			if idle(app):
+				return
+		time.sleep(0.02)
+
+
+if __name__ == '__main__':
+	main()
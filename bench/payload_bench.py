@@ -0,0 +1,77 @@
+# Measures time and allocations for wrapping a large interactive message
+# payload and reading the fields a command handler reads, with the lazy
+# payload view and (if installed) DotMap for comparison. Run from the repo
+# root:
+#
+#   python bench/payload_bench.py
+#
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payload import Payload
+
+
+def make_payload(attachments):
+	# an interactive message action carrying the original message, as Slack
+	# sends it after someone picks an incident from a long picker
+	return {
+		"type": "interactive_message",
+		"callback_id": "incidents",
+		"team": {"id": "T1", "domain": "acme"},
+		"user": {"id": "U1", "name": "someone"},
+		"channel": {"id": "C1", "name": "ops"},
+		"action_ts": "1530000000.000001",
+		"message_ts": "1530000000.000000",
+		"trigger_id": "1234.5678.abcdef",
+		"response_url": "https://hooks.slack.com/actions/T1/1/abc",
+		"actions": [{"name": "incidents", "type": "select", "selected_options": [{"value": "PABC123"}]}],
+		"original_message": {
+			"type": "message",
+			"text": "",
+			"attachments": [{
+				"id": i,
+				"text": "*<https://acme.pagerduty.com/incidents/P{0}|[#{0}]>* Something broke".format(i),
+				"color": "25c151",
+				"fields": [{"title": "Status", "value": "Triggered", "short": True}, {"title": "Service", "value": "<https://acme.pagerduty.com/services/S1|Web>", "short": True}],
+				"actions": [{"id": str(j), "name": name, "text": name.title(), "type": "button", "value": "P{}".format(i)} for j, name in enumerate(("acknowledge", "resolve", "annotate"))]
+			} for i in range(attachments)]
+		}
+	}
+
+
+def handle(req):
+	# the reads app.slack_action and Incidents.slack_action make
+	return (req.team.id, req.user.id, req.callback_id, req.type, req.trigger_id or req.action_ts,
+		req.actions[0].name, req.actions[0].selected_options[0].value, req.response_url, req.submission.note)
+
+
+def measure(name, wrap, body, number):
+	# time includes json.loads; allocations are only those made wrapping and reading
+	seconds = timeit.timeit(lambda: handle(wrap(json.loads(body))), number=number) / number
+	parsed = json.loads(body)
+	tracemalloc.start()
+	handle(wrap(parsed))
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	print("{:8} {:9.3f} ms/request  {:9.1f} KiB peak allocated".format(name, seconds * 1e3, peak / 1024))
+
+
+def main():
+	for attachments in (10, 100, 500):
+		body = json.dumps(make_payload(attachments))
+		print("{} attachments, {:.0f} KiB payload".format(attachments, len(body) / 1024))
+		measure("Payload", Payload, body, 50)
+		try:
+			from dotmap import DotMap
+			measure("DotMap", DotMap, body, 50)
+		except ImportError:
+			print("dotmap not installed, skipping comparison")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,50 @@
+# Reports how long importing the app takes, which modules the time goes to,
+# and what each command's first dispatch costs now that handler modules are
+# imported lazily. Run from the repo root:
+#
+#   python bench/startup_bench.py [top]
+#
+import os
+import subprocess
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(statement):
+	# python -X importtime writes "import time: self | cumulative | module" to stderr
+	start = time.perf_counter()
+	result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], cwd=root, stderr=subprocess.PIPE, universal_newlines=True)
+	wall = time.perf_counter() - start
+	times = []
+	for line in result.stderr.splitlines():
+		if not line.startswith("import time:") or "[us]" in line:
+			continue
+		(self_us, cumulative_us, module) = line[len("import time:"):].split("|")
+		# nested imports are indented under the module that imported them
+		times.append((int(cumulative_us), int(self_us), module[1:].rstrip()))
+	if result.returncode:
+		print(result.stderr)
+	return (wall, times)
+
+
+def main():
+	top = int(sys.argv[1]) if len(sys.argv) > 1 else 15
+
+	(wall, times) = import_times("import app")
+	top_level = [t for t in times if not t[2].startswith(" ")]
+	print("import app: {:.0f} ms wall, {:.0f} ms importing".format(wall * 1e3, sum(t[0] for t in top_level) / 1e3))
+	print()
+	print("{:>10} {:>10}  {}".format("cum (ms)", "self (ms)", "module"))
+	for (cumulative_us, self_us, module) in sorted(times, reverse=True)[:top]:
+		print("{:>10.1f} {:>10.1f}  {}".format(cumulative_us / 1e3, self_us / 1e3, module.strip()))
+
+	print()
+	print("first dispatch (imports the handler module):")
+	statement = "import time, app\nfor c in app.commands:\n\tstart = time.perf_counter(); c.command\n\tprint('{:>10.1f}  {}'.format((time.perf_counter() - start) * 1e3, c.name))"
+	subprocess.run([sys.executable, "-c", statement], cwd=root)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,54 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+	# thread-safe LRU with per-entry expiry
+
+	def __init__(self, maxsize=1024, ttl=300):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self._data = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key, default=None, refresh=False):
+		# with refresh, a hit starts the entry's default ttl over
+		with self._lock:
+			entry = self._data.get(key)
+			if entry is None:
+				return default
+			value, expires = entry
+			now = time.monotonic()
+			if expires < now:
+				del self._data[key]
+				return default
+			if refresh:
+				self._data[key] = (value, now + self.ttl)
+			self._data.move_to_end(key)
+			return value
+
+	def set(self, key, value, ttl=None):
+		expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+		with self._lock:
+			self._data[key] = (value, expires)
+			self._data.move_to_end(key)
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+
+	def delete(self, key):
+		with self._lock:
+			self._data.pop(key, None)
+
+	def clear(self):
+		with self._lock:
+			self._data.clear()
+
+	def __contains__(self, key):
+		return self.get(key, _MISSING) is not _MISSING
+
+	def __len__(self):
+		return len(self._data)
+
+
+_MISSING = object()
@@ -1,17 +1,32 @@
 import re
 import abc
-from dotmap import DotMap
-from slackclient import SlackClient
+
+import pd
 
 class Command:
+	# with defer_slash_command set, slack_command returns the response body
+	# (or None) instead of posting it, and the app either answers with it
+	# inline or acks straight away and posts it to response_url when ready.
+	# slash_command_working_text is shown while the user waits, if set
+	defer_slash_command = False
+	slash_command_working_text = None
 
 	def __init__(self):
 		self.name = "command base class"
 		self.patterns = []
+		# breaks ties when more than one command's patterns match the same text
+		self.priority = 0
 
 	def get_name(self):
 		return self.name
 
+	def pd_identity(self, user):
+		# the mapped PD user (email, name) without a users/me round trip in the usual case
+		fallback = None
+		if user.pd_email:
+			fallback = {"id": user.pd_userid, "email": user.pd_email, "name": user.pd_name}
+		return pd.me(user["pd_token"], fallback=fallback)
+
 	def slack_escape(self, str):
 		return str.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
 
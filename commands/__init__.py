@@ -1,3 +1,57 @@
 import re
-from os import listdir
-__all__ = [re.sub(r"\.py", "", name) for name in listdir('commands') if name.endswith('.py') and not name.startswith('__')]
+import threading
+from importlib import import_module
+
+# Every command and what the dispatcher needs to route to it. The handler
+# module is only imported the first time one of its commands is dispatched,
+# so adding a command means adding it here as well as in its own module.
+COMMANDS = [
+	{"module": "bulk", "class": "Bulk", "name": "bulk", "patterns": [r"^ack\b", r"^acknowledge\b", r"^resolve\b", r"^mbbulk"]},
+	{"module": "domain", "class": "Domain", "name": "domain", "patterns": [r"^domain", r"mbdomain"]},
+	{"module": "escalation_policies", "class": "Escalation_Policies", "name": "eps", "patterns": [r"^eps", r"^escal", r"^mbeps"]},
+	{"module": "incidents", "class": "Incidents", "name": "incidents", "patterns": [r"^incidents", r"^mbincidents"]},
+	{"module": "oncall", "class": "Oncall", "name": "oncall", "patterns": [r"^oncall", r"^on[- ]call\b", r"^who'?s on[- ]?call", r"^who is on[- ]?call", r"^mboncall"]},
+	{"module": "services", "class": "Services", "name": "services", "patterns": [r"^services", r"^mbserv"]},
+	{"module": "trigger", "class": "Trigger", "name": "trigger", "patterns": [r"^trig", r"^page", r"^mbtrigger"]},
+	{"module": "whoami", "class": "Whoami", "name": "whoami", "patterns": [r"^whoami", r"who am i"]}
+]
+
+__all__ = [spec["module"] for spec in COMMANDS]
+
+_specs = {spec["name"]: spec for spec in COMMANDS}
+
+
+def command_patterns(name):
+	return [re.compile(p) for p in _specs[name]["patterns"]]
+
+
+class LazyCommand:
+	# stands in for a Command until one of its handlers is needed
+
+	def __init__(self, spec):
+		self.spec = spec
+		self.name = spec["name"]
+		self.patterns = [re.compile(p) for p in spec["patterns"]]
+		self.priority = spec.get("priority", 0)
+		self._command = None
+		self._lock = threading.Lock()
+
+	@property
+	def command(self):
+		if self._command is None:
+			with self._lock:
+				if self._command is None:
+					module = import_module("commands.{}".format(self.spec["module"]))
+					self._command = getattr(module, self.spec["class"])()
+		return self._command
+
+	def matches(self, message_text):
+		return self.command.matches(message_text)
+
+	def __getattr__(self, attr):
+		# only called for attributes not set above, i.e. the handlers
+		return getattr(self.command, attr)
+
+
+def lazy_commands():
+	return [LazyCommand(spec) for spec in COMMANDS]
@@ -0,0 +1,123 @@
+import os
+import re
+import asyncio
+
+import pd
+import pd_aio
+import slack
+import open_incidents
+import service_status
+from command import Command
+from commands import command_patterns
+
+CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 100))
+CONCURRENCY = int(os.environ.get('BULK_CONCURRENCY', 4))
+
+usage = "Try `ack all mine`, `resolve all mine` or `ack all on service <service name>`"
+
+class Bulk(Command):
+
+	defer_slash_command = True
+	slash_command_working_text = "Working on it..."
+
+	def __init__(self):
+		self.name = "bulk"
+		self.patterns = command_patterns("bulk")
+
+	def parse(self, text):
+		# returns (status, scope, service name) or None
+		m = re.search(r"^(ack|acknowledge|resolve)\b(?: all)?\s*(mine|on service (.+)|service (.+))?\s*$", text.strip())
+		if not m or not m.group(2):
+			return None
+		status = "resolved" if m.group(1) == "resolve" else "acknowledged"
+		if m.group(2) == "mine":
+			return (status, "mine", None)
+		return (status, "service", (m.group(3) or m.group(4)).strip())
+
+	def find_service(self, user, name):
+		name = name.lower()
+		services = service_status.services(user)
+		if services is None:
+			# the store is still loading, ask PD instead
+			services = pd.fetch_services(oauth_token=user["pd_token"], params={"query": name})
+		exact = [service for service in services if (service["summary"] or "").lower() == name]
+		if exact:
+			return exact[0]
+		partial = [service for service in services if name in (service["summary"] or "").lower()]
+		return partial[0] if len(partial) == 1 else None
+
+	async def update_chunks(self, user, email, incident_ids, status):
+		semaphore = asyncio.Semaphore(CONCURRENCY)
+
+		async def update(chunk):
+			async with semaphore:
+				return await pd_aio.request(
+					oauth_token=user["pd_token"],
+					endpoint="incidents",
+					method="PUT",
+					addheaders={"From": email},
+					data={"incidents": [{"id": id, "type": "incident_reference", "status": status} for id in chunk]}
+				)
+
+		chunks = [incident_ids[i:i + CHUNK_SIZE] for i in range(0, len(incident_ids), CHUNK_SIZE)]
+		return await asyncio.gather(*[update(chunk) for chunk in chunks], return_exceptions=True)
+
+	def run(self, user, text):
+		parsed = self.parse(text)
+		if not parsed:
+			return usage
+		(status, scope, service_name) = parsed
+
+		# acknowledging only makes sense for triggered incidents
+		params = {"statuses[]": ["triggered"] if status == "acknowledged" else ["triggered", "acknowledged"]}
+		where = "assigned to you"
+		if scope == "mine":
+			params["user_ids[]"] = [user["pd_userid"]]
+		else:
+			service = self.find_service(user, service_name)
+			if not service:
+				return "Couldn't find a single service matching *{}* in domain *{}*".format(self.slack_escape(service_name), user["pd_subdomain"])
+			params["service_ids[]"] = [service["id"]]
+			where = "on service <{}|{}>".format(service["html_url"], service["summary"])
+
+		incident_ids = [incident["id"] for incident in pd.iter_fetch(oauth_token=user["pd_token"], endpoint="incidents", params=params)]
+		verb = "Resolved" if status == "resolved" else "Acknowledged"
+		if not incident_ids:
+			return "No incidents to {} {} in domain *{}*".format("resolve" if status == "resolved" else "acknowledge", where, user["pd_subdomain"])
+
+		results = pd_aio.run(self.update_chunks(user, self.pd_identity(user)["email"], incident_ids, status))
+		updated = 0
+		failed = 0
+		view = open_incidents.view(user)
+		for (i, r) in enumerate(results):
+			chunk_size = len(incident_ids[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE])
+			if isinstance(r, Exception):
+				print("bulk update failed: {}".format(r))
+				failed += chunk_size
+				continue
+			for incident in r.get("incidents", []):
+				view.apply(incident)
+			updated += len(r.get("incidents", []))
+			failed += chunk_size - len(r.get("incidents", []))
+
+		response = ":white_check_mark: {} {} incident{} {} in domain *{}*".format(verb, updated, "" if updated == 1 else "s", where, user["pd_subdomain"])
+		if failed:
+			response += "\n:warning: {} could not be updated".format(failed)
+		return response
+
+	def slack_event(self, team, user, req):
+		sc = slack.client(team["slack_bot_token"])
+		message_text = re.sub(r"^<[^\s]+> ", "", req.event.text or req.event.message.text)
+		sc.send("chat.postMessage",
+			channel=req.event.channel,
+			text=self.run(user, message_text)
+		)
+
+	def slack_command(self, team, user, form):
+		# /ack all mine, /resolve on service foo
+		command_text = "{} {}".format(re.sub(r"^/", "", form.get('command')), form.get('text') or "")
+		command_text = re.sub(r"^mbbulk\s*", "", command_text)
+		return {
+			"response_type": "in_channel",
+			"text": self.run(user, command_text)
+		}
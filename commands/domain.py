@@ -1,30 +1,30 @@
 import os
 import re
-import requests
-from dotmap import DotMap
-from slackclient import SlackClient
-from app import url_for
+from flask import url_for
 
-import pd
+import slack
 from command import Command
+from commands import command_patterns
 
 class Domain(Command):
 
+	defer_slash_command = True
+
 	def __init__(self):
 		self.name = "domain"
-		self.patterns = [re.compile(p) for p in [r"^domain", r"mbdomain"]]
+		self.patterns = command_patterns("domain")
 
 	def slack_event(self, team, user, req):
-		me = DotMap(pd.request(oauth_token=user["pd_token"], endpoint="users/me"))
-		sc = SlackClient(team["slack_bot_token"])
+		me = self.pd_identity(user)
+		sc = slack.client(team["slack_bot_token"])
 
 		slack_team_id = team["slack_team_id"]
 		slack_userid = user["slack_userid"]
 		host = os.environ['SERVER_NAME'] or "localhost"
 
-		sc.api_call("chat.postEphemeral",
+		sc.send("chat.postEphemeral",
 			channel=req.event.channel,
-			text="You're currently logged in to subdomain *{}* as *{}*".format(user["pd_subdomain"], me.user.email),
+			text="You're currently logged in to subdomain *{}* as *{}*".format(user["pd_subdomain"], me["email"]),
 			attachments=[{
 				"text": "",
 				"color": "#25c151",
@@ -39,15 +39,14 @@ class Domain(Command):
 		)
 
 	def slack_command(self, team, user, form):
-		me = DotMap(pd.request(oauth_token=user["pd_token"], endpoint="users/me"))
+		me = self.pd_identity(user)
 
-		response_url = form.get('response_url')
 		slack_team_id = team["slack_team_id"]
 		slack_userid = user["slack_userid"]
 
 		slack_response = {
 			"response_type": "ephemeral",
-			"text": "You're currently logged in to subdomain *{}* as *{}*".format(user["pd_subdomain"], me.user.email),
+			"text": "You're currently logged in to subdomain *{}* as *{}*".format(user["pd_subdomain"], me["email"]),
 			"attachments": [{
 				"text": "",
 				"color": "#25c151",
@@ -59,9 +58,4 @@ class Domain(Command):
 				}]
 			}]
 		}
-		requests.post(response_url,
-			json=slack_response,
-			headers={'Content-type': 'application/json'}
-		)
-
-		return ('', 200)
+		return slack_response
@@ -1,28 +1,31 @@
 import os
 import re
 import json
-import requests
-from dotmap import DotMap
-from slackclient import SlackClient
 
 import pd
+import slack
+import oncall_index
 import slack_formatters
+import typeahead
 from command import Command
+from commands import command_patterns
 
 class Escalation_Policies(Command):
 
+	defer_slash_command = True
+
 	def __init__(self):
 		self.name = "eps"
-		self.patterns = [re.compile(p) for p in [r"^eps", r"^escal", r"^mbeps"]]
+		self.patterns = command_patterns("eps")
 
 	def slack_event(self, team, user, req):
-		sc = SlackClient(team["slack_bot_token"])
+		sc = slack.client(team["slack_bot_token"])
 
 		message_text = req.event.text or req.event.message.text
 
-		eps = [{"text": ep["summary"], "value": ep["id"]} for ep in pd.fetch_escalation_policies(oauth_token=user["pd_token"])]
+		eps = [{"text": ep["summary"], "value": ep["id"]} for ep in pd.fetch_escalation_policies(oauth_token=user["pd_token"], cache_ttl=typeahead.refresh_intervals["escalation_policies"])]
 
-		sc.api_call("chat.postMessage",
+		sc.send("chat.postMessage",
 			channel=req.event.channel,
 			attachments=[{
 				"text": "Choose an escalation policy in domain {}".format(user["pd_subdomain"]),
@@ -41,35 +44,30 @@ class Escalation_Policies(Command):
 		ep_id = req.actions[0].selected_options[0].value
 		response_url = req.response_url
 
-		ep = pd.request(oauth_token=user.pd_token, endpoint="/escalation_policies/{}".format(ep_id), params={"include[]": "current_oncall"})
-		requests.post(response_url,
-			headers={
-				"Content-type": "application/json"
-			},
-			data=json.dumps({
-				"text": slack_formatters.make_ep_text(ep.get('escalation_policy')),
-				"color": "#25c151",
-				"replace_original": True
-			})
-		)
+		ep = oncall_index.escalation_policy(user["pd_subdomain"], user["pd_token"], ep_id)
+		slack.send_response(response_url, {
+			"text": slack_formatters.make_ep_text(ep),
+			"color": "#25c151",
+			"replace_original": True
+		}, channel=req.channel.id)
 
 	def slack_load_options(self, team, user, req):
 		endpoint = "escalation_policies"
 		query = req.value
-		r = pd.request(oauth_token=user["pd_token"], endpoint=endpoint, params={"query": query})
+		matches = typeahead.search(user, endpoint, query)
+		if matches is None:
+			matches = pd.request(oauth_token=user["pd_token"], endpoint=endpoint, params={"query": query, "limit": typeahead.OPTIONS_LIMIT})[endpoint]
 
 		# Slack dialogs expect "label", interactive message select menus expect "text" :-\
-		options_list = [{"text": elem["name"], "label": elem["name"], "value": elem["id"]} for elem in r[endpoint]]
+		options_list = [{"text": elem["name"], "label": elem["name"], "value": elem["id"]} for elem in matches]
 		if len(options_list) == 0:
 			options_list.append({"text": "Nothing found.", "value": "nothing"})
-		elif len(options_list) == 25:
-			options_list.insert(0, {"text": "(> 25 found, please type more letters.)", "value": "nothing"})
+		elif len(options_list) == typeahead.OPTIONS_LIMIT:
+			options_list.insert(0, {"text": "(> {} found, please type more letters.)".format(typeahead.OPTIONS_LIMIT), "value": "nothing"})
 		return json.dumps({"options": options_list})
 
 
 	def slack_command(self, team, user, form):
-		response_url = form.get('response_url')
-
 		slack_response = {
 			"response_type": "ephemeral",
 			"text": "",
@@ -86,9 +84,4 @@ class Escalation_Policies(Command):
 				}]
 			}]
 		}
-		requests.post(response_url,
-			json=slack_response,
-			headers={'Content-type': 'application/json'}
-		)
-
-		return ('', 200)
+		return slack_response
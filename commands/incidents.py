@@ -1,31 +1,37 @@
 import re
 import json
-import requests
-from dotmap import DotMap
-from slackclient import SlackClient
 
 import pd
+import slack
 import slack_formatters
+import open_incidents
 from command import Command
+from commands import command_patterns
 
 class Incidents(Command):
 
+	defer_slash_command = True
+
 	def __init__(self):
 		self.name = "incidents"
-		self.patterns = [re.compile(p) for p in [r"^incidents", r"^mbincidents"]]
+		self.patterns = command_patterns("incidents")
 		self.status_emoji = {
 			"acknowledged": ":warning:",
 			"triggered": ":octagonal_sign:",
 			"resolved": ":white_check_mark:"
 		}
 
-	def slack_event(self, team, user, req):
-		sc = SlackClient(team["slack_bot_token"])
-		attachments = [{
-			"text": "Choose an incident in domain *{}*:".format(user["pd_subdomain"]),
+	def picker_attachments(self, user, cursor=None):
+		text = "Choose an incident in domain *{}*:".format(user["pd_subdomain"])
+		callback_id = "incidents"
+		if cursor:
+			text = "Choose an incident older than #{} in domain *{}*:".format(cursor, user["pd_subdomain"])
+			callback_id = "incidents more:{}".format(cursor)
+		return [{
+			"text": text,
 			"color": "#25c151",
 			"attachment_type": "default",
-			"callback_id": "incidents",
+			"callback_id": callback_id,
 			"actions": [{
 				"name": "incidents",
 				"text": "Pick an incident",
@@ -34,37 +40,41 @@ class Incidents(Command):
 			}]
 		}]
 
-		sc.api_call("chat.postMessage",
+	def slack_event(self, team, user, req):
+		sc = slack.client(team["slack_bot_token"])
+		sc.send("chat.postMessage",
 			channel=req.event.channel,
 			text="",
-			attachments=attachments
+			attachments=self.picker_attachments(user)
 		)
 
 
 	def slack_action(self, team, user, req):
-		if req.actions[0].name == 'incidents':
+		if req.actions[0].name == 'incidents' and req.actions[0].selected_options[0].value.startswith("more:"):
+			cursor = int(req.actions[0].selected_options[0].value.split(":")[1])
+			slack.send_response(req.response_url, {
+				"text": "",
+				"attachments": self.picker_attachments(user, cursor),
+				"replace_original": True
+			}, channel=req.channel.id)
+
+		elif req.actions[0].name == 'incidents':
 			incident_id = req.actions[0].selected_options[0].value
 			response_url = req.response_url
 
 			incident = pd.request(oauth_token=user.pd_token, endpoint="/incidents/{}".format(incident_id))
 
-			r = requests.post(response_url,
-				headers={
-					"Content-type": "application/json"
-				},
-				json={
-					"text": "",
-					"attachments": slack_formatters.make_incident_attachments(incident.get('incident')),
-					"replace_original": True
-				}
-			)
+			slack.send_response(response_url, {
+				"text": "",
+				"attachments": slack_formatters.make_incident_attachments(incident.get('incident')),
+				"replace_original": True
+			}, channel=req.channel.id)
 
 		elif req.actions[0].name == 'acknowledge' or req.actions[0].name == 'resolve':
 			incident_id = req.actions[0].value
 			response_url = req.response_url
-			me = DotMap(pd.request(oauth_token=user["pd_token"], endpoint="users/me"))
 			headers = {
-				"From": me.user.email
+				"From": self.pd_identity(user)["email"]
 			}
 			body = {
 				"incidents": [
@@ -82,19 +92,14 @@ class Incidents(Command):
 				addheaders=headers,
 				data=body
 			)
-			r = requests.post(response_url,
-				headers={
-					"Content-type": "application/json"
-				},
-				json={
-					"text": "",
-					"attachments": slack_formatters.make_incident_attachments(incident.get('incidents')[0]),
-					"replace_original": True
-				}
-			)
+			slack.send_response(response_url, {
+				"text": "",
+				"attachments": slack_formatters.make_incident_attachments(incident.get('incidents')[0]),
+				"replace_original": True
+			}, channel=req.channel.id)
 		elif req.actions[0].name == 'annotate':
 			incident_id = req.actions[0].value
-			sc = SlackClient(team["slack_app_token"])
+			sc = slack.client(team["slack_app_token"])
 			trigger_id = req.trigger_id
 
 			call = sc.api_call("dialog.open",
@@ -115,10 +120,9 @@ class Incidents(Command):
 				}
 			)
 		elif req.submission.note:
-			me = DotMap(pd.request(oauth_token=user["pd_token"], endpoint="users/me"))
 			headers = {
 				"Content-type": "application/json",
-				"From": me.user.email
+				"From": self.pd_identity(user)["email"]
 			}
 			body = {
 				"note": {
@@ -128,53 +132,37 @@ class Incidents(Command):
 			incident_id = req.callback_id.split()[1]
 			incident = pd.request(
 				oauth_token=user["pd_token"],
-				endpoint="incidents/{}/notes",
+				endpoint="incidents/{}/notes".format(incident_id),
 				method="POST",
 				addheaders=headers,
 				data=body
 			)
 			print(incident)
 		else:
-			req.pprint()
+			print("incidents: nothing to do for {} from user {}".format(req.type, req.user.id))
 			
 
 
 	def slack_load_options(self, team, user, req):
-		endpoint = "incidents"
 		query = req.value
-		r = pd.request(oauth_token=user["pd_token"], endpoint=endpoint, params={"query": query, "statuses[]": ["triggered", "acknowledged"]})
+		cursor = re.search(r"more:(\d+)", req.callback_id or "")
+		page = open_incidents.page(user, query, int(cursor.groups()[0]) if cursor else None)
+		if page is None:
+			return json.dumps({"options": [{"text": open_incidents.loading_text, "label": open_incidents.loading_text, "value": "nothing"}]})
+		(matches, next_cursor) = page
 
 		# Slack dialogs expect "label", interactive message select menus expect "text" :-\
-		options_list = [{"text": elem["summary"], "label": elem["summary"], "value": elem["id"]} for elem in r[endpoint]]
+		options_list = [{"text": elem["summary"], "label": elem["summary"], "value": elem["id"]} for elem in matches]
 		if len(options_list) == 0:
 			options_list.append({"text": "Nothing found.", "value": "nothing"})
-		elif len(options_list) == 25:
-			options_list.append({"text": "See more incidents...", "value": "more:{}".format(0)})
+		elif next_cursor:
+			options_list.append({"text": "See more incidents...", "value": "more:{}".format(next_cursor)})
 		return json.dumps({"options": options_list})
 
 
 	def slack_command(self, team, user, form):
-		response_url = form.get('response_url')
-
-		slack_response = {
+		return {
 			"response_type": "ephemeral",
 			"text": "",
-			"attachments": [{
-				"text": "Choose an incident in domain *{}*:".format(user["pd_subdomain"]),
-				"color": "#25c151",
-				"attachment_type": "default",
-				"callback_id": "incidents",
-				"actions": [{
-					"name": "incidents",
-					"text": "Pick an incident",
-					"type": "select",
-					"data_source": "external"
-				}]
-			}]
+			"attachments": self.picker_attachments(user)
 		}
-		requests.post(response_url,
-			json=slack_response,
-			headers={'Content-type': 'application/json'}
-		)
-
-		return ('', 200)
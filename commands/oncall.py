@@ -0,0 +1,80 @@
+import re
+import time
+
+import slack
+import slack_formatters
+import oncall_index
+from command import Command
+from commands import command_patterns
+
+# EPs and schedules listed at most, so the message stays readable
+LIST_LIMIT = 20
+
+usage = "Try `oncall <escalation policy or schedule>`, `oncall <name> at <time>` or `oncall <name> until <time>`"
+
+class Oncall(Command):
+
+	defer_slash_command = True
+
+	def __init__(self):
+		self.name = "oncall"
+		self.patterns = command_patterns("oncall")
+
+	def parse(self, text):
+		# returns (query, at, until) with times as epoch seconds, or None
+		m = re.search(r"^(?:mb)?(?:who(?:'?s| is) )?on[- ]?call\b(?:\s+for\b)?\s*(.*?)(?:\s+(at|until)\s+(.+?))?\s*$", text.strip(), re.I)
+		if not m:
+			return None
+		query = m.group(1)
+		now = time.time()
+		if not m.group(2):
+			return (query, now, None)
+		try:
+			t = slack_formatters.parse_time(m.group(3)).timestamp()
+		except (ValueError, AttributeError):
+			return None
+		if m.group(2).lower() == "at":
+			return (query, t, None)
+		return (query, now, t)
+
+	def run(self, user, text):
+		parsed = self.parse(text)
+		if not parsed:
+			return usage
+		(query, at, until) = parsed
+		oncalls = oncall_index.index(user["pd_subdomain"], user["pd_token"])
+		if oncalls is None:
+			return "I'm still loading the on-call schedules for *{}*, please try again in a minute.".format(user["pd_subdomain"])
+
+		(eps, schedules) = oncalls.find(query)
+		if not eps and not schedules:
+			return "No escalation policy or schedule matching *{}* in domain *{}*".format(query, user["pd_subdomain"])
+		if len(eps) == 1 and not schedules and until is None:
+			return slack_formatters.make_ep_text(oncalls.escalation_policy(eps[0]["id"], at))
+
+		snapshot = oncalls.snapshot
+		if until is None:
+			schedule_shifts = [(schedule, [shift for shift in [snapshot.schedule_at(schedule["id"], at)] if shift]) for schedule in schedules[:LIST_LIMIT]]
+		else:
+			schedule_shifts = [(schedule, snapshot.schedule_between(schedule["id"], at, until)) for schedule in schedules[:LIST_LIMIT]]
+		response = "On call in domain *{}*:\n".format(user["pd_subdomain"])
+		response += slack_formatters.make_oncall_text([oncalls.escalation_policy(ep["id"], at) for ep in eps[:LIST_LIMIT]], schedule_shifts)
+		if len(eps) > LIST_LIMIT or len(schedules) > LIST_LIMIT:
+			response += "_...and more, add to the name to narrow it down_"
+		return response
+
+	def slack_event(self, team, user, req):
+		sc = slack.client(team["slack_bot_token"])
+		message_text = re.sub(r"^<[^\s]+> ", "", req.event.text or req.event.message.text)
+		sc.send("chat.postMessage",
+			channel=req.event.channel,
+			text=self.run(user, message_text)
+		)
+
+	def slack_command(self, team, user, form):
+		# /oncall database, /oncall database at tomorrow 9am
+		command_text = "oncall {}".format(form.get('text') or "")
+		return {
+			"response_type": "ephemeral",
+			"text": self.run(user, command_text)
+		}
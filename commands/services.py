@@ -1,22 +1,26 @@
 import os
 import re
 import json
-import requests
-from dotmap import DotMap
-from slackclient import SlackClient
 
 import pd
+import slack
+import service_status
 import slack_formatters
+import typeahead
 from command import Command
+from commands import command_patterns
 
 class Services(Command):
 
+	defer_slash_command = True
+	slash_command_working_text = "Looking up services..."
+
 	def __init__(self):
 		self.name = "services"
-		self.patterns = [re.compile(p) for p in [r"^services", r"^mbserv"]]
+		self.patterns = command_patterns("services")
 
 	def slack_event(self, team, user, req):
-		sc = SlackClient(team["slack_bot_token"])
+		sc = slack.client(team["slack_bot_token"])
 
 		message_text = req.event.text or req.event.message.text
 		search = re.search("^services( .*)$", message_text)
@@ -28,38 +32,50 @@ class Services(Command):
 			if re.search("^trig|^red|^crit", arg):
 				valid_arg = True
 				response = "Critical services in subdomain *{}*:\n".format(user["pd_subdomain"])
-				services = [service for service in pd.fetch_services(oauth_token=user["pd_token"]) if service.get("status") == "critical"]
-				for service in services:
-					response += "\t{} <{}|{}>\n".format(self.status_emoji.get(service.get("status")), service.get("html_url"), service.get("summary"))
+				services = service_status.services(user, ("critical",))
+				if services:
+					response += slack_formatters.make_services_list(services)
 			elif re.search("^ack|^orange|^amber|^warn", arg):
 				valid_arg = True
 				response = "Warning services in subdomain *{}*:\n".format(user["pd_subdomain"])
-				services = [service for service in pd.fetch_services(oauth_token=user["pd_token"]) if service.get("status") == "warning"]
-				for service in services:
-					response += "\t{} <{}|{}>\n".format(self.status_emoji.get(service.get("status")), service.get("html_url"), service.get("summary"))
+				services = service_status.services(user, ("warning",))
+				if services:
+					response += slack_formatters.make_services_list(services)
 			elif re.search("^all|list", arg):
 				valid_arg = True
 				response = "All services in subdomain *{}*:\n".format(user["pd_subdomain"])
-				services = pd.fetch_services(oauth_token=user["pd_token"])
-				for service in services:
-					response += "\t{} <{}|{}> ({})\n".format(self.status_emoji.get(service.get("status")), service.get("html_url"), service.get("summary"), service.get("status"))
+				services = service_status.services(user)
+				if services:
+					response += slack_formatters.make_services_list(services, show_status=True)
 
-			if services:
-				sc.api_call("chat.postMessage",
+			if valid_arg and services is None:
+				sc.send("chat.postMessage",
+					channel=req.event.channel,
+					text=service_status.loading_text.format(user["pd_subdomain"])
+				)
+			elif services:
+				sc.send("chat.postMessage",
 					channel=req.event.channel,
 					text=response
 				)
 			else:
-				sc.api_call("chat.postMessage",
+				sc.send("chat.postMessage",
 					channel=req.event.channel,
 					text="No services found for *{}*".format(message_text)
 				)
 			return
 
 
-		services = [{"text": service["summary"], "value": service["id"]} for service in pd.fetch_services(oauth_token=user["pd_token"])]
+		services = service_status.services(user)
+		if services is None:
+			sc.send("chat.postMessage",
+				channel=req.event.channel,
+				text=service_status.loading_text.format(user["pd_subdomain"])
+			)
+			return
+		services = [{"text": service["summary"], "value": service["id"]} for service in services]
 
-		sc.api_call("chat.postMessage",
+		sc.send("chat.postMessage",
 			channel=req.event.channel,
 			attachments=[{
 				"text": "Choose a service in domain {}".format(user["pd_subdomain"]),
@@ -85,51 +101,51 @@ class Services(Command):
 
 		service = pd.request(oauth_token=user.pd_token, endpoint="/services/{}".format(service_id))
 
-		r = requests.post(response_url,
-			headers={
-				"Content-type": "application/json"
-			},
-			json={
-				"text": slack_formatters.make_service_text(service.get('service'), expand_ep=expand_ep, pd_token=user["pd_token"]),
-				"replace_original": True
-			}
-		)
+		slack.send_response(response_url, {
+			"text": slack_formatters.make_service_text(service.get('service'), expand_ep=expand_ep, pd_token=user["pd_token"]),
+			"replace_original": True
+		}, channel=req.channel.id)
 
 	def slack_load_options(self, team, user, req):
 		endpoint = "services"
 		query = req.value
-		r = pd.request(oauth_token=user["pd_token"], endpoint=endpoint, params={"query": query})
+		matches = typeahead.search(user, endpoint, query)
+		if matches is None:
+			matches = pd.request(oauth_token=user["pd_token"], endpoint=endpoint, params={"query": query, "limit": typeahead.OPTIONS_LIMIT})[endpoint]
 
 		# Slack dialogs expect "label", interactive message select menus expect "text" :-\
-		options_list = [{"text": elem["summary"], "label": elem["summary"], "value": elem["id"]} for elem in r[endpoint]]
+		options_list = [{"text": elem["summary"], "label": elem["summary"], "value": elem["id"]} for elem in matches]
 		if len(options_list) == 0:
 			options_list.append({"text": "Nothing found.", "value": "nothing"})
-		elif len(options_list) == 25:
-			options_list.insert(0, {"text": "(> 25 found, please type more letters.)", "value": "nothing"})
+		elif len(options_list) == typeahead.OPTIONS_LIMIT:
+			options_list.insert(0, {"text": "(> {} found, please type more letters.)".format(typeahead.OPTIONS_LIMIT), "value": "nothing"})
 		return json.dumps({"options": options_list})
 
 
 	def slack_command(self, team, user, form):
-		response_url = form.get('response_url')
 		command_text = form.get('text')
 
 		if re.search(r"list|all|trig|red|crit|ack|orange|amber|warn|open", command_text):
-			services = pd.fetch_services(oauth_token=user["pd_token"])
 			if re.search(r"trig|red|crit", command_text):
 				response_text = "Critical services"
-				services = [service for service in services if service.get("status") == "critical"]
+				statuses = ("critical",)
 			elif re.search(r"ack|orange|amber|warn", command_text):
 				response_text = "Warning services"
-				services = [service for service in services if service.get("status") == "warning"]
+				statuses = ("warning",)
 			elif re.search(r"open", command_text):
 				response_text = "Services with open incidents"
-				services = [service for service in services if service.get("status") == "warning" or service.get("status") == "critical"]
+				statuses = ("warning", "critical")
 			else:
 				response_text = "All services"
+				statuses = None
+
+			services = service_status.services(user, statuses)
 
 			response_text += " in domain *{}*:\n".format(user["pd_subdomain"])
 
-			if services:
+			if services is None:
+				response_text = service_status.loading_text.format(user["pd_subdomain"])
+			elif services:
 				response_text += slack_formatters.make_services_list(services)
 			else:
 				response_text += "\tNo services found."
@@ -156,9 +172,4 @@ class Services(Command):
 				}]
 			}
 
-		requests.post(response_url,
-			json=slack_response,
-			headers={'Content-type': 'application/json'}
-		)
-
-		return ('', 200)
+		return slack_response
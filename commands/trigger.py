@@ -1,18 +1,18 @@
 import re
 import json
-import requests
-from dotmap import DotMap
-from slackclient import SlackClient
 
 import pd
+import slack
 import slack_formatters
+import typeahead
 from command import Command
+from commands import command_patterns
 
 class Trigger(Command):
 
 	def __init__(self):
 		self.name = "trigger"
-		self.patterns = [re.compile(p) for p in [r"^trig", r"^page", r"^mbtrigger"]]
+		self.patterns = command_patterns("trigger")
 
 	def slack_action(self, team, user, req):
 		if req.type == "dialog_submission":
@@ -52,21 +52,16 @@ class Trigger(Command):
 			)
 
 			response_url = req.response_url
-			requests.post(response_url,
-				headers={
-					"Content-type": "application/json"
-				},
-				json={
-					"text": "Created an incident in domain *{}*:".format(user["pd_subdomain"]),
-					"attachments": slack_formatters.make_incident_attachments(r.get('incident')),
-					"replace_original": True
-				}
-			)
+			slack.send_response(response_url, {
+				"text": "Created an incident in domain *{}*:".format(user["pd_subdomain"]),
+				"attachments": slack_formatters.make_incident_attachments(r.get('incident')),
+				"replace_original": True
+			}, channel=req.channel.id)
 		return('', 200)
 
 
 	def slack_load_options(self, team, user, req):
-		# req.pprint()
+		# print(req)
 		if req.name == "service":
 			endpoint = "services"
 		elif req.name == "user":
@@ -75,12 +70,14 @@ class Trigger(Command):
 			return('', 200)
 
 		query = req.value
-		r = pd.request(oauth_token=user["pd_token"], endpoint=endpoint, params={"query": query})
-		options_list = [{"text": elem["name"], "label": elem["name"], "value": elem["id"]} for elem in r[endpoint]]
+		matches = typeahead.search(user, endpoint, query)
+		if matches is None:
+			matches = pd.request(oauth_token=user["pd_token"], endpoint=endpoint, params={"query": query, "limit": typeahead.OPTIONS_LIMIT})[endpoint]
+		options_list = [{"text": elem["name"], "label": elem["name"], "value": elem["id"]} for elem in matches]
 		if len(options_list) == 0:
 			options_list.append({"label": "Nothing found.", "value": "nothing"})
-		elif len(options_list) == 25:
-			options_list.insert(0, {"label": "-- More than 25 results found!. Please type more letters. --", "value": "nothing"})
+		elif len(options_list) == typeahead.OPTIONS_LIMIT:
+			options_list.insert(0, {"label": "-- More than {} results found!. Please type more letters. --".format(typeahead.OPTIONS_LIMIT), "value": "nothing"})
 
 		return json.dumps({"options": options_list})
 
@@ -110,7 +107,7 @@ class Trigger(Command):
 			)
 
 	def slack_command(self, team, user, form):
-		sc = SlackClient(team["slack_app_token"])
+		sc = slack.client(team["slack_app_token"])
 		channel = form.get('channel_id')
 		trigger_id = form.get('trigger_id')
 
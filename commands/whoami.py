@@ -1,19 +1,18 @@
 import re
-from dotmap import DotMap
-from slackclient import SlackClient
 
-import pd
+import slack
 from command import Command
+from commands import command_patterns
 
 class Whoami(Command):
 	def __init__(self):
 		self.name = "whoami"
-		self.patterns = [re.compile(p) for p in [r"^whoami", r"who am i"]]
+		self.patterns = command_patterns("whoami")
 
 	def slack_event(self, team, user, req):
-		me = DotMap(pd.request(oauth_token=user["pd_token"], endpoint="users/me"))
-		sc = SlackClient(team["slack_bot_token"])
-		sc.api_call("chat.postMessage",
+		me = self.pd_identity(user)
+		sc = slack.client(team["slack_bot_token"])
+		sc.send("chat.postMessage",
 			channel=req.event.channel,
-			text="<@{}> is mapped to *{}* in domain *{}*".format(req.event.user, me.user.email, user["pd_subdomain"])
+			text="<@{}> is mapped to *{}* in domain *{}*".format(req.event.user, me["email"], user["pd_subdomain"])
 		)
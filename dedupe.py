@@ -0,0 +1,44 @@
+import datetime
+import os
+import threading
+from mongoengine import Document, StringField, DateTimeField, NotUniqueError
+
+from cache import TTLCache
+
+DEDUPE_TTL = int(os.environ.get('DEDUPE_TTL', 600))
+
+
+class ProcessedEvent(Document):
+	key = StringField(primary_key=True)
+	created_at = DateTimeField(default=datetime.datetime.utcnow)
+	meta = {
+		'indexes': [
+			{'fields': ['created_at'], 'expireAfterSeconds': DEDUPE_TTL}
+		]
+	}
+
+
+class SeenEvents:
+	# remembers event ids for ttl seconds so Slack's retries can be acked
+	# without dispatching again. With shared=True the ids also go to a Mongo
+	# TTL collection so that every gunicorn worker and dyno sees them.
+
+	def __init__(self, ttl=DEDUPE_TTL, maxsize=10000, shared=False):
+		self.shared = shared
+		self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+		self._lock = threading.Lock()
+
+	def seen(self, key):
+		# returns True if key was already seen, otherwise records it and returns False
+		if not key:
+			return False
+		with self._lock:
+			if key in self._local:
+				return True
+			self._local.set(key, True)
+		if self.shared:
+			try:
+				ProcessedEvent(key=key).save(force_insert=True)
+			except NotUniqueError:
+				return True
+		return False
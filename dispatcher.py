@@ -0,0 +1,144 @@
+import re
+
+mention_re = re.compile(r"^<[^\s]+> ")
+
+inline_flags = (
+	(re.IGNORECASE, "i"),
+	(re.MULTILINE, "m"),
+	(re.DOTALL, "s")
+)
+
+
+def has_top_level_alternation(pattern):
+	depth = 0
+	in_class = False
+	escaped = False
+	for c in pattern:
+		if escaped:
+			escaped = False
+		elif c == "\\":
+			escaped = True
+		elif in_class:
+			in_class = c != "]"
+		elif c == "[":
+			in_class = True
+		elif c == "(":
+			depth += 1
+		elif c == ")":
+			depth -= 1
+		elif c == "|" and depth == 0:
+			return True
+	return False
+
+def first_literal(pattern, flags):
+	# the character every match has to start with, if it's obvious
+	if has_top_level_alternation(pattern):
+		return None
+	if pattern and (pattern[0].isalnum() or pattern[0] in " _-") and not flags and (len(pattern) == 1 or pattern[1] not in "?*{"):
+		return pattern[0]
+	return None
+
+
+class Dispatcher:
+	# Folds every command's patterns into regexes built once at startup, so
+	# finding the command for a message is one or two regex calls instead of
+	# a loop over commands. The winner is the same as looping over commands
+	# by priority (higher first) and then name and taking the first whose
+	# patterns match, so it never depends on the order os.listdir saw
+	# modules in. Each combined regex is a match() at the start of the text
+	# with the alternatives in that order: anchored patterns as they are,
+	# floating ones prefixed with a lazy .*? so they can match anywhere.
+	# Regexes are bucketed by the first character anchored patterns need,
+	# and the floating alternatives are only included when a plain search()
+	# for them has found something.
+
+	def __init__(self, commands):
+		self.commands = sorted(commands, key=lambda command: (-getattr(command, "priority", 0), command.name))
+		self._groups = {}
+		self._patterns = []
+		# (first character or None, floating, alternative) in command order
+		alternatives = []
+		floating = []
+		for i, command in enumerate(self.commands):
+			patterns = [re.compile(pattern) if isinstance(pattern, str) else pattern for pattern in command.patterns]
+			self._patterns.append(patterns)
+			for j, pattern in enumerate(patterns):
+				group = "c{}_{}".format(i, j)
+				self._groups[group] = i
+				flags = "".join(letter for (flag, letter) in inline_flags if pattern.flags & flag)
+				source = pattern.pattern
+				if source.startswith("^") and not has_top_level_alternation(source):
+					source = source[1:]
+					alternatives.append((first_literal(source, flags), False, self._alternative(group, source, flags)))
+				else:
+					alternatives.append((None, True, self._alternative(group, source, flags, floating=True)))
+					floating.append((first_literal(source, flags), self._scoped(source, flags)))
+
+		# one regex per first character anchored patterns need, plus one for
+		# text that starts with anything else; each with and without the
+		# floating alternatives
+		firsts = set(first for (first, is_floating, alternative) in alternatives if first is not None)
+		self._anchored = {}
+		self._ranked = {}
+		for first in firsts:
+			self._anchored[first] = self._combine(alternatives, first, False)
+			self._ranked[first] = self._combine(alternatives, first, True)
+		self._anchored_any = self._combine(alternatives, None, False)
+		self._ranked_any = self._combine(alternatives, None, True)
+
+		# does any floating pattern match at all: a lookahead on the possible
+		# first characters lets the engine skip most positions
+		self._floating = None
+		if floating:
+			source = "|".join(alternative for (first, alternative) in floating)
+			floating_firsts = [first for (first, alternative) in floating]
+			if None not in floating_firsts:
+				source = "(?=[{}])(?:{})".format(re.escape("".join(sorted(set(floating_firsts)))), source)
+			self._floating = re.compile(source)
+
+	def _scoped(self, source, flags):
+		if flags:
+			return "(?{}:{})".format(flags, source)
+		return "(?:{})".format(source)
+
+	def _alternative(self, group, source, flags, floating=False):
+		if floating:
+			return "(?P<{}>(?s:.*?){})".format(group, self._scoped(source, flags))
+		if flags:
+			return "(?P<{}>(?{}:{}))".format(group, flags, source)
+		return "(?P<{}>{})".format(group, source)
+
+	def _combine(self, alternatives, first, with_floating):
+		selected = [alternative for (f, is_floating, alternative) in alternatives if (is_floating and with_floating) or (not is_floating and (f is None or f == first))]
+		if not selected:
+			return None
+		return re.compile("|".join(selected))
+
+	def match(self, text, handler=None):
+		# returns the winning command, or None; with handler, only commands
+		# that implement that method are considered
+		if not text:
+			return None
+		text = mention_re.sub("", text, count=1)
+
+		if self._floating is not None and self._floating.search(text):
+			regex = self._ranked.get(text[:1], self._ranked_any)
+		else:
+			regex = self._anchored.get(text[:1], self._anchored_any)
+		m = regex.match(text) if regex else None
+		if not m:
+			return None
+		i = self._groups[m.lastgroup]
+		command = self.commands[i]
+		if not handler or callable(getattr(command, handler, None)):
+			return command
+
+		# rare: the winner doesn't implement handler, so carry on down the
+		# list; handlers are only looked up once a command's patterns match,
+		# so lazily loaded commands aren't imported for nothing
+		for j in range(i + 1, len(self.commands)):
+			if any(pattern.search(text) for pattern in self._patterns[j]):
+				command = self.commands[j]
+				if callable(getattr(command, handler, None)):
+					return command
+		return None
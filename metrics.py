@@ -0,0 +1,168 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimal Prometheus text-format metrics. Everything is per process, so with
+# several gunicorn workers each one reports its own numbers.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+_collectors = []
+_lock = threading.Lock()
+
+pd_id_re = re.compile(r"/[A-Z0-9]{7,}(?=/|$)")
+
+
+def escape(value):
+	return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(labelnames, labelvalues, extra=None):
+	pairs = list(zip(labelnames, labelvalues))
+	if extra:
+		pairs.append(extra)
+	if not pairs:
+		return ""
+	return "{" + ",".join('{}="{}"'.format(name, escape(value)) for (name, value) in pairs) + "}"
+
+
+class Metric:
+
+	def __init__(self, name, help, labelnames=(), kind="untyped"):
+		self.name = name
+		self.help = help
+		self.labelnames = tuple(labelnames)
+		self.kind = kind
+		self._values = {}
+		self._lock = threading.Lock()
+		with _lock:
+			_registry.append(self)
+
+	def key(self, labels):
+		return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+	def header(self):
+		return ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.kind)]
+
+
+class Counter(Metric):
+
+	def __init__(self, name, help, labelnames=()):
+		super().__init__(name, help, labelnames, "counter")
+
+	def inc(self, amount=1, **labels):
+		key = self.key(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+	def render(self):
+		with self._lock:
+			return self.header() + ["{}{} {}".format(self.name, format_labels(self.labelnames, key), value) for (key, value) in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+
+	def __init__(self, name, help, labelnames=()):
+		super().__init__(name, help, labelnames, "gauge")
+
+	def set(self, value, **labels):
+		with self._lock:
+			self._values[self.key(labels)] = value
+
+	def inc(self, amount=1, **labels):
+		key = self.key(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+	def dec(self, amount=1, **labels):
+		self.inc(-amount, **labels)
+
+	def render(self):
+		with self._lock:
+			return self.header() + ["{}{} {}".format(self.name, format_labels(self.labelnames, key), value) for (key, value) in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+
+	def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+		super().__init__(name, help, labelnames, "histogram")
+		self.buckets = tuple(buckets)
+
+	def observe(self, value, **labels):
+		key = self.key(labels)
+		with self._lock:
+			entry = self._values.get(key)
+			if entry is None:
+				entry = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+			for (i, bound) in enumerate(self.buckets):
+				if value <= bound:
+					entry[0][i] += 1
+			entry[1] += 1
+			entry[2] += value
+
+	@contextmanager
+	def time(self, **labels):
+		start = time.perf_counter()
+		try:
+			yield labels
+		finally:
+			self.observe(time.perf_counter() - start, **labels)
+
+	def render(self):
+		lines = self.header()
+		with self._lock:
+			for (key, (counts, count, total)) in sorted(self._values.items()):
+				for (bound, bucket_count) in zip(self.buckets, counts):
+					lines.append("{}_bucket{} {}".format(self.name, format_labels(self.labelnames, key, ("le", bound)), bucket_count))
+				lines.append("{}_bucket{} {}".format(self.name, format_labels(self.labelnames, key, ("le", "+Inf")), count))
+				lines.append("{}_count{} {}".format(self.name, format_labels(self.labelnames, key), count))
+				lines.append("{}_sum{} {}".format(self.name, format_labels(self.labelnames, key), total))
+		return lines
+
+
+def collector(fn):
+	# fn is called right before rendering, e.g. to set gauges from current state
+	with _lock:
+		_collectors.append(fn)
+	return fn
+
+def render():
+	with _lock:
+		collectors = list(_collectors)
+		metrics = list(_registry)
+	for fn in collectors:
+		fn()
+	lines = []
+	for metric in metrics:
+		lines.extend(metric.render())
+	return "\n".join(lines) + "\n"
+
+def endpoint_template(endpoint):
+	# incidents/PABC123/notes -> incidents/{id}/notes, to keep label cardinality down
+	return pd_id_re.sub("/{id}", "/" + endpoint.lstrip("/"))[1:]
+
+
+http_request_seconds = Histogram("martbot_http_request_seconds", "Time spent in each Flask route", ("route", "method", "status"))
+command_seconds = Histogram("martbot_command_seconds", "Time spent in command handlers", ("command", "handler", "action"))
+command_errors = Counter("martbot_command_errors_total", "Command handlers that raised", ("command", "handler", "action"))
+pd_requests = Counter("martbot_pd_requests_total", "PD API requests by final status", ("method", "endpoint", "status"))
+pd_request_seconds = Histogram("martbot_pd_request_seconds", "PD API request latency, including retries", ("method", "endpoint"))
+pd_retries = Counter("martbot_pd_retries_total", "PD API requests retried", ("method", "endpoint", "reason"))
+pd_throttled = Counter("martbot_pd_throttled_total", "PD API calls delayed by the per-token rate limiter", ("method", "endpoint"))
+pd_coalesced = Counter("martbot_pd_coalesced_total", "PD API GETs answered by an identical call already in flight", ("endpoint",))
+slack_requests = Counter("martbot_slack_requests_total", "Slack Web API calls and response_url posts", ("method", "status"))
+slack_request_seconds = Histogram("martbot_slack_request_seconds", "Slack Web API and response_url latency, including retries", ("method",))
+slack_outbox_seconds = Histogram("martbot_slack_outbox_seconds", "Time from queueing a Slack message to delivering it", ("method",))
+slack_outbox_coalesced = Counter("martbot_slack_outbox_coalesced_total", "Queued Slack messages replaced by a newer version before being sent", ("method",))
+slack_outbox_retries = Counter("martbot_slack_outbox_retries_total", "Slack messages queued again after being rate limited", ("method",))
+slack_outbox = Gauge("martbot_slack_outbox", "Slack outbox state: queued messages, channels with messages, channels sending", ("outbox", "stat"))
+mongo_seconds = Histogram("martbot_mongo_seconds", "Mongo query latency", ("operation",))
+cache_lookups = Counter("martbot_cache_lookups_total", "Shared PD data cache lookups by result: fresh, stale (served while refetched) or miss", ("result",))
+resolver_lookups = Counter("martbot_resolver_lookups_total", "Team/user resolution by cache result", ("result",))
+threads = Gauge("martbot_threads", "Live threads in this process")
+worker_pool = Gauge("martbot_worker_pool", "Worker pool state", ("pool", "stat"))
+
+@collector
+def collect_threads():
+	threads.set(threading.active_count())
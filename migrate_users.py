@@ -0,0 +1,33 @@
+# Copies the user mappings embedded in each Team document into the
+# UserMapping collection. Mappings already in UserMapping are newer and are
+# left alone, so it is safe to run again. The app copies each mapping the
+# first time it's needed anyway; this does them all at once:
+#
+#   python migrate_users.py          copy mappings
+#   python migrate_users.py --drop   copy, then remove the embedded lists
+#
+import sys
+
+from app import Team, UserMapping
+
+def migrate(drop=False):
+	teams = 0
+	users = 0
+	for team in Team.objects(users__0__exists=True).only('slack_team_id', 'users'):
+		teams += 1
+		for user in team.users:
+			UserMapping.objects(slack_team_id=team.slack_team_id, slack_userid=user.slack_userid).update_one(
+				upsert=True,
+				set_on_insert__pd_userid=user.pd_userid,
+				set_on_insert__pd_token=user.pd_token,
+				set_on_insert__pd_subdomain=user.pd_subdomain,
+				set_on_insert__pd_email=user.pd_email,
+				set_on_insert__pd_name=user.pd_name
+			)
+			users += 1
+		if drop:
+			Team.objects(id=team.id).update_one(unset__users=True)
+	print("migrated {} user mappings from {} teams".format(users, teams))
+
+if __name__ == '__main__':
+	migrate(drop='--drop' in sys.argv[1:])
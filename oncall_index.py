@@ -0,0 +1,333 @@
+import bisect
+import datetime
+import os
+import threading
+import time
+
+import pd
+from cache import TTLCache
+from workers import WorkerPool
+
+# how far ahead on-calls are indexed, and how much history is kept
+HORIZON = int(os.environ.get('ONCALL_HORIZON', 7 * 24 * 3600))
+HISTORY = 24 * 3600
+# every REFRESH seconds the window is extended and its next RECHECK seconds
+# are fetched again, which picks up overrides and schedule edits there; every
+# FULL_REFRESH seconds all of it is fetched again
+REFRESH = int(os.environ.get('ONCALL_REFRESH', 300))
+RECHECK = 2 * REFRESH
+FULL_REFRESH = int(os.environ.get('ONCALL_FULL_REFRESH', 3600))
+
+INFINITY = float('inf')
+
+refresher = WorkerPool(name="oncall", workers=2, queue_size=100)
+
+
+def timestamp(value, default):
+	if not value:
+		return default
+	return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+def isoformat(t):
+	return datetime.datetime.fromtimestamp(t, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def overlaps(entry, since, until):
+	return entry["starts_at"] < until and entry["ends_at"] > since
+
+def oncall_entry(oncall):
+	# what the index keeps of one /oncalls entry
+	schedule = oncall.get("schedule")
+	user = oncall.get("user") or {}
+	ep = oncall.get("escalation_policy") or {}
+	return {
+		"escalation_policy": {"id": ep.get("id"), "summary": ep.get("summary"), "html_url": ep.get("html_url")},
+		"level": oncall.get("escalation_level"),
+		"target": schedule["id"] if schedule else user.get("id"),
+		"schedule": {"id": schedule.get("id"), "summary": schedule.get("summary"), "html_url": schedule.get("html_url")} if schedule else None,
+		"user": {"id": user.get("id"), "name": user.get("summary"), "summary": user.get("summary"), "html_url": user.get("html_url")},
+		"start": oncall.get("start"),
+		"end": oncall.get("end"),
+		"starts_at": timestamp(oncall.get("start"), -INFINITY),
+		"ends_at": timestamp(oncall.get("end"), INFINITY)
+	}
+
+
+class Intervals:
+	# one on-call target's shifts: non-overlapping, sorted by start, so ends
+	# are sorted too and both kinds of query are a bisect away
+
+	__slots__ = ('starts', 'ends', 'entries')
+
+	def __init__(self, entries):
+		entries = sorted(entries, key=lambda entry: entry["starts_at"])
+		self.starts = [entry["starts_at"] for entry in entries]
+		self.ends = [entry["ends_at"] for entry in entries]
+		self.entries = entries
+
+	def at(self, t):
+		i = bisect.bisect_right(self.starts, t) - 1
+		if i >= 0 and self.ends[i] > t:
+			return self.entries[i]
+
+	def between(self, since, until):
+		i = bisect.bisect_right(self.ends, since)
+		j = bisect.bisect_left(self.starts, until)
+		return self.entries[i:j]
+
+
+class OncallSnapshot:
+	# immutable view of one subdomain's on-calls, rebuilt on refresh and
+	# swapped in whole
+
+	def __init__(self, entries):
+		self.entries = entries
+		by_target = {}
+		by_schedule = {}
+		# schedule id -> ids of the EPs it's on
+		self.schedule_eps = {}
+		for entry in entries:
+			by_target.setdefault((entry["escalation_policy"]["id"], entry["level"], entry["target"]), []).append(entry)
+			if entry["schedule"]:
+				# the same shift shows up once for every EP level the schedule is on
+				by_schedule.setdefault(entry["schedule"]["id"], {})[entry["starts_at"]] = entry
+				self.schedule_eps.setdefault(entry["schedule"]["id"], set()).add(entry["escalation_policy"]["id"])
+		self.targets = {key: Intervals(shifts) for (key, shifts) in by_target.items()}
+		self.schedules = {id: Intervals(shifts.values()) for (id, shifts) in by_schedule.items()}
+
+	def at(self, ep_id, level, target, t):
+		intervals = self.targets.get((ep_id, level, target))
+		return intervals.at(t) if intervals else None
+
+	def schedule_at(self, schedule_id, t):
+		intervals = self.schedules.get(schedule_id)
+		return intervals.at(t) if intervals else None
+
+	def schedule_between(self, schedule_id, since, until):
+		intervals = self.schedules.get(schedule_id)
+		return intervals.between(since, until) if intervals else []
+
+
+def with_oncalls(ep, snapshot, t):
+	# ep shaped like GET escalation_policies/{id}?include[]=current_oncall,
+	# with whoever snapshot has on call at time t
+	rules = []
+	for (i, rule) in enumerate(ep.get("escalation_rules") or []):
+		current_oncalls = []
+		for target in rule.get("escalation_targets") or []:
+			entry = snapshot.at(ep["id"], i + 1, target["id"], t)
+			if entry:
+				current_oncalls.append({
+					"escalation_target": {"id": target["id"], "type": target.get("type"), "summary": target.get("summary"), "html_url": target.get("html_url")},
+					"user": entry["user"],
+					"start": entry["start"],
+					"end": entry["end"]
+				})
+		rules.append(dict(rule, current_oncalls=current_oncalls))
+	return dict(ep, escalation_rules=rules)
+
+
+class SubdomainOncalls:
+	# Every snapshot is fetched with one token, the index's, so what it has
+	# on call for an EP always comes from a token that can see that EP. The
+	# first user to ask provides it; if PD stops taking it, the next user to
+	# ask rebuilds the index with theirs.
+
+	def __init__(self, subdomain):
+		self.subdomain = subdomain
+		self.token = None
+		self.snapshot = None
+		# escalation policies by id, for their rules, delays and loops
+		self.eps = {}
+		self.schedules = {}
+		self.covered_until = None
+		self.refreshed_at = None
+		self.full_refreshed_at = None
+		self.lock = threading.Lock()
+
+	def refresh(self, pd_token, full=False):
+		now = time.time()
+		until = now + HORIZON
+		# a new token starts the snapshot over, so it's all from one token
+		full = full or self.snapshot is None or pd_token != self.token
+		if full:
+			# straight from PD rather than the shared cache, which could be up
+			# to its ttl and stale time behind
+			windows = [(now - HISTORY, until)]
+			eps = {ep["id"]: ep for ep in pd.fetch_escalation_policies(oauth_token=pd_token)}
+			kept = []
+		else:
+			# the next RECHECK seconds again, then what's beyond the window we
+			# already have; shifts overlapping either are replaced by PD's,
+			# keeping what they had before it for the history
+			windows = [(now, now + RECHECK), (max(self.covered_until, now + RECHECK), until)]
+			eps = self.eps
+			kept = []
+			for entry in self.snapshot.entries:
+				if entry["ends_at"] <= now - HISTORY:
+					continue
+				starts = [start for (start, end) in windows if overlaps(entry, start, end)]
+				if not starts:
+					kept.append(entry)
+				elif entry["starts_at"] < starts[0]:
+					kept.append(dict(entry, end=isoformat(starts[0]), ends_at=starts[0]))
+
+		fetched = []
+		for (start, end) in windows:
+			oncalls = pd.iter_fetch(oauth_token=pd_token, endpoint="oncalls", params={"since": isoformat(start), "until": isoformat(end)})
+			fetched.extend(oncall_entry(oncall) for oncall in oncalls)
+		entries = {}
+		for entry in kept + fetched:
+			entries[(entry["escalation_policy"]["id"], entry["level"], entry["target"], entry["starts_at"])] = entry
+		snapshot = OncallSnapshot(list(entries.values()))
+		schedules = {}
+		for entry in snapshot.entries:
+			if entry["schedule"]:
+				schedules[entry["schedule"]["id"]] = entry["schedule"]
+
+		with self.lock:
+			self.token = pd_token
+			self.snapshot = snapshot
+			self.eps = eps
+			self.schedules = schedules
+			self.covered_until = until
+			self.refreshed_at = time.monotonic()
+			if full:
+				self.full_refreshed_at = self.refreshed_at
+
+	def escalation_policy(self, ep_id, t=None):
+		# the EP shaped like GET escalation_policies/{id}?include[]=current_oncall,
+		# with whoever is on call at time t (default now)
+		ep = self.eps.get(ep_id)
+		snapshot = self.snapshot
+		if ep is None or snapshot is None:
+			return None
+		return with_oncalls(ep, snapshot, time.time() if t is None else t)
+
+	def find(self, query):
+		# (escalation policies, schedules) whose names contain query
+		query = (query or "").lower().strip()
+		eps = [ep for ep in self.eps.values() if query in (ep.get("summary") or ep.get("name") or "").lower()]
+		schedules = [schedule for schedule in self.schedules.values() if query in (schedule.get("summary") or "").lower()]
+		eps.sort(key=lambda ep: (ep.get("summary") or "").lower())
+		schedules.sort(key=lambda schedule: (schedule.get("summary") or "").lower())
+		return (eps, schedules)
+
+
+class OncallView:
+	# one token's view of a subdomain's index: the EPs this token can see,
+	# and the schedules on them. EPs the index's token can't see aren't in
+	# the index, so their on-calls are fetched live with this token
+
+	def __init__(self, oncalls, pd_token, eps):
+		self.oncalls = oncalls
+		self.snapshot = oncalls.snapshot
+		self.pd_token = pd_token
+		self.eps = eps
+
+	def escalation_policy(self, ep_id, t=None):
+		ep = self.eps.get(ep_id)
+		if ep is None:
+			return None
+		indexed = self.oncalls.escalation_policy(ep_id, t)
+		if indexed is not None:
+			return indexed
+		t = time.time() if t is None else t
+		oncalls = pd.fetch(oauth_token=self.pd_token, endpoint="oncalls", params={"escalation_policy_ids[]": [ep_id], "since": isoformat(t), "until": isoformat(t + 1)})
+		return with_oncalls(ep, OncallSnapshot([oncall_entry(oncall) for oncall in oncalls]), t)
+
+	def find(self, query):
+		query = (query or "").lower().strip()
+		eps = [ep for ep in self.eps.values() if query in (ep.get("summary") or ep.get("name") or "").lower()]
+		eps.sort(key=lambda ep: (ep.get("summary") or "").lower())
+		schedules = [schedule for schedule in self.oncalls.find(query)[1] if self.snapshot.schedule_eps.get(schedule["id"], set()) & self.eps.keys()]
+		return (eps, schedules)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+_pending = set()
+# pd_token -> (the EPs it can see by id, when they were fetched)
+_visible = TTLCache(maxsize=10000, ttl=24 * 3600)
+
+def subdomain_index(subdomain):
+	with _indexes_lock:
+		if subdomain not in _indexes:
+			_indexes[subdomain] = SubdomainOncalls(subdomain)
+		return _indexes[subdomain]
+
+def schedule_refresh(subdomain, pd_token, full=False):
+	with _indexes_lock:
+		if subdomain in _pending:
+			return
+		_pending.add(subdomain)
+
+	def run():
+		oncalls = subdomain_index(subdomain)
+		try:
+			oncalls.refresh(pd_token, full)
+		except pd.PDError as e:
+			print("refreshing on-calls in {} failed: {}".format(subdomain, e))
+			if e.status in (401, 403):
+				# the index's token was revoked, let the next user's replace it
+				with oncalls.lock:
+					if oncalls.token == pd_token:
+						oncalls.token = None
+		finally:
+			with _indexes_lock:
+				_pending.discard(subdomain)
+
+	if not refresher.submit(run, label="refresh oncalls {}".format(subdomain)):
+		with _indexes_lock:
+			_pending.discard(subdomain)
+
+def schedule_visible(pd_token):
+	key = ("visible", pd_token)
+	with _indexes_lock:
+		if key in _pending:
+			return
+		_pending.add(key)
+
+	def run():
+		try:
+			eps = pd.fetch_escalation_policies(oauth_token=pd_token, cache_ttl=REFRESH)
+			_visible.set(pd_token, ({ep["id"]: ep for ep in eps}, time.monotonic()))
+		except pd.PDError as e:
+			print("fetching escalation policies failed: {}".format(e))
+		finally:
+			with _indexes_lock:
+				_pending.discard(key)
+
+	if not refresher.submit(run, label="visible escalation policies"):
+		with _indexes_lock:
+			_pending.discard(key)
+
+def index(subdomain, pd_token):
+	# pd_token's view of the on-call index for a subdomain. One index per
+	# subdomain serves all its users, each of whom only sees the EPs their
+	# token can. Returns None until both have been fetched; keeps them fresh
+	# in the background, always with the index's own token.
+	oncalls = subdomain_index(subdomain)
+	visible = _visible.get(pd_token)
+	if visible is None or time.monotonic() - visible[1] > REFRESH:
+		schedule_visible(pd_token)
+	token = oncalls.token or pd_token
+	if oncalls.refreshed_at is None:
+		schedule_refresh(subdomain, token)
+		return None
+	now = time.monotonic()
+	if oncalls.token is None or now - oncalls.full_refreshed_at > FULL_REFRESH:
+		schedule_refresh(subdomain, token, full=True)
+	elif now - oncalls.refreshed_at > REFRESH:
+		schedule_refresh(subdomain, token)
+	if visible is None:
+		return None
+	return OncallView(oncalls, pd_token, visible[0])
+
+def escalation_policy(subdomain, pd_token, ep_id, t=None):
+	# EP with its current on-calls from the index, or live from PD while the
+	# index is being built or doesn't show pd_token the EP
+	oncalls = index(subdomain, pd_token)
+	ep = oncalls.escalation_policy(ep_id, t) if oncalls else None
+	if ep is None:
+		ep = pd.request(oauth_token=pd_token, endpoint="escalation_policies/{}".format(ep_id), params={"include[]": "current_oncall"})["escalation_policy"]
+	return ep
@@ -0,0 +1,197 @@
+import asyncio
+import bisect
+import datetime
+import os
+import re
+import threading
+import time
+
+import pd
+import pd_aio
+from workers import WorkerPool
+
+POLL_INTERVAL = int(os.environ.get('OPEN_INCIDENTS_POLL', 30))
+# re-read a little of the previous window so nothing falls between polls
+POLL_OVERLAP = 5
+PAGE_SIZE = 99
+# how many changed incidents a poll fetches at once, and how many changes
+# make fetching the whole list again cheaper than fetching them one by one
+POLL_CONCURRENCY = int(os.environ.get('OPEN_INCIDENTS_CONCURRENCY', 4))
+RESEED_AFTER = 2 * pd.PAGE_LIMIT
+
+subdomain_re = re.compile(r"https://([^\.]+)")
+
+poller = WorkerPool(name="open-incidents", workers=2, queue_size=100)
+
+loading_text = "Still loading incidents, please try again in a few seconds."
+
+
+def incident_entry(incident):
+	return {
+		"id": incident["id"],
+		"incident_number": incident.get("incident_number"),
+		"summary": incident.get("summary") or incident.get("title"),
+		"status": incident.get("status"),
+		"html_url": incident.get("html_url"),
+		"service": {"id": (incident.get("service") or {}).get("id")}
+	}
+
+
+class OpenIncidentView:
+	# Triggered and acknowledged incidents one PD user can see, seeded with a
+	# full fetch with their token and then kept current from
+	# log_entries?since= (and webhooks, when they are set up). Incidents are
+	# kept ordered by incident number, newest first, so a picker can page
+	# through them with the number of the last incident it showed as a
+	# stable cursor.
+
+	def __init__(self, subdomain, pd_userid):
+		self.subdomain = subdomain
+		self.pd_userid = pd_userid
+		self.incidents = {}
+		# negated incident numbers, ascending, i.e. newest incident first
+		self.order = []
+		self.polled_at = None
+		self.since = None
+		self.lock = threading.Lock()
+
+	def _put(self, incident):
+		entry = incident_entry(incident)
+		key = -(entry["incident_number"] or 0)
+		old = self.incidents.get(entry["id"])
+		if old:
+			self.order.pop(bisect.bisect_left(self.order, (-(old["incident_number"] or 0), old["id"])))
+		if entry["status"] in ("triggered", "acknowledged"):
+			self.incidents[entry["id"]] = entry
+			bisect.insort(self.order, (key, entry["id"]))
+		elif old:
+			del self.incidents[entry["id"]]
+
+	def apply(self, incident):
+		with self.lock:
+			self._put(incident)
+
+	def update(self, incident):
+		# like apply, but only for incidents already in the view: a webhook
+		# doesn't say who may see a new incident, the next poll will
+		with self.lock:
+			if incident.get("id") in self.incidents:
+				self._put(incident)
+
+	def seed(self, pd_token):
+		started = datetime.datetime.utcnow()
+		incidents = pd.fetch_incidents(oauth_token=pd_token)
+		with self.lock:
+			self.incidents = {}
+			self.order = []
+			for incident in incidents:
+				self._put(incident)
+			self.since = started
+			self.polled_at = time.monotonic()
+
+	def poll(self, pd_token):
+		started = datetime.datetime.utcnow()
+		since = (self.since - datetime.timedelta(seconds=POLL_OVERLAP)).strftime("%Y-%m-%dT%H:%M:%SZ")
+		changed = set()
+		for entry in pd.iter_fetch(oauth_token=pd_token, endpoint="log_entries", params={"since": since, "is_overview": "true"}):
+			if entry.get("incident"):
+				changed.add(entry["incident"]["id"])
+		if len(changed) > RESEED_AFTER:
+			self.seed(pd_token)
+			return
+		if changed:
+			responses = pd_aio.run(fetch_incidents(pd_token, changed))
+			with self.lock:
+				for r in responses:
+					if isinstance(r, dict) and r.get("incident"):
+						self._put(r["incident"])
+		with self.lock:
+			self.since = started
+			self.polled_at = time.monotonic()
+
+	def page(self, query=None, cursor=None, limit=PAGE_SIZE):
+		# returns (incidents, next_cursor); cursor is the incident number of
+		# the last incident on the previous page
+		query = (query or "").lower().strip()
+		with self.lock:
+			start = bisect.bisect_right(self.order, (-cursor, "\uffff")) if cursor else 0
+			found = []
+			for (key, id) in self.order[start:]:
+				incident = self.incidents[id]
+				if query and query not in (incident["summary"] or "").lower():
+					continue
+				if len(found) == limit:
+					return (found, found[-1]["incident_number"])
+				found.append(dict(incident))
+		return (found, None)
+
+
+async def fetch_incidents(pd_token, ids):
+	# GET incidents/{id} for every id, at most POLL_CONCURRENCY at a time
+	semaphore = asyncio.Semaphore(POLL_CONCURRENCY)
+
+	async def fetch(id):
+		async with semaphore:
+			return await pd_aio.request(oauth_token=pd_token, endpoint="incidents/{}".format(id))
+
+	return await asyncio.gather(*[fetch(id) for id in ids], return_exceptions=True)
+
+
+_views = {}
+_views_lock = threading.Lock()
+_pending = set()
+
+def view(user):
+	key = (user["pd_subdomain"], user["pd_userid"])
+	with _views_lock:
+		if key not in _views:
+			_views[key] = OpenIncidentView(user["pd_subdomain"], user["pd_userid"])
+		return _views[key]
+
+def schedule_poll(user):
+	# seeds the user's view the first time, polls for changes after that
+	key = (user["pd_subdomain"], user["pd_userid"])
+	with _views_lock:
+		if key in _pending:
+			return
+		_pending.add(key)
+
+	def run():
+		v = view(user)
+		try:
+			if v.polled_at is None:
+				v.seed(user["pd_token"])
+			else:
+				v.poll(user["pd_token"])
+		except pd.PDError as e:
+			print("polling open incidents in {} failed: {}".format(user["pd_subdomain"], e))
+		finally:
+			with _views_lock:
+				_pending.discard(key)
+
+	if not poller.submit(run, label="poll {}".format(user["pd_subdomain"])):
+		with _views_lock:
+			_pending.discard(key)
+
+def apply_webhook(payload):
+	for message in payload.get("messages") or []:
+		incident = message.get("incident")
+		if not (message.get("event") or "").startswith("incident.") or not incident:
+			continue
+		m = subdomain_re.match(incident.get("html_url") or "")
+		if m:
+			with _views_lock:
+				views = [v for (key, v) in _views.items() if key[0] == m.groups()[0]]
+			for v in views:
+				v.update(incident)
+
+def page(user, query=None, cursor=None, limit=PAGE_SIZE):
+	# a page of the open incidents the user can see, or None while their view
+	# is first being fetched in the background; after that it polls for
+	# changes in the background every POLL_INTERVAL seconds
+	v = view(user)
+	if v.polled_at is None or time.monotonic() - v.polled_at > POLL_INTERVAL:
+		schedule_poll(user)
+	if v.polled_at is None:
+		return None
+	return v.page(query, cursor, limit)
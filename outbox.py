@@ -0,0 +1,188 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import metrics
+from ratelimit import Limiter
+from workers import WorkerPool
+
+outboxes = []
+
+
+class Message:
+	__slots__ = ('channel', 'method', 'key', 'fn', 'args', 'retry', 'paced', 'futures', 'enqueued', 'attempts')
+
+	def __init__(self, channel, method, key, fn, args, retry, paced):
+		self.channel = channel
+		self.method = method
+		self.key = key
+		self.fn = fn
+		self.args = args
+		self.retry = retry
+		self.paced = paced
+		self.futures = []
+		self.enqueued = time.monotonic()
+		self.attempts = 0
+
+
+class Outbox:
+	# outgoing messages queued per channel and sent in order, no faster than
+	# the channel's token bucket allows. A message put with a key replaces
+	# the queued message with the same key if that one hasn't gone out yet,
+	# so a burst of updates to one message ends up as one call. Messages put
+	# with paced=False keep their place in the channel's order but don't wait
+	# for or use up its tokens
+
+	def __init__(self, name="outbox", rate=1.0, burst=3, senders=4, max_attempts=3, retry_wait=1.0, busy_wait=0.1):
+		self.name = name
+		self.max_attempts = max_attempts
+		self.retry_wait = retry_wait
+		# how long a message waits when every sender is busy
+		self.busy_wait = busy_wait
+		self._limiter = Limiter(rate, burst)
+		self._senders = WorkerPool(name=name, workers=senders, queue_size=1000)
+		self._cond = threading.Condition()
+		self._channels = {}
+		self._keys = {}
+		# (when, seq, channel) for channels with something to send
+		self._ready = []
+		self._seq = itertools.count()
+		# channels that already hold a token for their next send
+		self._reserved = set()
+		self._inflight = set()
+		self._queued = 0
+		self._pid = None
+		outboxes.append(self)
+
+	def _start(self):
+		# the scheduler thread is started lazily, and again after a fork
+		with self._cond:
+			if self._pid == os.getpid():
+				return
+			self._pid = os.getpid()
+			threading.Thread(target=self._run, name="{}-scheduler".format(self.name), daemon=True).start()
+
+	def put(self, channel, method, fn, *args, key=None, retry=None, paced=True):
+		# queues fn(*args) and returns a Future for its result; retry(result)
+		# says whether a result means "rate limited, send again later". This
+		# is the only place rate limited messages are retried, so fn should
+		# return a 429 rather than retry it itself
+		if self._pid != os.getpid():
+			self._start()
+		future = Future()
+		with self._cond:
+			message = self._keys.get(key) if key is not None else None
+			if message is not None:
+				message.fn = fn
+				message.args = args
+				message.retry = retry
+				message.futures.append(future)
+				metrics.slack_outbox_coalesced.inc(method=method)
+				return future
+			message = Message(channel, method, key, fn, args, retry, paced)
+			message.futures.append(future)
+			if key is not None:
+				self._keys[key] = message
+			queue = self._channels.get(channel)
+			if queue is None:
+				queue = self._channels[channel] = deque()
+			queue.append(message)
+			self._queued += 1
+			if len(queue) == 1 and channel not in self._inflight:
+				self._schedule(channel, time.monotonic())
+		return future
+
+	def _schedule(self, channel, when):
+		heapq.heappush(self._ready, (when, next(self._seq), channel))
+		self._cond.notify()
+
+	def _run(self):
+		while True:
+			with self._cond:
+				while True:
+					now = time.monotonic()
+					if self._ready and self._ready[0][0] <= now:
+						break
+					self._cond.wait(self._ready[0][0] - now if self._ready else None)
+				(_, _, channel) = heapq.heappop(self._ready)
+				if self._channels[channel][0].paced and channel not in self._reserved:
+					delay = self._limiter.reserve(channel)
+					if delay:
+						self._reserved.add(channel)
+						self._schedule(channel, now + delay)
+						continue
+				self._reserved.discard(channel)
+				message = self._channels[channel].popleft()
+				if message.key is not None:
+					del self._keys[message.key]
+				self._queued -= 1
+				# one message per channel at a time keeps them in order
+				self._inflight.add(channel)
+			if not self._senders.submit(self._deliver, message, label="{} {}".format(self.name, message.method)):
+				# sending it here would hold up every other channel, so it
+				# waits its turn again, keeping the token it took
+				with self._cond:
+					self._inflight.discard(channel)
+					if message.paced:
+						self._reserved.add(channel)
+					self._requeue(message, time.monotonic() + self.busy_wait)
+
+	def _requeue(self, message, when):
+		# puts a message that was taken off its queue back at the head;
+		# called with self._cond held
+		if message.key is not None and message.key in self._keys:
+			# a newer version was queued meanwhile and replaces this one
+			self._keys[message.key].futures.extend(message.futures)
+		else:
+			self._channels[message.channel].appendleft(message)
+			self._queued += 1
+			if message.key is not None:
+				self._keys[message.key] = message
+		self._schedule(message.channel, when)
+
+	def _deliver(self, message):
+		result = None
+		error = None
+		try:
+			result = message.fn(*message.args)
+		except Exception as e:
+			error = e
+		message.attempts += 1
+
+		again = error is None and message.retry is not None and message.retry(result) and message.attempts < self.max_attempts
+		with self._cond:
+			self._inflight.discard(message.channel)
+			if again:
+				metrics.slack_outbox_retries.inc(method=message.method)
+				self._requeue(message, time.monotonic() + self.retry_wait)
+				return
+			if self._channels[message.channel]:
+				self._schedule(message.channel, time.monotonic())
+			else:
+				del self._channels[message.channel]
+
+		metrics.slack_outbox_seconds.observe(time.monotonic() - message.enqueued, method=message.method)
+		for future in message.futures:
+			if error is not None:
+				future.set_exception(error)
+			else:
+				future.set_result(result)
+
+	def stats(self):
+		with self._cond:
+			return {
+				"queued": self._queued,
+				"channels": len(self._channels),
+				"inflight": len(self._inflight)
+			}
+
+
+@metrics.collector
+def collect_outboxes():
+	for outbox in outboxes:
+		for (stat, value) in outbox.stats().items():
+			metrics.slack_outbox.set(value, outbox=outbox.name, stat=stat)
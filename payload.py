@@ -0,0 +1,134 @@
+import json
+
+
+class MissingType:
+	# what a payload view returns for a key that isn't there: falsy, empty
+	# when formatted into a message, and any further attribute or index
+	# lookup on it is Missing too, so event.message.subtype works whether or
+	# not event has a message
+	__slots__ = ()
+
+	def __getattr__(self, name):
+		if name.startswith('__'):
+			raise AttributeError(name)
+		return self
+
+	def __getitem__(self, key):
+		return self
+
+	def __bool__(self):
+		return False
+
+	def __len__(self):
+		return 0
+
+	def __iter__(self):
+		return iter(())
+
+	def __contains__(self, key):
+		return False
+
+	def __eq__(self, other):
+		return other is self or other is None
+
+	def __hash__(self):
+		return hash(None)
+
+	def __str__(self):
+		return ""
+
+	def __format__(self, spec):
+		return format("", spec)
+
+	def __repr__(self):
+		return "Missing"
+
+Missing = MissingType()
+
+
+def view(value):
+	# wraps containers on access instead of converting the whole payload up front
+	if isinstance(value, dict):
+		return Payload(value)
+	if isinstance(value, list):
+		return PayloadList(value)
+	return value
+
+
+class Payload:
+	# read-only attribute view over a parsed JSON object. It has no methods
+	# of its own, so no key is hidden behind one; payload["key"] works for
+	# keys that aren't identifiers
+
+	__slots__ = ('_raw',)
+
+	def __init__(self, raw):
+		self._raw = raw
+
+	def __getattr__(self, name):
+		if name.startswith('__'):
+			raise AttributeError(name)
+		try:
+			return view(self._raw[name])
+		except KeyError:
+			return Missing
+
+	def __getitem__(self, key):
+		try:
+			return view(self._raw[key])
+		except KeyError:
+			return Missing
+
+	def __contains__(self, key):
+		return key in self._raw
+
+	def __iter__(self):
+		return iter(self._raw)
+
+	def __len__(self):
+		return len(self._raw)
+
+	def __bool__(self):
+		return bool(self._raw)
+
+	def __eq__(self, other):
+		if isinstance(other, Payload):
+			return self._raw == other._raw
+		return self._raw == other
+
+	def __repr__(self):
+		return json.dumps(self._raw, indent=2, sort_keys=True)
+
+
+class PayloadList:
+	# read-only view over a parsed JSON array; out of range indexes are Missing
+
+	__slots__ = ('_raw',)
+
+	def __init__(self, raw):
+		self._raw = raw
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return PayloadList(self._raw[index])
+		try:
+			return view(self._raw[index])
+		except IndexError:
+			return Missing
+
+	def __iter__(self):
+		return (view(value) for value in self._raw)
+
+	def __len__(self):
+		return len(self._raw)
+
+	def __bool__(self):
+		return bool(self._raw)
+
+	def __eq__(self, other):
+		if isinstance(other, PayloadList):
+			return self._raw == other._raw
+		return self._raw == other
+
+	def __repr__(self):
+		return json.dumps(self._raw, indent=2, sort_keys=True)
@@ -1,8 +1,107 @@
 import json
+import os
+import random
+import threading
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, NewConnectionError
+
+import metrics
+import shared_cache
+from cache import TTLCache
+from ratelimit import Limiter, SingleFlight
+from requests.adapters import HTTPAdapter
 
 BASE_URL = 'https://api.pagerduty.com'
 
+POOL_SIZE = int(os.environ.get('PD_POOL_SIZE', 20))
+MAX_RETRIES = int(os.environ.get('PD_MAX_RETRIES', 3))
+BACKOFF_BASE = float(os.environ.get('PD_BACKOFF_BASE', 0.5))
+BACKOFF_MAX = float(os.environ.get('PD_BACKOFF_MAX', 20))
+TIMEOUT = float(os.environ.get('PD_TIMEOUT', 10))
+FETCH_CONCURRENCY = int(os.environ.get('PD_FETCH_CONCURRENCY', 4))
+PAGE_LIMIT = 100
+ME_TTL = int(os.environ.get('PD_ME_TTL', 3600))
+RATE_LIMIT = float(os.environ.get('PD_RATE_LIMIT', 15))
+RATE_BURST = int(os.environ.get('PD_RATE_BURST', 30))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# methods that are safe to send twice. Anything else may already have taken
+# effect when the call times out or PD answers 5xx (a retried POST incidents
+# triggers a second incident), so it is only retried on 429 or when the
+# connection was never made
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_session = None
+_session_lock = threading.Lock()
+
+# users/me by token: (user, fetched_at). Entries are kept for twice ME_TTL so
+# that a stale one can be served while it is refreshed in the background
+_me_cache = TTLCache(maxsize=10000, ttl=ME_TTL * 2)
+_me_refreshing = set()
+_me_lock = threading.Lock()
+
+# PD rate limits per token, so every thread and coroutine using a token
+# draws from one bucket; identical GETs in flight at once share one call
+limiter = Limiter(RATE_LIMIT, RATE_BURST)
+_inflight = SingleFlight()
+
+
+class PDError(Exception):
+
+	def __init__(self, status, method, endpoint, body=None):
+		self.status = status
+		self.method = method
+		self.endpoint = endpoint
+		self.body = body
+		message = None
+		if isinstance(body, dict) and isinstance(body.get('error'), dict):
+			message = body['error'].get('message')
+		super().__init__("PD {} {} failed with status {}: {}".format(method, endpoint, status, message or body))
+
+
+def session():
+	# one keep-alive pool shared by every command thread; requests.Session is
+	# safe to share for sending as long as nobody mutates it after setup
+	global _session
+	if _session is None:
+		with _session_lock:
+			if _session is None:
+				s = requests.Session()
+				adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+				s.mount('https://', adapter)
+				s.mount('http://', adapter)
+				_session = s
+	return _session
+
+def retry_delay(attempt, response=None):
+	if response is not None:
+		retry_after = response.headers.get('Retry-After')
+		if retry_after:
+			try:
+				return min(float(retry_after), BACKOFF_MAX)
+			except ValueError:
+				pass
+	# full jitter so that threads that got throttled together don't come back together
+	return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+def never_sent(error):
+	# whether a requests exception happened before the request went out
+	if isinstance(error, requests.ConnectTimeout):
+		return True
+	reason = error.args[0] if error.args else None
+	if isinstance(reason, MaxRetryError):
+		reason = reason.reason
+	return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+def should_retry(method, status=None, error=None):
+	if method in IDEMPOTENT_METHODS:
+		return True
+	if error is not None:
+		return never_sent(error)
+	return status == 429
+
 def request(api_key=None, oauth_token=None, endpoint=None, method="GET", params=None, data=None, addheaders=None):
 
 	if not api_key and not oauth_token:
@@ -10,7 +109,7 @@ def request(api_key=None, oauth_token=None, endpoint=None, method="GET", params=
 	if not endpoint:
 		return None
 
-
+	endpoint = endpoint.lstrip('/')
 	url = '/'.join([BASE_URL, endpoint])
 	headers = {
 		"Accept": "application/vnd.pagerduty+json;version=2",
@@ -24,42 +123,160 @@ def request(api_key=None, oauth_token=None, endpoint=None, method="GET", params=
 	if addheaders:
 		headers.update(addheaders)
 
-	req = requests.Request(
-		method=method,
-		url=url,
-		headers=headers,
-		params=params,
-		json=data
-	)
+	template = metrics.endpoint_template(endpoint)
+	if method == "GET" and data is None:
+		key = (headers["Authorization"], endpoint, params_key(params), tuple(sorted(addheaders.items())) if addheaders else None)
+		(body, shared) = _inflight.do(key, _send, api_key or oauth_token, method, url, headers, params, data, endpoint, template)
+		if shared:
+			metrics.pd_coalesced.inc(endpoint=template)
+		return body
+	return _send(api_key or oauth_token, method, url, headers, params, data, endpoint, template)
 
-	prepped = req.prepare()
-	response = requests.Session().send(prepped)
-	return response.json()
+def params_key(params):
+	if not params:
+		return None
+	return tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in params.items()))
 
-def fetch(api_key=None, oauth_token=None, endpoint=None, params=None):
-	my_params = {}
-	if params:
-		my_params = params.copy()
+def throttle_delay(token, method, template):
+	# how long to wait before the next call with token; counted when it isn't 0
+	delay = limiter.reserve(token)
+	if delay:
+		metrics.pd_throttled.inc(method=method, endpoint=template)
+	return delay
 
-	fetched_data = []
-	offset = 0
+def _send(token, method, url, headers, params, data, endpoint, template):
+	started = time.perf_counter()
+	attempt = 0
 	while True:
-		r = request(api_key=api_key, oauth_token=oauth_token, endpoint=endpoint, params=my_params)
-		fetched_data.extend(r[endpoint])
-		if not r["more"]:
-			break
-		offset += r["limit"]
-		my_params["offset"] = offset
-	return fetched_data
+		delay = throttle_delay(token, method, template)
+		if delay:
+			time.sleep(delay)
+		try:
+			response = session().request(method, url, headers=headers, params=params, json=data, timeout=TIMEOUT)
+		except (requests.ConnectionError, requests.Timeout) as e:
+			if attempt >= MAX_RETRIES or not should_retry(method, error=e):
+				metrics.pd_requests.inc(method=method, endpoint=template, status="error")
+				raise PDError(None, method, endpoint, str(e)) from e
+			metrics.pd_retries.inc(method=method, endpoint=template, reason="connection")
+			time.sleep(retry_delay(attempt))
+			attempt += 1
+			continue
+
+		if response.status_code in RETRY_STATUSES and attempt < MAX_RETRIES and should_retry(method, status=response.status_code):
+			metrics.pd_retries.inc(method=method, endpoint=template, reason=response.status_code)
+			time.sleep(retry_delay(attempt, response))
+			attempt += 1
+			continue
+		break
+
+	metrics.pd_request_seconds.observe(time.perf_counter() - started, method=method, endpoint=template)
+	metrics.pd_requests.inc(method=method, endpoint=template, status=response.status_code)
+
+	try:
+		body = response.json() if response.content else {}
+	except ValueError:
+		body = response.text
+
+	if not response.ok:
+		raise PDError(response.status_code, method, endpoint, body)
+	return body
+
+def iter_fetch(api_key=None, oauth_token=None, endpoint=None, params=None, concurrency=FETCH_CONCURRENCY):
+	# yields objects as pages arrive: the first page is fetched with total=true,
+	# then the remaining offsets are fetched concurrently and yielded in order
+	my_params = {"limit": PAGE_LIMIT}
+	if params:
+		my_params.update(params)
+	my_params["total"] = "true"
+
+	def fetch_page(offset):
+		page_params = my_params.copy()
+		page_params["offset"] = offset
+		return request(api_key=api_key, oauth_token=oauth_token, endpoint=endpoint, params=page_params)
+
+	r = request(api_key=api_key, oauth_token=oauth_token, endpoint=endpoint, params=my_params)
+	yield from r[endpoint]
+	if not r["more"]:
+		return
+
+	limit = r["limit"]
+	offset = r.get("offset", 0) + limit
+	total = r.get("total")
+	if total is None:
+		# no total, so we can't know the offsets up front
+		while True:
+			r = fetch_page(offset)
+			yield from r[endpoint]
+			if not r["more"]:
+				return
+			offset += r["limit"]
+
+	executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+	try:
+		futures = [executor.submit(fetch_page, o) for o in range(offset, total, limit)]
+		for future in futures:
+			yield from future.result()[endpoint]
+	finally:
+		executor.shutdown(wait=False, cancel_futures=True)
+
+def fetch(api_key=None, oauth_token=None, endpoint=None, params=None, cache_ttl=None):
+	# with cache_ttl, the list comes from shared_cache when it's younger than
+	# that, so gunicorn workers and dynos don't each fetch it. Entries are
+	# keyed by token, since what a list holds depends on who asks: they're
+	# shared between the processes serving one user, never between users
+	if cache_ttl:
+		key = "fetch:{}:{}:{}".format(shared_cache.token_key(api_key or oauth_token), endpoint, json.dumps(params, sort_keys=True))
+		return shared_cache.cache().get(key, lambda: fetch(api_key=api_key, oauth_token=oauth_token, endpoint=endpoint, params=params), cache_ttl)
+	return list(iter_fetch(api_key=api_key, oauth_token=oauth_token, endpoint=endpoint, params=params))
+
+def fetch_incidents(api_key=None, oauth_token=None, cache_ttl=None):
+	return fetch(api_key=api_key, oauth_token=oauth_token, endpoint="incidents", params={"statuses[]": ["triggered", "acknowledged"]}, cache_ttl=cache_ttl)
+
+def fetch_users(api_key=None, oauth_token=None, params=None, cache_ttl=None):
+	return fetch(api_key=api_key, oauth_token=oauth_token, endpoint="users", params=params, cache_ttl=cache_ttl)
+
+def fetch_escalation_policies(api_key=None, oauth_token=None, params=None, cache_ttl=None):
+	return fetch(api_key=api_key, oauth_token=oauth_token, endpoint="escalation_policies", params=params, cache_ttl=cache_ttl)
+
+def fetch_services(api_key=None, oauth_token=None, params=None, cache_ttl=None):
+	return fetch(api_key=api_key, oauth_token=oauth_token, endpoint="services", params=params, cache_ttl=cache_ttl)
+
+def iter_services(api_key=None, oauth_token=None, params=None):
+	return iter_fetch(api_key=api_key, oauth_token=oauth_token, endpoint="services", params=params)
+
+def _fetch_me(oauth_token):
+	user = request(oauth_token=oauth_token, endpoint="users/me")["user"]
+	_me_cache.set(oauth_token, (user, time.monotonic()))
+	return user
 
-def fetch_incidents(api_key=None, oauth_token=None):
-	return fetch(api_key=api_key, oauth_token=oauth_token, endpoint="incidents", params={"statuses[]": ["triggered", "acknowledged"]})
+def _refresh_me(oauth_token):
+	with _me_lock:
+		if oauth_token in _me_refreshing:
+			return
+		_me_refreshing.add(oauth_token)
 
-def fetch_users(api_key=None, oauth_token=None, params=None):
-	return fetch(api_key=api_key, oauth_token=oauth_token, endpoint="users", params=params)
+	def run():
+		try:
+			_fetch_me(oauth_token)
+		except PDError as e:
+			print("refreshing users/me failed: {}".format(e))
+		finally:
+			with _me_lock:
+				_me_refreshing.discard(oauth_token)
 
-def fetch_escalation_policies(api_key=None, oauth_token=None, params=None):
-	return fetch(api_key=api_key, oauth_token=oauth_token, endpoint="escalation_policies", params=params)
+	threading.Thread(target=run, daemon=True).start()
 
-def fetch_services(api_key=None, oauth_token=None, params=None):
-	return fetch(api_key=api_key, oauth_token=oauth_token, endpoint="services", params=params)
\ No newline at end of file
+def me(oauth_token, fallback=None):
+	# the PD user that owns the token. Cached entries older than ME_TTL are
+	# served while being refreshed in the background; fallback (e.g. the
+	# identity saved with the user mapping) is served the same way on a miss
+	entry = _me_cache.get(oauth_token)
+	if entry:
+		(user, fetched_at) = entry
+		if time.monotonic() - fetched_at > ME_TTL:
+			_refresh_me(oauth_token)
+		return user
+	if fallback:
+		_refresh_me(oauth_token)
+		return fallback
+	return _fetch_me(oauth_token)
@@ -0,0 +1,198 @@
+import asyncio
+import atexit
+import json
+import threading
+import time
+import aiohttp
+
+import metrics
+import pd
+from pd import PDError
+
+# asyncio counterpart of pd: same request/fetch/fetch_* surface, plus an
+# async paginator, on one aiohttp connection pool. Sync code (command
+# handlers run on worker threads) uses run() to hand coroutines to a single
+# background event loop, so every caller shares that loop's pool, and
+# gather() to wait for independent lookups together, e.g.
+#
+#	(service, incidents) = pd_aio.gather(
+#		pd_aio.request(oauth_token=token, endpoint="services/{}".format(id)),
+#		pd_aio.fetch(oauth_token=token, endpoint="incidents", params={"service_ids[]": [id]})
+#	)
+
+_loop = None
+_loop_lock = threading.Lock()
+_session = None
+
+
+def loop():
+	global _loop
+	if _loop is None:
+		with _loop_lock:
+			if _loop is None:
+				new_loop = asyncio.new_event_loop()
+				threading.Thread(target=new_loop.run_forever, name="pd-aio", daemon=True).start()
+				_loop = new_loop
+	return _loop
+
+def run(coro, timeout=None):
+	# run a coroutine on the shared loop from sync code and wait for its result
+	return asyncio.run_coroutine_threadsafe(coro, loop()).result(timeout)
+
+async def _gather(coros, return_exceptions):
+	return await asyncio.gather(*coros, return_exceptions=return_exceptions)
+
+def gather(*coros, return_exceptions=False, timeout=None):
+	# run coroutines concurrently on the shared loop and return their results in order
+	return run(_gather(coros, return_exceptions), timeout)
+
+def session():
+	global _session
+	if _session is None or _session.closed:
+		_session = aiohttp.ClientSession(
+			connector=aiohttp.TCPConnector(limit=pd.POOL_SIZE),
+			timeout=aiohttp.ClientTimeout(total=pd.TIMEOUT)
+		)
+	return _session
+
+async def _close():
+	if _session is not None and not _session.closed:
+		await _session.close()
+
+@atexit.register
+def close():
+	if _loop is not None and _loop.is_running():
+		try:
+			run(_close(), timeout=5)
+		except Exception:
+			pass
+
+def query_params(params):
+	# aiohttp wants flat (key, value) pairs, e.g. for statuses[]
+	if not params:
+		return None
+	pairs = []
+	for (key, value) in params.items():
+		for v in (value if isinstance(value, (list, tuple)) else [value]):
+			pairs.append((key, str(v).lower() if isinstance(v, bool) else str(v)))
+	return pairs
+
+async def request(api_key=None, oauth_token=None, endpoint=None, method="GET", params=None, data=None, addheaders=None):
+
+	if not api_key and not oauth_token:
+		return None
+	if not endpoint:
+		return None
+
+	endpoint = endpoint.lstrip('/')
+	url = '/'.join([pd.BASE_URL, endpoint])
+	headers = {
+		"Accept": "application/vnd.pagerduty+json;version=2",
+	}
+
+	if api_key:
+		headers["Authorization"] = "Token token={}".format(api_key)
+	else:
+		headers["Authorization"] = "Bearer {}".format(oauth_token)
+
+	if addheaders:
+		headers.update(addheaders)
+
+	template = metrics.endpoint_template(endpoint)
+	started = time.perf_counter()
+	attempt = 0
+	while True:
+		delay = pd.throttle_delay(api_key or oauth_token, method, template)
+		if delay:
+			await asyncio.sleep(delay)
+		try:
+			async with session().request(method, url, headers=headers, params=query_params(params), json=data) as response:
+				if response.status in pd.RETRY_STATUSES and attempt < pd.MAX_RETRIES and pd.should_retry(method, status=response.status):
+					metrics.pd_retries.inc(method=method, endpoint=template, reason=response.status)
+					await asyncio.sleep(pd.retry_delay(attempt, response))
+					attempt += 1
+					continue
+				text = await response.text()
+				status = response.status
+		except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+			# ClientConnectorError means the connection was never made
+			if attempt >= pd.MAX_RETRIES or not (method in pd.IDEMPOTENT_METHODS or isinstance(e, aiohttp.ClientConnectorError)):
+				metrics.pd_requests.inc(method=method, endpoint=template, status="error")
+				raise PDError(None, method, endpoint, str(e)) from e
+			metrics.pd_retries.inc(method=method, endpoint=template, reason="connection")
+			await asyncio.sleep(pd.retry_delay(attempt))
+			attempt += 1
+			continue
+		break
+
+	metrics.pd_request_seconds.observe(time.perf_counter() - started, method=method, endpoint=template)
+	metrics.pd_requests.inc(method=method, endpoint=template, status=status)
+
+	try:
+		body = json.loads(text) if text else {}
+	except ValueError:
+		body = text
+
+	if status >= 400:
+		raise PDError(status, method, endpoint, body)
+	return body
+
+async def iter_fetch(api_key=None, oauth_token=None, endpoint=None, params=None, concurrency=pd.FETCH_CONCURRENCY):
+	# like pd.iter_fetch: first page with total=true, then the other offsets
+	# concurrently (at most concurrency at a time), yielded in order
+	my_params = {"limit": pd.PAGE_LIMIT}
+	if params:
+		my_params.update(params)
+	my_params["total"] = "true"
+	semaphore = asyncio.Semaphore(max(1, concurrency))
+
+	async def fetch_page(offset):
+		page_params = my_params.copy()
+		page_params["offset"] = offset
+		async with semaphore:
+			return await request(api_key=api_key, oauth_token=oauth_token, endpoint=endpoint, params=page_params)
+
+	r = await request(api_key=api_key, oauth_token=oauth_token, endpoint=endpoint, params=my_params)
+	for obj in r[endpoint]:
+		yield obj
+	if not r["more"]:
+		return
+
+	limit = r["limit"]
+	offset = r.get("offset", 0) + limit
+	total = r.get("total")
+	if total is None:
+		while True:
+			r = await fetch_page(offset)
+			for obj in r[endpoint]:
+				yield obj
+			if not r["more"]:
+				return
+			offset += r["limit"]
+
+	tasks = [asyncio.ensure_future(fetch_page(o)) for o in range(offset, total, limit)]
+	try:
+		for task in tasks:
+			for obj in (await task)[endpoint]:
+				yield obj
+	finally:
+		for task in tasks:
+			task.cancel()
+
+async def fetch(api_key=None, oauth_token=None, endpoint=None, params=None):
+	return [obj async for obj in iter_fetch(api_key=api_key, oauth_token=oauth_token, endpoint=endpoint, params=params)]
+
+async def fetch_incidents(api_key=None, oauth_token=None):
+	return await fetch(api_key=api_key, oauth_token=oauth_token, endpoint="incidents", params={"statuses[]": ["triggered", "acknowledged"]})
+
+async def fetch_users(api_key=None, oauth_token=None, params=None):
+	return await fetch(api_key=api_key, oauth_token=oauth_token, endpoint="users", params=params)
+
+async def fetch_escalation_policies(api_key=None, oauth_token=None, params=None):
+	return await fetch(api_key=api_key, oauth_token=oauth_token, endpoint="escalation_policies", params=params)
+
+async def fetch_services(api_key=None, oauth_token=None, params=None):
+	return await fetch(api_key=api_key, oauth_token=oauth_token, endpoint="services", params=params)
+
+def iter_services(api_key=None, oauth_token=None, params=None):
+	return iter_fetch(api_key=api_key, oauth_token=oauth_token, endpoint="services", params=params)
@@ -0,0 +1,103 @@
+import copy
+import threading
+import time
+
+from cache import TTLCache
+
+
+class TokenBucket:
+	# rate tokens per second, up to burst saved up. reserve() always takes a
+	# token and returns how long the caller should wait before using it, so
+	# threads and coroutines can share one bucket and sleep their own way
+
+	def __init__(self, rate, burst):
+		self.rate = rate
+		self.burst = burst
+		self._tokens = burst
+		self._updated = time.monotonic()
+		self._lock = threading.Lock()
+
+	def reserve(self):
+		with self._lock:
+			now = time.monotonic()
+			self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+			self._updated = now
+			self._tokens -= 1
+			if self._tokens >= 0:
+				return 0
+			return -self._tokens / self.rate
+
+
+class Limiter:
+	# one TokenBucket per key (e.g. per API token), created on first use;
+	# buckets idle for an hour are dropped
+
+	def __init__(self, rate, burst, maxsize=10000, idle=3600):
+		self.rate = rate
+		self.burst = burst
+		self._buckets = TTLCache(maxsize=maxsize, ttl=idle)
+		self._lock = threading.Lock()
+
+	def reserve(self, key):
+		if self.rate <= 0:
+			return 0
+		# every use keeps a busy key's bucket from expiring and coming back full
+		bucket = self._buckets.get(key, refresh=True)
+		if bucket is None:
+			with self._lock:
+				bucket = self._buckets.get(key, refresh=True)
+				if bucket is None:
+					bucket = TokenBucket(self.rate, self.burst)
+					self._buckets.set(key, bucket)
+		return bucket.reserve()
+
+
+class _Call:
+	__slots__ = ('done', 'result', 'error', 'waiters')
+
+	def __init__(self):
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+		self.waiters = 0
+
+
+class SingleFlight:
+	# concurrent do() calls with the same key share one call of fn. When the
+	# call was shared, every caller gets its own copy of the result so nobody
+	# sees another thread's changes to it
+
+	def __init__(self):
+		self._calls = {}
+		self._lock = threading.Lock()
+
+	def do(self, key, fn, *args, **kwargs):
+		# returns (result, shared) where shared says whether this caller
+		# joined a call that another caller made
+		with self._lock:
+			call = self._calls.get(key)
+			if call is None:
+				call = self._calls[key] = _Call()
+				leader = True
+			else:
+				call.waiters += 1
+				leader = False
+
+		if leader:
+			try:
+				call.result = fn(*args, **kwargs)
+			except BaseException as e:
+				call.error = e
+			with self._lock:
+				# nobody can join once the call is out of the map
+				del self._calls[key]
+				waiters = call.waiters
+			call.done.set()
+			if call.error is not None:
+				raise call.error
+			return (copy.deepcopy(call.result) if waiters else call.result, False)
+
+		call.done.wait()
+		if call.error is not None:
+			raise call.error
+		return (copy.deepcopy(call.result), True)
@@ -0,0 +1,177 @@
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+
+import pd_aio
+from workers import WorkerPool
+
+RECONCILE_INTERVAL = int(os.environ.get('SERVICE_STATUS_RECONCILE', 600))
+# how long webhook updates are remembered, longer than any crawl takes
+UPDATES_KEPT = 3600
+
+subdomain_re = re.compile(r"https://([^\.]+)")
+
+# PD v2 webhook event -> status of the incident afterwards
+incident_events = {
+	"incident.trigger": "triggered",
+	"incident.unacknowledge": "triggered",
+	"incident.escalate": None,
+	"incident.assign": None,
+	"incident.delegate": None,
+	"incident.acknowledge": "acknowledged",
+	"incident.resolve": "resolved"
+}
+
+reconciler = WorkerPool(name="service-status", workers=2, queue_size=100)
+
+loading_text = "Still loading the services in *{}*, please try again in a few seconds."
+
+
+def service_entry(service):
+	return {
+		"id": service["id"],
+		"type": service.get("type"),
+		"summary": service.get("summary") or service.get("name"),
+		"name": service.get("name") or service.get("summary"),
+		"html_url": service.get("html_url"),
+		"status": service.get("status")
+	}
+
+
+class ServiceStatusStore:
+	# Status of the services in one PD subdomain, seeded by crawls and then
+	# kept current by incident webhooks. Open incidents are tracked per
+	# service so that resolving one of several incidents leaves the service
+	# critical or warning as PD would. Every user's crawl only covers the
+	# services their token can see, and list() only shows them those.
+
+	def __init__(self, subdomain):
+		self.subdomain = subdomain
+		self.services = {}
+		self.base_status = {}
+		self.open_incidents = defaultdict(dict)
+		# incident id -> (when, service id, status) for every webhook update,
+		# so a crawl that was running meanwhile doesn't undo it
+		self.updates = {}
+		# pd_userid -> ids of the services that user's token returned
+		self.visible = {}
+		self.reconciled = {}
+		self.lock = threading.Lock()
+
+	def _derive(self, service_id):
+		base = self.base_status.get(service_id)
+		if base in ("disabled", "maintenance"):
+			return base
+		statuses = self.open_incidents[service_id].values()
+		if "triggered" in statuses:
+			return "critical"
+		if "acknowledged" in statuses:
+			return "warning"
+		return "active"
+
+	def apply_incident(self, event, incident):
+		service = incident.get("service") or {}
+		if not service.get("id"):
+			return
+		status = incident_events[event] or incident.get("status")
+		with self.lock:
+			self.updates[incident["id"]] = (time.monotonic(), service["id"], status)
+			if service["id"] not in self.services:
+				self.services[service["id"]] = service_entry(service)
+			if status in ("triggered", "acknowledged"):
+				self.open_incidents[service["id"]][incident["id"]] = status
+			else:
+				self.open_incidents[service["id"]].pop(incident["id"], None)
+			self.services[service["id"]]["status"] = self._derive(service["id"])
+
+	def reconcile(self, pd_userid, pd_token):
+		started = time.monotonic()
+		(services, incidents) = pd_aio.gather(
+			pd_aio.fetch_services(oauth_token=pd_token),
+			pd_aio.fetch_incidents(oauth_token=pd_token)
+		)
+		ids = set(service["id"] for service in services)
+		open_incidents = defaultdict(dict)
+		for incident in incidents:
+			open_incidents[incident["service"]["id"]][incident["id"]] = incident["status"]
+		with self.lock:
+			# webhooks that came in while we were crawling are newer than
+			# what the crawl saw
+			for (incident_id, (updated, service_id, status)) in self.updates.items():
+				if updated >= started:
+					if status in ("triggered", "acknowledged"):
+						open_incidents[service_id][incident_id] = status
+					else:
+						open_incidents[service_id].pop(incident_id, None)
+			# only the services this token can see are replaced; other users'
+			# crawls are left as they are
+			for service in services:
+				self.services[service["id"]] = service_entry(service)
+				self.base_status[service["id"]] = service.get("status")
+				self.open_incidents[service["id"]] = open_incidents.get(service["id"], {})
+				self.services[service["id"]]["status"] = self._derive(service["id"])
+			self.visible[pd_userid] = ids
+			self.reconciled[pd_userid] = time.monotonic()
+			self.updates = {id: update for (id, update) in self.updates.items() if update[0] > started - UPDATES_KEPT}
+
+	def list(self, pd_userid, statuses=None):
+		with self.lock:
+			visible = self.visible.get(pd_userid, ())
+			services = [dict(self.services[id]) for id in visible if id in self.services and (not statuses or self.services[id]["status"] in statuses)]
+		return sorted(services, key=lambda service: (service["summary"] or "").lower())
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+_pending = set()
+
+def store(subdomain):
+	with _stores_lock:
+		if subdomain not in _stores:
+			_stores[subdomain] = ServiceStatusStore(subdomain)
+		return _stores[subdomain]
+
+def schedule_reconcile(user):
+	key = (user["pd_subdomain"], user["pd_userid"])
+	with _stores_lock:
+		if key in _pending:
+			return
+		_pending.add(key)
+
+	def run():
+		try:
+			store(user["pd_subdomain"]).reconcile(user["pd_userid"], user["pd_token"])
+		finally:
+			with _stores_lock:
+				_pending.discard(key)
+
+	if not reconciler.submit(run, label="reconcile {}".format(user["pd_subdomain"])):
+		with _stores_lock:
+			_pending.discard(key)
+
+def apply_webhook(payload):
+	# payload is a PD v2 webhook body: {"messages": [{"event": ..., "incident": {...}}]}
+	for message in payload.get("messages") or []:
+		event = message.get("event")
+		incident = message.get("incident")
+		if event not in incident_events or not incident:
+			continue
+		m = subdomain_re.match(incident.get("html_url") or "")
+		if m:
+			store(m.groups()[0]).apply_incident(event, incident)
+
+def services(user, statuses=None):
+	# Services the user can see, optionally only those in statuses, from the
+	# local store. Returns None while the user's first crawl is running in the
+	# background, so callers can say they're still loading; after that the
+	# user's view is reconciled in the background every RECONCILE_INTERVAL
+	# seconds.
+	s = store(user["pd_subdomain"])
+	reconciled = s.reconciled.get(user["pd_userid"])
+	if reconciled is None or time.monotonic() - reconciled > RECONCILE_INTERVAL:
+		schedule_reconcile(user)
+	if reconciled is None:
+		return None
+	return s.list(user["pd_userid"], statuses)
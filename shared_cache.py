@@ -0,0 +1,273 @@
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from mongoengine import Document, StringField, BinaryField, FloatField, DateTimeField, NotUniqueError
+
+import metrics
+from cache import TTLCache
+from ratelimit import SingleFlight
+from workers import WorkerPool
+
+BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+SQLITE_PATH = os.environ.get('CACHE_SQLITE_PATH', '/tmp/martbot-cache.sqlite')
+LOCAL_SIZE = int(os.environ.get('CACHE_LOCAL_SIZE', 1000))
+# how long past its ttl a value may still be served while it is refetched
+STALE = int(os.environ.get('CACHE_STALE', 600))
+LEASE = 30
+
+
+def dumps(value):
+	return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+def loads(blob):
+	return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+def token_key(token):
+	# keys end up in shared storage, tokens shouldn't
+	return hashlib.sha256(token.encode('utf-8')).hexdigest()[:20]
+
+
+# Backends store (blob, stored_at) under a string key until expires (epoch
+# seconds), and grant leases: lease(key, ttl) returns an owner token to
+# exactly one caller until the lease expires, in every process that shares
+# the backend, and None to the others. release(key, owner) only drops the
+# lease if it is still the owner's, so a refresh that outlived its lease
+# can't drop the next holder's
+
+def owner():
+	return uuid.uuid4().hex
+
+
+class MemoryBackend:
+
+	def __init__(self, maxsize=LOCAL_SIZE):
+		self._data = TTLCache(maxsize=maxsize, ttl=3600)
+		self._lock = threading.Lock()
+
+	def get(self, key):
+		return self._data.get(key)
+
+	def set(self, key, blob, stored_at, expires):
+		self._data.set(key, (blob, stored_at), ttl=expires - time.time())
+
+	def lease(self, key, ttl):
+		with self._lock:
+			if ("lease", key) in self._data:
+				return None
+			token = owner()
+			self._data.set(("lease", key), token, ttl=ttl)
+			return token
+
+	def release(self, key, token):
+		with self._lock:
+			if self._data.get(("lease", key)) == token:
+				self._data.delete(("lease", key))
+
+
+class CachedValue(Document):
+	key = StringField(primary_key=True)
+	value = BinaryField()
+	stored_at = FloatField()
+	expires_at = DateTimeField()
+	# who holds a lease
+	owner = StringField()
+	meta = {
+		'collection': 'pd_cache',
+		'indexes': [
+			{'fields': ['expires_at'], 'expireAfterSeconds': 0}
+		]
+	}
+
+
+class MongoBackend:
+	# shared by every worker and dyno on the same MONGODB_URI; Mongo's TTL
+	# monitor removes expired entries
+
+	def get(self, key):
+		entry = CachedValue.objects(key=key, expires_at__gt=datetime.datetime.utcnow()).only('value', 'stored_at').first()
+		if entry:
+			return (entry.value, entry.stored_at)
+
+	def set(self, key, blob, stored_at, expires):
+		CachedValue.objects(key=key).update_one(
+			upsert=True,
+			set__value=blob,
+			set__stored_at=stored_at,
+			set__expires_at=datetime.datetime.utcfromtimestamp(expires)
+		)
+
+	def lease(self, key, ttl):
+		# the upsert only matches an expired lease, so while one is held it
+		# tries to insert a second document with the same key and fails
+		now = datetime.datetime.utcnow()
+		token = owner()
+		try:
+			CachedValue.objects(key="lease:" + key, expires_at__lt=now).update_one(
+				upsert=True,
+				set__owner=token,
+				set__expires_at=now + datetime.timedelta(seconds=ttl)
+			)
+			return token
+		except NotUniqueError:
+			return None
+
+	def release(self, key, token):
+		CachedValue.objects(key="lease:" + key, owner=token).delete()
+
+
+class SQLiteBackend:
+	# shared by the workers on one host through a local file
+
+	def __init__(self, path=SQLITE_PATH):
+		self.path = path
+		self._local = threading.local()
+		self._pruned = 0
+		with self._db() as db:
+			db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, stored_at REAL, expires_at REAL)")
+
+	def _db(self):
+		# one connection per thread (and per process, after a fork)
+		db = getattr(self._local, 'db', None)
+		if db is None or self._local.pid != os.getpid():
+			db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+			db.execute("PRAGMA journal_mode=WAL")
+			db.execute("PRAGMA synchronous=NORMAL")
+			self._local.db = db
+			self._local.pid = os.getpid()
+		return db
+
+	def get(self, key):
+		row = self._db().execute("SELECT value, stored_at FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+		if row:
+			return (row[0], row[1])
+
+	def set(self, key, blob, stored_at, expires):
+		db = self._db()
+		db.execute("INSERT OR REPLACE INTO cache (key, value, stored_at, expires_at) VALUES (?, ?, ?, ?)", (key, blob, stored_at, expires))
+		now = time.time()
+		if now - self._pruned > 60:
+			self._pruned = now
+			db.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+
+	def lease(self, key, ttl):
+		# a lease's value is its owner
+		now = time.time()
+		token = owner()
+		cursor = self._db().execute(
+			"INSERT INTO cache (key, value, stored_at, expires_at) VALUES (?, ?, ?, ?) "
+			"ON CONFLICT(key) DO UPDATE SET value = excluded.value, stored_at = excluded.stored_at, expires_at = excluded.expires_at WHERE cache.expires_at < ?",
+			("lease:" + key, token, now, now + ttl, now)
+		)
+		return token if cursor.rowcount == 1 else None
+
+	def release(self, key, token):
+		self._db().execute("DELETE FROM cache WHERE key = ? AND value = ?", ("lease:" + key, token))
+
+
+class TieredCache:
+	# An in-process LRU in front of a shared backend. Values are stored
+	# compressed in both tiers, so every caller decodes its own copy. A value
+	# older than its ttl but within stale seconds of it is still returned
+	# while one process, holding the backend's lease, refetches it.
+
+	def __init__(self, shared=None, local_size=LOCAL_SIZE, stale=STALE):
+		self.local = MemoryBackend(local_size)
+		self.shared = shared
+		self.stale = stale
+		self._inflight = SingleFlight()
+		self._refresher = WorkerPool(name="cache-refresh", workers=2, queue_size=100)
+
+	def _shared(self, op, *args):
+		# the shared tier is an optimization, so if it's down carry on without it
+		try:
+			return getattr(self.shared, op)(*args)
+		except Exception as e:
+			print("shared cache {} failed: {}".format(op, e))
+
+	def _lookup(self, key, ttl):
+		entry = self.local.get(key)
+		if entry is not None and time.time() - entry[1] < ttl:
+			return entry
+		if self.shared is not None:
+			# another worker may have refreshed it already
+			shared = self._shared('get', key)
+			if shared is not None and (entry is None or shared[1] > entry[1]):
+				self.local.set(key, shared[0], shared[1], shared[1] + ttl + self.stale)
+				entry = shared
+		return entry
+
+	def _store(self, key, value, ttl):
+		stored_at = time.time()
+		blob = dumps(value)
+		expires = stored_at + ttl + self.stale
+		self.local.set(key, blob, stored_at, expires)
+		if self.shared is not None:
+			self._shared('set', key, blob, stored_at, expires)
+
+	def _fetch(self, key, fetch, ttl):
+		value = fetch()
+		self._store(key, value, ttl)
+		return value
+
+	def _revalidate(self, key, fetch, ttl):
+		# only the process that gets the lease refetches; the others keep
+		# serving the stale value until the new one shows up in the shared tier
+		if self.shared is not None:
+			lease = self._shared('lease', key, LEASE)
+			release = lambda: self._shared('release', key, lease)
+		else:
+			lease = self.local.lease(key, LEASE)
+			release = lambda: self.local.release(key, lease)
+		if not lease:
+			return
+
+		def run():
+			try:
+				self._fetch(key, fetch, ttl)
+			finally:
+				release()
+
+		if not self._refresher.submit(run, label="refresh {}".format(key)):
+			release()
+
+	def get(self, key, fetch, ttl):
+		# the cached value for key, calling fetch() when there is none
+		entry = self._lookup(key, ttl)
+		if entry is not None:
+			(blob, stored_at) = entry
+			age = time.time() - stored_at
+			if age < ttl:
+				metrics.cache_lookups.inc(result="fresh")
+				return loads(blob)
+			if age < ttl + self.stale:
+				metrics.cache_lookups.inc(result="stale")
+				self._revalidate(key, fetch, ttl)
+				return loads(blob)
+		metrics.cache_lookups.inc(result="miss")
+		(value, shared) = self._inflight.do(key, self._fetch, key, fetch, ttl)
+		return value
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def cache():
+	# the process-wide cache, with the shared tier chosen by CACHE_BACKEND
+	# (memory, mongo or sqlite)
+	global _cache
+	if _cache is None:
+		with _cache_lock:
+			if _cache is None:
+				shared = None
+				if BACKEND == 'mongo':
+					shared = MongoBackend()
+				elif BACKEND == 'sqlite':
+					shared = SQLiteBackend()
+				_cache = TieredCache(shared)
+	return _cache
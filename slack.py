@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+import time
+import requests
+from functools import partial
+from requests.adapters import HTTPAdapter
+
+import metrics
+from cache import TTLCache
+from outbox import Outbox
+from pd import never_sent, retry_delay
+
+API_URL = os.environ.get('SLACK_API_URL', 'https://slack.com/api')
+POOL_SIZE = int(os.environ.get('SLACK_POOL_SIZE', 20))
+MAX_RETRIES = int(os.environ.get('SLACK_MAX_RETRIES', 3))
+TIMEOUT = float(os.environ.get('SLACK_TIMEOUT', 10))
+MAX_RETRY_AFTER = 30
+CHANNEL_RATE = float(os.environ.get('SLACK_CHANNEL_RATE', 1))
+CHANNEL_BURST = int(os.environ.get('SLACK_CHANNEL_BURST', 3))
+OUTBOX_THREADS = int(os.environ.get('SLACK_OUTBOX_THREADS', 4))
+
+_session = None
+_session_lock = threading.Lock()
+
+# token -> SlackAPI; tokens stay valid for as long as the app is installed
+_clients = TTLCache(maxsize=10000, ttl=24 * 3600)
+_clients_lock = threading.Lock()
+
+# messages to channels go out through here, about one per second per channel
+outbox = Outbox(name="slack_outbox", rate=CHANNEL_RATE, burst=CHANNEL_BURST, senders=OUTBOX_THREADS)
+
+
+def session():
+	# one keep-alive pool to slack.com and hooks.slack.com for every thread
+	global _session
+	if _session is None:
+		with _session_lock:
+			if _session is None:
+				s = requests.Session()
+				adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+				s.mount('https://', adapter)
+				s.mount('http://', adapter)
+				_session = s
+	return _session
+
+def idempotent(method):
+	# Web API calls that can safely be made twice; a postMessage that timed
+	# out may have been posted already
+	return method in ("chat.update", "chat.delete") or method.endswith((".info", ".list", ".history", ".test"))
+
+def retry_after(response):
+	try:
+		return min(float(response.headers.get('Retry-After', 1)), MAX_RETRY_AFTER)
+	except ValueError:
+		return 1
+
+
+class SlackAPI:
+	# Web API client for one token, a drop-in for slackclient's
+	# SlackClient.api_call. Slack rate limits per method, so a 429 on one
+	# method holds back later calls to that method only.
+
+	def __init__(self, token):
+		self.token = token
+		self._blocked = {}
+
+	def api_call(self, method, **kwargs):
+		return self.call(method, kwargs)
+
+	def call(self, method, kwargs, ratelimit_retries=MAX_RETRIES):
+		with metrics.slack_request_seconds.time(method=method):
+			body = self._api_call(method, kwargs, ratelimit_retries)
+		metrics.slack_requests.inc(method=method, status="ok" if body.get("ok") else body.get("error"))
+		return body
+
+	def send(self, method, **kwargs):
+		# api_call through the outbox, for posting and updating messages;
+		# returns a Future for the response body. Queued chat.updates of the
+		# same message collapse into the latest one. The outbox retries 429s
+		# itself, so they aren't retried here as well
+		channel = kwargs.get("channel")
+		key = (self.token, channel, kwargs.get("ts")) if method == "chat.update" else None
+		return outbox.put(channel, method, partial(self.call, method, kwargs, 0), key=key, retry=ratelimited)
+
+	def _api_call(self, method, kwargs, ratelimit_retries):
+		data = {k: json.dumps(v) if isinstance(v, (dict, list)) else v for (k, v) in kwargs.items() if v is not None}
+		headers = {"Authorization": "Bearer {}".format(self.token)}
+		url = "{}/{}".format(API_URL, method)
+
+		attempt = 0
+		while True:
+			wait = self._blocked.get(method, 0) - time.monotonic()
+			if wait > 0:
+				time.sleep(wait)
+			try:
+				response = session().post(url, data=data, headers=headers, timeout=TIMEOUT)
+			except (requests.ConnectionError, requests.Timeout) as e:
+				if attempt >= MAX_RETRIES or not (idempotent(method) or never_sent(e)):
+					print("slack {} failed: {}".format(method, e))
+					# a fixed error, since it ends up as a metrics label
+					return {"ok": False, "error": "timeout" if isinstance(e, requests.Timeout) else "connection_error"}
+				time.sleep(retry_delay(attempt))
+				attempt += 1
+				continue
+			if response.status_code == 429:
+				self._blocked[method] = time.monotonic() + retry_after(response)
+				if attempt < ratelimit_retries:
+					attempt += 1
+					continue
+				return {"ok": False, "error": "ratelimited"}
+			try:
+				body = response.json()
+			except ValueError:
+				body = {"ok": False, "error": "HTTP {}".format(response.status_code)}
+			if not body.get("ok"):
+				print("slack {} failed: {}".format(method, body.get("error")))
+			return body
+
+
+def ratelimited(body):
+	return body.get("error") == "ratelimited"
+
+def client(token):
+	api = _clients.get(token)
+	if api is None:
+		with _clients_lock:
+			api = _clients.get(token)
+			if api is None:
+				api = SlackAPI(token)
+				_clients.set(token, api)
+	return api
+
+def respond(response_url, body, ratelimit_retries=MAX_RETRIES):
+	# post a message to an interaction's response_url
+	with metrics.slack_request_seconds.time(method="response_url"):
+		response = _respond(response_url, body, ratelimit_retries)
+	metrics.slack_requests.inc(method="response_url", status=response.status_code if response is not None else "error")
+	return response
+
+def send_response(response_url, body, channel=None):
+	# respond through the outbox, in order with channel's other messages;
+	# queued replace_original responses to the same interaction collapse
+	# into the latest one. response_urls aren't chat.postMessage calls and
+	# don't count against the channel's rate limit, so they aren't paced
+	key = response_url if body.get("replace_original") else None
+	return outbox.put(channel or response_url, "response_url", respond, response_url, body, 0, key=key, retry=respond_ratelimited, paced=False)
+
+def respond_ratelimited(response):
+	return response is not None and response.status_code == 429
+
+def _respond(response_url, body, ratelimit_retries):
+	attempt = 0
+	while True:
+		try:
+			response = session().post(response_url, json=body, headers={'Content-type': 'application/json'}, timeout=TIMEOUT)
+		except (requests.ConnectionError, requests.Timeout) as e:
+			# a response that replaces the original is the same message however
+			# often it's posted, anything else could show up twice
+			if attempt >= MAX_RETRIES or not (body.get("replace_original") or never_sent(e)):
+				print("posting to response_url failed: {}".format(e))
+				return None
+			time.sleep(retry_delay(attempt))
+			attempt += 1
+			continue
+		if response.status_code == 429 and attempt < ratelimit_retries:
+			time.sleep(retry_after(response))
+			attempt += 1
+			continue
+		if not response.ok:
+			print("posting to response_url failed: HTTP {} {}".format(response.status_code, response.text))
+		return response
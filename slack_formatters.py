@@ -1,8 +1,8 @@
 import re
-import dateparser
-from dotmap import DotMap
+import datetime
+from functools import lru_cache
 
-import pd
+import oncall_index
 
 incident_status_emoji = {
 	"acknowledged": ":warning:",
@@ -18,30 +18,51 @@ service_status_emoji = {
 	"disabled": ":black_square_for_stop:"
 }
 
+subdomain_re = re.compile(r"https://([^\.]+)")
+
+def parse_time(value):
+	# PD always sends ISO-8601, so only fall back to dateparser (slow to import
+	# and to run) for free text
+	try:
+		return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+	except ValueError:
+		import dateparser
+		return dateparser.parse(value)
+
+@lru_cache(maxsize=4096)
+def date_token(value):
+	# Slack <!date> token that shows value in the reader's own timezone
+	parsed = parse_time(value)
+	return "<!date^{}^{{date_num}} {{time}}|{}>".format(int(parsed.timestamp()), parsed)
+
+@lru_cache(maxsize=4096)
+def subdomain(html_url):
+	return subdomain_re.match(html_url).groups()[0]
+
+
 def make_incident_attachments(incident):
 	# call with incident as whatever is in the incident body; it could be
 	# response['incident'] in the case of GET /incidents/{id}, or 
 	# response['incidents'][0] in the case of PUT /incidents
-	incident = DotMap(incident)
-	incident_id = incident.id
+	incident_id = incident["id"]
+	status = incident["status"]
+	service = incident.get("service") or {}
 
-	incident_link = "*<{}|[#{}]>* {}".format(incident.html_url, incident.incident_number, incident.title)
-	response = "{} {}".format(incident_status_emoji[incident.status], incident_link)
+	incident_link = "*<{}|[#{}]>* {}".format(incident.get("html_url"), incident.get("incident_number"), incident.get("title"))
+	response = "{} {}".format(incident_status_emoji[status], incident_link)
 
-	created = dateparser.parse(incident.created_at)
-	createdts = int(created.timestamp())
-	incident_datestr = "<!date^{}^{{date_num}} {{time}}|{}>".format(createdts, created)
+	incident_datestr = date_token(incident["created_at"])
 
-	assignments = ", ".join(["<{}|{}>".format(a.assignee.html_url, a.assignee.summary) for a in incident.assignments])
+	assignments = ", ".join(["<{}|{}>".format(a["assignee"].get("html_url"), a["assignee"].get("summary")) for a in incident.get("assignments") or []])
 	fields = [
 		{
 			"title": "Status",
-			"value": incident.status.title(),
+			"value": status.title(),
 			"short": True
 		},
 		{
 			"title": "Service",
-			"value": "<{}|{}>".format(incident.service.html_url, incident.service.summary),
+			"value": "<{}|{}>".format(service.get("html_url"), service.get("summary")),
 			"short": True
 		},
 		{
@@ -53,7 +74,7 @@ def make_incident_attachments(incident):
 
 	actions = []
 
-	if incident.status == "triggered" or incident.status == "acknowledged":
+	if status == "triggered" or status == "acknowledged":
 		fields.append({
 			"title": "Assigned To",
 			"value": assignments,
@@ -93,81 +114,93 @@ def make_incident_attachments(incident):
 
 def make_ep_text(ep, include_intro=True):
 	# call with ep as the EP body, like response.get('escalation_policy')
-	ep = DotMap(ep)
-
-	ep_link = "<{}|{}>".format(ep.html_url, ep.summary)
-	subdomain = re.match(r"https://([^\.]+)", ep.html_url).groups()[0]
+	ep_link = "<{}|{}>".format(ep["html_url"], ep.get("summary"))
+	ep_subdomain = subdomain(ep["html_url"])
 
-	response = ""
+	parts = []
 
 	if include_intro:
-		response += ":arrow_forward: Escalation Policy *{}* in subdomain *{}*:\n\n".format(ep_link, subdomain)
+		parts.append(":arrow_forward: Escalation Policy *{}* in subdomain *{}*:\n\n".format(ep_link, ep_subdomain))
 
-	if ep.description and ep.description != ep.summary:
-		response += "Description: {}\n".format(ep.description)
+	if ep.get("description") and ep.get("description") != ep.get("summary"):
+		parts.append("Description: {}\n".format(ep["description"]))
 
-	for i, rule in enumerate(ep.escalation_rules):
+	for i, rule in enumerate(ep.get("escalation_rules") or []):
 		if i == 0:
-			response += "\t*Level 1:* Immediately after an incident is triggered, notify:\n"
+			parts.append("\t*Level 1:* Immediately after an incident is triggered, notify:\n")
 		else:
-			response += "\t*Level {}:* Notify:\n".format(i+1)
+			parts.append("\t*Level {}:* Notify:\n".format(i+1))
 
-		for oncall in rule.current_oncalls:
-			if oncall.escalation_target.type == "user_reference":
-				response += "\t\t:slightly_smiling_face: Always on call: *{}*\n".format(oncall.user.name)
+		for oncall in rule.get("current_oncalls") or []:
+			target = oncall["escalation_target"]
+			user = oncall["user"]
+			if target.get("type") == "user_reference":
+				parts.append("\t\t:slightly_smiling_face: Always on call: *{}*\n".format(user.get("name")))
 			else:
-				sch_link = "<{}|{}>".format(oncall.escalation_target.html_url, oncall.escalation_target.summary)
-				user_link = "<https://{}.pagerduty.com/users/{}|{}>".format(subdomain, oncall.user.id, oncall.user.name)
+				sch_link = "<{}|{}>".format(target.get("html_url"), target.get("summary"))
+				user_link = "<https://{}.pagerduty.com/users/{}|{}>".format(ep_subdomain, user.get("id"), user.get("name"))
 
-				response += "\t\t:date: Schedule: *{}*\n\t\t\t\t:slightly_smiling_face: On call now: *{}* ".format(sch_link, user_link)
+				parts.append("\t\t:date: Schedule: *{}*\n\t\t\t\t:slightly_smiling_face: On call now: *{}* ".format(sch_link, user_link))
+				parts.append("({} - {})\n".format(date_token(oncall["start"]), date_token(oncall["end"])))
 
-				start = dateparser.parse(oncall.start)
-				end = dateparser.parse(oncall.end)
-				startts = int(start.timestamp())
-				endts = int(end.timestamp())
+		parts.append("\t\t_Escalates after *{} minutes*_\n\n".format(rule.get("escalation_delay_in_minutes")))
 
-				response += "(<!date^{}^{{date_num}} {{time}}|{}> - <!date^{}^{{date_num}} {{time}}|{}>)\n".format(startts, start, endts, end)
-
-		response += "\t\t_Escalates after *{} minutes*_\n\n".format(rule.escalation_delay_in_minutes)
-
-	if ep.num_loops > 0:
-		response += "\t_:arrows_counterclockwise: Repeats *{} times* if no one acknowledges incidents_".format(ep.num_loops)
+	if (ep.get("num_loops") or 0) > 0:
+		parts.append("\t_:arrows_counterclockwise: Repeats *{} times* if no one acknowledges incidents_".format(ep["num_loops"]))
 	else:
-		response += "\t:arrows_counterclockwise: _Does not repeat_"
+		parts.append("\t:arrows_counterclockwise: _Does not repeat_")
 
-	return response
+	return "".join(parts)
 
 
 def make_service_text(service, expand_ep=False, pd_token=None):
 	# call with service as the service body, like response.get('service')
-	service = DotMap(service)
-	service_link = "<{}|{}>".format(service.html_url, service.summary)
-	subdomain = re.match(r"https://([^\.]+)", service.html_url).groups()[0]
-	response = ":desktop_computer: Service *{}* in subdomain *{}*:\n\n".format(service_link, subdomain)
-	if service.description and service.description != service.summary:
-		response += "Description: {}\n".format(service.description)
-	response += "Status: {} {}\n".format(service_status_emoji.get(service.status), service.status.title())
-	ep_link = "<{}|{}>".format(service.escalation_policy.html_url, service.escalation_policy.summary)
-	response += "Escalation Policy: *{}*\n".format(ep_link)
+	escalation_policy = service.get("escalation_policy") or {}
+	service_link = "<{}|{}>".format(service["html_url"], service.get("summary"))
+	parts = [":desktop_computer: Service *{}* in subdomain *{}*:\n\n".format(service_link, subdomain(service["html_url"]))]
+	if service.get("description") and service.get("description") != service.get("summary"):
+		parts.append("Description: {}\n".format(service["description"]))
+	parts.append("Status: {} {}\n".format(service_status_emoji.get(service.get("status")), service.get("status", "").title()))
+	ep_link = "<{}|{}>".format(escalation_policy.get("html_url"), escalation_policy.get("summary"))
+	parts.append("Escalation Policy: *{}*\n".format(ep_link))
+	response = "".join(parts)
+
 	if expand_ep and pd_token:
-		ep = pd.request(
-			oauth_token=pd_token,
-			endpoint="escalation_policies/{}".format(service.escalation_policy.id),
-			method="GET",
-			params={"include[]": "current_oncall"}
-		)
-		response += make_ep_text(ep.get('escalation_policy'), include_intro=False)
+		ep = oncall_index.escalation_policy(subdomain(service["html_url"]), pd_token, escalation_policy.get("id"))
+		response += make_ep_text(ep, include_intro=False)
 
 	return response
 
 
-def make_services_list(services):
+def make_service_row(service, show_status=False):
+	if show_status:
+		return "\t{} <{}|{}> ({})\n".format(service_status_emoji.get(service.get("status")), service.get("html_url"), service.get("summary"), service.get("status"))
+	return "\t{} <{}|{}>\n".format(service_status_emoji.get(service.get("status")), service.get("html_url"), service.get("summary"))
+
+def make_services_list(services, show_status=False):
 	# call with services endpoint output
 	if not services:
 		return
-	subdomain = re.match(r"https://([^\.]+)", services[0].get("html_url")).groups()[0]
-	response = ""
-	for service in services:
-		response += "\t{} <{}|{}>\n".format(service_status_emoji.get(service.get("status")), service.get("html_url"), service.get("summary"))
+	return "".join([make_service_row(service, show_status) for service in services])
+
+
+def make_shift_text(shift):
+	# one on-call shift from oncall_index: who, and from when until when
+	user_link = "<{}|{}>".format(shift["user"].get("html_url"), shift["user"].get("summary"))
+	if not shift["start"] and not shift["end"]:
+		return "*{}* (always on call)".format(user_link)
+	return "*{}* ({} - {})".format(user_link, date_token(shift["start"]) if shift["start"] else "always", date_token(shift["end"]) if shift["end"] else "always")
+
+def make_oncall_text(eps, schedules):
+	# eps as from oncall_index escalation_policy(), schedules as (schedule,
+	# shifts) pairs; shows the first level of each EP
+	parts = []
+	for ep in eps:
+		rules = ep.get("escalation_rules") or []
+		oncalls = rules[0].get("current_oncalls") if rules else []
+		names = ", ".join([make_shift_text(oncall) for oncall in oncalls]) or "nobody"
+		parts.append(":arrow_forward: <{}|{}>: {}\n".format(ep.get("html_url"), ep.get("summary"), names))
+	for (schedule, schedule_shifts) in schedules:
+		parts.append(":date: <{}|{}>: {}\n".format(schedule.get("html_url"), schedule.get("summary"), ", ".join([make_shift_text(shift) for shift in schedule_shifts]) or "nobody"))
+	return "".join(parts)
 
-	return response
\ No newline at end of file
@@ -0,0 +1,118 @@
+import re
+
+import pytest
+
+from commands import COMMANDS
+from dispatcher import Dispatcher, first_literal
+
+
+class Fake:
+
+	def __init__(self, name, patterns, priority=0, handlers=("slack_event", "slack_action", "slack_load_options", "slack_command")):
+		self.name = name
+		self.patterns = [re.compile(p) if isinstance(p, str) else p for p in patterns]
+		self.priority = priority
+		for handler in handlers:
+			setattr(self, handler, lambda *args: None)
+
+
+def linear_scan(commands, text, handler=None):
+	# what the routes did before the dispatcher: every command in priority
+	# order, the first whose patterns match and that has the handler wins
+	text = re.sub(r"^<[^\s]+> ", "", text)
+	for command in sorted(commands, key=lambda command: (-command.priority, command.name)):
+		if any(pattern.search(text) for pattern in command.patterns):
+			if not handler or callable(getattr(command, handler, None)):
+				return command
+	return None
+
+
+def example(pattern):
+	# a text the (simple) pattern matches: optional bits dropped, classes
+	# replaced by their first character
+	text = re.sub(r"\[[^\]]*\]\?|\\?.\?", "", pattern)
+	text = re.sub(r"\[(.)[^\]]*\]", r"\1", text)
+	return text.replace("^", "").replace(r"\b", "")
+
+
+def registry():
+	return [Fake(spec["name"], spec["patterns"], spec.get("priority", 0)) for spec in COMMANDS]
+
+
+def texts(commands):
+	examples = [example(pattern.pattern) for command in commands for pattern in command.patterns]
+	for (command, pattern) in [(command, pattern) for command in commands for pattern in command.patterns]:
+		assert pattern.search(example(pattern.pattern)), pattern.pattern
+	yield from ["", "hello there", "nothing to see", "<@U123>"]
+	for text in examples:
+		yield text
+		yield "<@U123> " + text
+		yield text + " something else"
+		yield "please " + text
+		# two commands in one message, so priority has to decide
+		for other in examples:
+			yield "{} {}".format(text, other)
+
+
+def test_registry_matches_linear_scan():
+	commands = registry()
+	dispatcher = Dispatcher(commands)
+	for text in texts(commands):
+		assert dispatcher.match(text) is linear_scan(commands, text), text
+
+
+def test_priority_beats_name_and_anchoring():
+	commands = [Fake("alpha", [r"^alpha"]), Fake("zulu", [r"alpha"], priority=1)]
+	assert Dispatcher(commands).match("alpha") is commands[1]
+
+
+def test_floating_beats_anchored_by_name():
+	commands = [Fake("alpha", [r"mbalpha"]), Fake("beta", [r"^beta"])]
+	dispatcher = Dispatcher(commands)
+	assert dispatcher.match("beta mbalpha") is commands[0]
+	assert dispatcher.match("beta") is commands[1]
+
+
+def test_top_level_alternation_matches_every_alternative():
+	commands = [Fake("alt", [r"abc|xyz"]), Fake("other", [r"^other"])]
+	dispatcher = Dispatcher(commands)
+	assert dispatcher.match("say xyz") is commands[0]
+	assert dispatcher.match("abc") is commands[0]
+	assert dispatcher.match("other") is commands[1]
+
+
+def test_anchored_alternation_is_not_anchored_as_a_whole():
+	commands = [Fake("alt", [r"^abc|xyz"])]
+	dispatcher = Dispatcher(commands)
+	assert dispatcher.match("say xyz") is commands[0]
+	assert dispatcher.match("say abc") is None
+
+
+@pytest.mark.parametrize("handler", ["slack_event", "slack_action", "slack_load_options", "slack_command"])
+def test_winner_without_handler_falls_through(handler):
+	commands = [
+		Fake("alpha", [r"^go"], handlers=()),
+		Fake("beta", [r"go"], handlers=(handler,)),
+		Fake("gamma", [r"^go"])
+	]
+	dispatcher = Dispatcher(commands)
+	assert dispatcher.match("go now") is commands[0]
+	assert dispatcher.match("go now", handler) is commands[1]
+	assert dispatcher.match("go now", "validate_submission") is None
+	for text in ["go", "<@U1> go", "stop", "let's go"]:
+		for h in [None, handler, "validate_submission"]:
+			assert dispatcher.match(text, h) is linear_scan(commands, text, h)
+
+
+def test_flags_are_kept():
+	commands = [Fake("loud", [re.compile(r"^shout", re.IGNORECASE)]), Fake("quiet", [re.compile(r"whisper", re.IGNORECASE)])]
+	dispatcher = Dispatcher(commands)
+	assert dispatcher.match("SHOUT") is commands[0]
+	assert dispatcher.match("i WHISPER") is commands[1]
+
+
+def test_first_literal():
+	assert first_literal("abc", "") == "a"
+	assert first_literal("abc|xyz", "") is None
+	assert first_literal("a?bc", "") is None
+	assert first_literal("abc", "i") is None
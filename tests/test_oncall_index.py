@@ -0,0 +1,191 @@
+import time
+
+import pytest
+
+import oncall_index
+from oncall_index import Intervals, OncallView, SubdomainOncalls, isoformat
+
+HOUR = 3600
+NOW = 1700000000.0
+
+
+def shift(user, start, end, ep="EP1", level=1, schedule="S1"):
+	return {
+		"escalation_policy": {"id": ep, "summary": ep},
+		"escalation_level": level,
+		"schedule": {"id": schedule, "summary": schedule} if schedule else None,
+		"user": {"id": user, "summary": user},
+		"start": isoformat(start) if start is not None else None,
+		"end": isoformat(end) if end is not None else None
+	}
+
+
+class FakePD:
+	# serves /oncalls from a list of shifts, the way PD does: every shift
+	# that overlaps [since, until), of the EPs the token can see
+
+	PDError = oncall_index.pd.PDError
+
+	def __init__(self, shifts, visible=None):
+		self.shifts = shifts
+		self.visible = visible or {}
+		self.windows = []
+
+	def can_see(self, token, ep_id):
+		return token not in self.visible or ep_id in self.visible[token]
+
+	def iter_fetch(self, oauth_token=None, endpoint=None, params=None):
+		since = oncall_index.timestamp(params["since"], None)
+		until = oncall_index.timestamp(params["until"], None)
+		self.windows.append((since, until))
+		entries = [(s, oncall_index.oncall_entry(s)) for s in self.shifts]
+		return [s for (s, e) in entries if e["starts_at"] < until and e["ends_at"] > since and self.can_see(oauth_token, e["escalation_policy"]["id"]) and e["escalation_policy"]["id"] in params.get("escalation_policy_ids[]", [e["escalation_policy"]["id"]])]
+
+	def fetch(self, oauth_token=None, endpoint=None, params=None):
+		return list(self.iter_fetch(oauth_token=oauth_token, endpoint=endpoint, params=params))
+
+	def fetch_escalation_policies(self, oauth_token=None, cache_ttl=None):
+		assert cache_ttl is None
+		return [ep for ep in (escalation_policy("EP1", "S1"), escalation_policy("EP2", "S2")) if self.can_see(oauth_token, ep["id"])]
+
+
+def escalation_policy(id, schedule):
+	return {"id": id, "summary": id, "escalation_rules": [{"escalation_targets": [{"id": schedule, "type": "schedule_reference"}]}]}
+
+def oncall_users(ep):
+	return [oncall["user"]["id"] for oncall in ep["escalation_rules"][0]["current_oncalls"]]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+	clock = {"now": NOW}
+	monkeypatch.setattr(time, "time", lambda: clock["now"])
+	return clock
+
+
+def test_intervals_at():
+	intervals = Intervals([oncall_index.oncall_entry(s) for s in [shift("B", NOW + HOUR, NOW + 2 * HOUR), shift("A", NOW, NOW + HOUR)]])
+	assert intervals.at(NOW - 1) is None
+	assert intervals.at(NOW)["user"]["id"] == "A"
+	assert intervals.at(NOW + HOUR - 1)["user"]["id"] == "A"
+	assert intervals.at(NOW + HOUR)["user"]["id"] == "B"
+	assert intervals.at(NOW + 2 * HOUR) is None
+
+
+def test_intervals_at_with_gaps_and_open_ends():
+	intervals = Intervals([oncall_index.oncall_entry(s) for s in [shift("A", None, NOW), shift("B", NOW + HOUR, None)]])
+	assert intervals.at(0)["user"]["id"] == "A"
+	assert intervals.at(NOW + 1) is None
+	assert intervals.at(NOW + 1000 * HOUR)["user"]["id"] == "B"
+
+
+def test_intervals_between():
+	intervals = Intervals([oncall_index.oncall_entry(shift(u, NOW + i * HOUR, NOW + (i + 1) * HOUR)) for (i, u) in enumerate("ABCD")])
+	assert [e["user"]["id"] for e in intervals.between(NOW + HOUR / 2, NOW + 2 * HOUR)] == ["A", "B"]
+	assert [e["user"]["id"] for e in intervals.between(NOW + HOUR, NOW + 2 * HOUR + 1)] == ["B", "C"]
+	assert intervals.between(NOW + 10 * HOUR, NOW + 11 * HOUR) == []
+
+
+def test_incremental_refresh_picks_up_overrides(monkeypatch, clock):
+	shifts = [shift("A", NOW - HOUR, NOW + HOUR), shift("B", NOW + HOUR, NOW + 3 * HOUR)]
+	pd = FakePD(shifts)
+	monkeypatch.setattr(oncall_index, "pd", pd)
+	oncalls = SubdomainOncalls("acme")
+	oncalls.refresh("token")
+	assert oncalls.snapshot.at("EP1", 1, "S1", NOW)["user"]["id"] == "A"
+
+	# an override for the rest of A's shift, made after the index was built
+	clock["now"] = NOW + oncall_index.REFRESH
+	pd.shifts = [shift("A", NOW - HOUR, clock["now"]), shift("O", clock["now"], NOW + HOUR), shift("B", NOW + HOUR, NOW + 3 * HOUR)]
+	pd.windows = []
+	oncalls.refresh("token")
+	assert pd.windows[0] == (clock["now"], clock["now"] + oncall_index.RECHECK)
+	assert oncalls.snapshot.at("EP1", 1, "S1", clock["now"])["user"]["id"] == "O"
+	# the replaced shift is gone, not left overlapping the override
+	assert [e["user"]["id"] for e in oncalls.snapshot.schedule_between("S1", NOW - HOUR, NOW + 3 * HOUR)] == ["A", "O", "B"]
+	assert oncalls.snapshot.at("EP1", 1, "S1", NOW - 1)["user"]["id"] == "A"
+
+
+def test_incremental_refresh_extends_the_window(monkeypatch, clock):
+	horizon = oncall_index.HORIZON
+	pd = FakePD([shift("A", NOW, NOW + horizon + HOUR)])
+	monkeypatch.setattr(oncall_index, "pd", pd)
+	oncalls = SubdomainOncalls("acme")
+	oncalls.refresh("token")
+
+	clock["now"] = NOW + 5 * HOUR
+	pd.shifts.append(shift("C", NOW + horizon + HOUR, NOW + horizon + 20 * HOUR))
+	pd.windows = []
+	oncalls.refresh("token")
+	assert pd.windows[1] == (NOW + horizon, clock["now"] + horizon)
+	assert oncalls.covered_until == clock["now"] + horizon
+	assert oncalls.snapshot.at("EP1", 1, "S1", NOW + horizon + 2 * HOUR)["user"]["id"] == "C"
+	# A's shift came back from both windows but is only indexed once
+	assert len(oncalls.snapshot.entries) == 2
+
+
+def test_incremental_refresh_drops_old_history(monkeypatch, clock):
+	pd = FakePD([shift("A", NOW - 2 * HOUR, NOW - HOUR), shift("B", NOW - HOUR, NOW + 100 * HOUR)])
+	monkeypatch.setattr(oncall_index, "pd", pd)
+	oncalls = SubdomainOncalls("acme")
+	oncalls.refresh("token")
+	assert len(oncalls.snapshot.entries) == 2
+
+	clock["now"] = NOW + oncall_index.HISTORY
+	oncalls.refresh("token")
+	assert [e["user"]["id"] for e in oncalls.snapshot.entries] == ["B"]
+
+
+def test_view_only_shows_visible_eps(monkeypatch, clock):
+	pd = FakePD([shift("A", NOW - HOUR, NOW + HOUR)])
+	monkeypatch.setattr(oncall_index, "pd", pd)
+	oncalls = SubdomainOncalls("acme")
+	oncalls.refresh("token")
+
+	view = OncallView(oncalls, "token", {"EP1": escalation_policy("EP1", "S1")})
+	assert [ep["id"] for ep in view.find("")[0]] == ["EP1"]
+	assert [schedule["id"] for schedule in view.find("")[1]] == ["S1"]
+	assert oncall_users(view.escalation_policy("EP1")) == ["A"]
+
+	hidden = OncallView(oncalls, "other", {"EP2": escalation_policy("EP2", "S2")})
+	assert [ep["id"] for ep in hidden.find("")[0]] == ["EP2"]
+	assert hidden.find("")[1] == []
+	assert hidden.escalation_policy("EP1") is None
+
+
+def test_view_fetches_eps_the_index_cannot_see(monkeypatch, clock):
+	pd = FakePD([shift("A", NOW - HOUR, NOW + HOUR), shift("B", NOW - HOUR, NOW + HOUR, ep="EP2", schedule="S2")], visible={"narrow": {"EP1"}})
+	monkeypatch.setattr(oncall_index, "pd", pd)
+	oncalls = SubdomainOncalls("acme")
+	oncalls.refresh("narrow")
+
+	view = OncallView(oncalls, "wide", {ep["id"]: ep for ep in pd.fetch_escalation_policies(oauth_token="wide")})
+	assert [ep["id"] for ep in view.find("EP")[0]] == ["EP1", "EP2"]
+	assert oncall_users(view.escalation_policy("EP1")) == ["A"]
+	assert oncall_users(view.escalation_policy("EP2")) == ["B"]
+
+
+def test_refreshes_stay_with_the_index_token(monkeypatch, clock):
+	# a narrower token must not replace the on-calls the index has for EPs
+	# only its own token can see
+	pd = FakePD([shift("A", NOW - HOUR, NOW + HOUR), shift("B", NOW - HOUR, NOW + HOUR, ep="EP2", schedule="S2")], visible={"narrow": {"EP1"}})
+	monkeypatch.setattr(oncall_index, "pd", pd)
+	oncalls = SubdomainOncalls("acme")
+	oncalls.refresh("wide")
+	oncalls.refreshed_at -= oncall_index.REFRESH + 1
+
+	scheduled = []
+	monkeypatch.setattr(oncall_index, "_indexes", {"acme": oncalls})
+	monkeypatch.setattr(oncall_index, "schedule_refresh", lambda subdomain, token, full=False: scheduled.append((token, full)))
+	monkeypatch.setattr(oncall_index, "schedule_visible", lambda token: None)
+	oncall_index._visible.set("narrow", ({"EP1": escalation_policy("EP1", "S1")}, time.monotonic()))
+	oncall_index.index("acme", "narrow")
+	assert scheduled == [("wide", False)]
+
+	# and a refresh with another token starts over with it
+	clock["now"] += oncall_index.REFRESH
+	oncalls.refresh("narrow")
+	assert oncalls.token == "narrow"
+	assert oncalls.full_refreshed_at == oncalls.refreshed_at
+	assert oncalls.escalation_policy("EP2") is None
+	assert oncall_users(oncalls.escalation_policy("EP1")) == ["A"]
@@ -0,0 +1,57 @@
+import threading
+import time
+
+from outbox import Outbox
+
+
+def test_unpaced_messages_skip_the_channel_limit():
+	outbox = Outbox(name="test_outbox", rate=0.01, burst=1, senders=1)
+	sent = []
+	futures = [outbox.put("C1", "chat.postMessage", sent.append, "first")]
+	futures += [outbox.put("C1", "response_url", sent.append, i, paced=False) for i in range(3)]
+	for future in futures:
+		future.result(timeout=2)
+	assert sent == ["first", 0, 1, 2]
+
+
+def test_paced_messages_wait_for_the_channel_limit():
+	outbox = Outbox(name="test_outbox", rate=0.01, burst=1, senders=1)
+	sent = []
+	outbox.put("C1", "chat.postMessage", sent.append, 1).result(timeout=2)
+	outbox.put("C1", "chat.postMessage", sent.append, 2)
+	time.sleep(0.2)
+	assert sent == [1]
+
+
+def test_a_slow_channel_does_not_hold_up_the_others():
+	# one sender, no room in its queue: the second channel's message must
+	# not be sent on the scheduler thread while the first one is stuck
+	outbox = Outbox(name="test_outbox", rate=100, burst=10, senders=1, busy_wait=0.01)
+	outbox._senders._queue.maxsize = 1
+	release = threading.Event()
+	sent = []
+	slow = outbox.put("C1", "chat.postMessage", lambda: release.wait() and sent.append("slow"))
+	time.sleep(0.05)
+	blocker = outbox.put("C2", "chat.postMessage", sent.append, "queued")
+	waiting = outbox.put("C3", "chat.postMessage", sent.append, "waiting")
+	time.sleep(0.05)
+	assert sent == []
+	release.set()
+	for future in (slow, blocker, waiting):
+		future.result(timeout=2)
+	assert sorted(sent) == ["queued", "slow", "waiting"]
+
+
+def test_ratelimited_messages_are_retried_in_order():
+	outbox = Outbox(name="test_outbox", rate=100, burst=10, senders=2, retry_wait=0.01)
+	answers = iter(["ratelimited", "ok"])
+	sent = []
+
+	def post(text):
+		answer = next(answers) if text == 1 else "ok"
+		sent.append((text, answer))
+		return answer
+
+	futures = [outbox.put("C1", "chat.postMessage", post, i, retry=lambda answer: answer == "ratelimited") for i in (1, 2)]
+	assert [future.result(timeout=2) for future in futures] == ["ok", "ok"]
+	assert sent == [(1, "ratelimited"), (1, "ok"), (2, "ok")]
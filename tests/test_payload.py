@@ -0,0 +1,25 @@
+from payload import Missing, Payload
+
+
+def test_attribute_and_item_access():
+	req = Payload({"event": {"text": "hi", "files": [{"name": "a"}]}, "get": 1, "raw": 2, "bot-id": 3})
+	assert req.event.text == "hi"
+	assert req.event.files[0].name == "a"
+	assert req.get == 1
+	assert req.raw == 2
+	assert req["bot-id"] == 3
+
+
+def test_missing_keys():
+	req = Payload({"event": {}})
+	assert req.event.message.text is Missing
+	assert req.event.files[3] is Missing
+	assert not req.event.message
+	assert req.event.message == None
+
+
+def test_missing_formats_as_empty():
+	req = Payload({})
+	assert "<@{}>".format(req.user.id) == "<@>"
+	assert str(req.user) == ""
+	assert "{:>3}".format(req.user) == "   "
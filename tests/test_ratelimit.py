@@ -0,0 +1,156 @@
+import threading
+import time
+
+import pytest
+
+from ratelimit import Limiter, SingleFlight, TokenBucket
+
+
+class Clock:
+
+	def __init__(self):
+		self.now = 1000.0
+
+	def __call__(self):
+		return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+	clock = Clock()
+	monkeypatch.setattr(time, "monotonic", clock)
+	return clock
+
+
+def test_bucket_allows_burst_then_paces(clock):
+	bucket = TokenBucket(rate=2, burst=3)
+	assert [bucket.reserve() for i in range(3)] == [0, 0, 0]
+	assert bucket.reserve() == pytest.approx(0.5)
+	assert bucket.reserve() == pytest.approx(1.0)
+
+
+def test_bucket_refills_up_to_burst(clock):
+	bucket = TokenBucket(rate=1, burst=2)
+	bucket.reserve()
+	bucket.reserve()
+	clock.now += 100
+	assert [bucket.reserve() for i in range(2)] == [0, 0]
+	assert bucket.reserve() == pytest.approx(1.0)
+
+
+def test_limiter_keys_are_independent(clock):
+	limiter = Limiter(rate=1, burst=1)
+	assert limiter.reserve("a") == 0
+	assert limiter.reserve("b") == 0
+	assert limiter.reserve("a") == pytest.approx(1.0)
+
+
+def test_limiter_off_when_rate_is_zero():
+	limiter = Limiter(rate=0, burst=1)
+	assert [limiter.reserve("a") for i in range(10)] == [0] * 10
+
+
+def test_limiter_creates_one_bucket_per_key():
+	# threads racing to create the same key's bucket must not each get a
+	# fresh burst
+	limiter = Limiter(rate=0.001, burst=5)
+	start = threading.Barrier(20)
+	delays = []
+	lock = threading.Lock()
+
+	def run():
+		start.wait()
+		delay = limiter.reserve("token")
+		with lock:
+			delays.append(delay)
+
+	threads = [threading.Thread(target=run) for i in range(20)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	assert delays.count(0) == 5
+
+
+def test_limiter_keeps_busy_buckets(clock):
+	limiter = Limiter(rate=1, burst=2, idle=60)
+	limiter.reserve("a")
+	limiter.reserve("a")
+	# in use all along, so the bucket must not expire and come back full
+	for i in range(10):
+		clock.now += 30
+		limiter.reserve("a")
+		limiter.reserve("a")
+	assert limiter.reserve("a") > 0
+
+
+def test_limiter_drops_idle_buckets(clock):
+	limiter = Limiter(rate=1, burst=1, idle=60)
+	limiter.reserve("a")
+	clock.now += 61
+	assert limiter.reserve("a") == 0
+
+
+def test_singleflight_shares_one_call():
+	flight = SingleFlight()
+	calls = []
+	release = threading.Event()
+	results = []
+
+	def fn():
+		calls.append(1)
+		release.wait()
+		return {"items": [1, 2]}
+
+	def run():
+		results.append(flight.do("key", fn))
+
+	threads = [threading.Thread(target=run) for i in range(5)]
+	for thread in threads:
+		thread.start()
+	while not flight._calls:
+		time.sleep(0.001)
+	time.sleep(0.05)
+	release.set()
+	for thread in threads:
+		thread.join()
+
+	assert len(calls) == 1
+	assert sorted(shared for (result, shared) in results) == [False, True, True, True, True]
+	values = [result for (result, shared) in results]
+	assert all(value == {"items": [1, 2]} for value in values)
+	# everyone got their own copy
+	values[0]["items"].append(3)
+	assert all(value["items"] == [1, 2] for value in values[1:])
+
+
+def test_singleflight_runs_again_after_a_call_finishes():
+	flight = SingleFlight()
+	calls = []
+	assert flight.do("key", lambda: calls.append(1) or len(calls)) == (1, False)
+	assert flight.do("key", lambda: calls.append(1) or len(calls)) == (2, False)
+
+
+def test_singleflight_shares_errors():
+	flight = SingleFlight()
+	release = threading.Event()
+	errors = []
+
+	def fn():
+		release.wait()
+		raise ValueError("boom")
+
+	def run():
+		try:
+			flight.do("key", fn)
+		except ValueError as e:
+			errors.append(e)
+
+	threads = [threading.Thread(target=run) for i in range(3)]
+	for thread in threads:
+		thread.start()
+	time.sleep(0.05)
+	release.set()
+	for thread in threads:
+		thread.join()
+	assert len(errors) == 3
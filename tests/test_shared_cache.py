@@ -0,0 +1,30 @@
+import pytest
+
+from shared_cache import MemoryBackend, SQLiteBackend
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+	if request.param == "sqlite":
+		return SQLiteBackend(str(tmp_path / "cache.sqlite"))
+	return MemoryBackend()
+
+
+def test_lease_has_one_holder(backend):
+	owner = backend.lease("key", 30)
+	assert owner
+	assert backend.lease("key", 30) is None
+	assert backend.lease("other", 30)
+	backend.release("key", owner)
+	assert backend.lease("key", 30)
+
+
+def test_release_keeps_someone_elses_lease(backend):
+	# the first holder's refresh outlived its lease, which went to another
+	first = backend.lease("key", -1)
+	second = backend.lease("key", 30)
+	assert second and second != first
+	backend.release("key", first)
+	assert backend.lease("key", 30) is None
+	backend.release("key", second)
+	assert backend.lease("key", 30)
@@ -0,0 +1,215 @@
+import bisect
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+
+import pd
+from cache import TTLCache
+from workers import WorkerPool
+
+# Slack allows 100 options, leave room for a "type more letters" hint
+OPTIONS_LIMIT = 99
+FUZZY_THRESHOLD = 0.5
+
+refresh_intervals = {
+	"services": int(os.environ.get('TYPEAHEAD_REFRESH', 300)),
+	"users": int(os.environ.get('TYPEAHEAD_REFRESH', 300)),
+	"escalation_policies": int(os.environ.get('TYPEAHEAD_REFRESH', 300))
+}
+
+# a user's own index is only built once they've searched a kind this many
+# times within its refresh interval; until then their searches go to PD's
+# ?query= directly, which is cheaper than crawling the whole list for them
+HOT_QUERIES = int(os.environ.get('TYPEAHEAD_HOT_QUERIES', 5))
+
+word_re = re.compile(r"\w+")
+
+refresher = WorkerPool(name="typeahead", workers=2, queue_size=100)
+
+
+def trigrams(text):
+	text = " {} ".format(text)
+	return set(text[i:i+3] for i in range(len(text) - 2))
+
+
+class SearchIndex:
+	# immutable snapshot of one kind of PD object in one subdomain: a sorted
+	# list of (word, name, id) for prefix search plus a trigram index for
+	# fuzzy matches. Rebuilt in the background and swapped in whole.
+
+	def __init__(self, entries):
+		self.entries = entries
+		words = []
+		grams = defaultdict(list)
+		for (id, entry) in entries.items():
+			name = (entry["summary"] or "").lower()
+			words.append((name, name, id))
+			for word in set(word_re.findall(name)):
+				if word != name:
+					words.append((word, name, id))
+			for gram in trigrams(name):
+				grams[gram].append(id)
+		words.sort()
+		self.by_name = [id for (name, id) in sorted(((entry["summary"] or "").lower(), id) for (id, entry) in entries.items())]
+		self.words = words
+		self.keys = [word for (word, name, id) in words]
+		self.grams = dict(grams)
+
+	def search(self, query, visible, limit=OPTIONS_LIMIT):
+		query = query.lower().strip()
+		found = []
+		seen = set()
+
+		if not query:
+			for id in self.by_name:
+				if id in visible:
+					found.append(self.entries[id])
+					if len(found) >= limit:
+						break
+			return found
+
+		# prefix of the name or of any word in it
+		prefix = []
+		i = bisect.bisect_left(self.keys, query)
+		while i < len(self.words) and self.keys[i].startswith(query):
+			(word, name, id) = self.words[i]
+			if id in visible and id not in seen:
+				seen.add(id)
+				prefix.append((name, id))
+			i += 1
+		for (name, id) in sorted(prefix):
+			found.append(self.entries[id])
+			if len(found) >= limit:
+				return found
+
+		# then anything sharing enough trigrams with the query
+		query_grams = trigrams(query)
+		if len(query) >= 3:
+			scores = defaultdict(int)
+			for gram in query_grams:
+				for id in self.grams.get(gram, ()):
+					if id not in seen and id in visible:
+						scores[id] += 1
+			fuzzy = [(-score, id) for (id, score) in scores.items() if score >= FUZZY_THRESHOLD * len(query_grams)]
+			for (score, id) in sorted(fuzzy):
+				found.append(self.entries[id])
+				if len(found) >= limit:
+					break
+		return found
+
+
+class SubdomainIndex:
+
+	def __init__(self, subdomain):
+		self.subdomain = subdomain
+		self.indexes = {}
+		# pd_userid -> kind -> set of ids that user's token can see
+		self.visible = defaultdict(dict)
+		# (pd_userid, kind) -> time of last refresh and of last search
+		self.refreshed = {}
+		self.used = {}
+		self.lock = threading.Lock()
+
+	def refresh(self, pd_userid, pd_token, kind):
+		fetched = {}
+		for obj in pd.fetch(oauth_token=pd_token, endpoint=kind, cache_ttl=refresh_intervals[kind]):
+			fetched[obj["id"]] = {
+				"id": obj["id"],
+				"name": obj.get("name") or obj.get("summary"),
+				"summary": obj.get("summary") or obj.get("name")
+			}
+		with self.lock:
+			now = time.monotonic()
+			self.visible[pd_userid][kind] = set(fetched)
+			self.refreshed[(pd_userid, kind)] = now
+			self.used.setdefault((pd_userid, kind), now)
+			# forget users who stopped searching, so their lists aren't kept
+			for (other, other_kind) in [key for (key, used) in list(self.used.items()) if now - used > 2 * refresh_intervals[key[1]]]:
+				self.used.pop((other, other_kind), None)
+				self.refreshed.pop((other, other_kind), None)
+				self.visible[other].pop(other_kind, None)
+				if not self.visible[other]:
+					del self.visible[other]
+			# keep whatever other users can still see, drop the rest
+			current = self.indexes.get(kind)
+			entries = {}
+			if current:
+				still_visible = set()
+				for kinds in self.visible.values():
+					still_visible |= kinds.get(kind, set())
+				entries = {id: entry for (id, entry) in current.entries.items() if id in still_visible}
+			entries.update(fetched)
+		index = SearchIndex(entries)
+		with self.lock:
+			self.indexes[kind] = index
+
+	def search(self, pd_userid, kind, query, limit=OPTIONS_LIMIT):
+		self.used[(pd_userid, kind)] = time.monotonic()
+		index = self.indexes.get(kind)
+		visible = self.visible.get(pd_userid, {}).get(kind)
+		if index is None or visible is None:
+			return None
+		return index.search(query, visible, limit)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+_pending = set()
+# (subdomain, pd_userid, kind) -> (searches, since) for users without an index
+_searches = TTLCache(maxsize=10000, ttl=max(refresh_intervals.values()))
+
+def subdomain_index(subdomain):
+	with _indexes_lock:
+		if subdomain not in _indexes:
+			_indexes[subdomain] = SubdomainIndex(subdomain)
+		return _indexes[subdomain]
+
+def schedule_refresh(user, kind):
+	key = (user["pd_subdomain"], user["pd_userid"], kind)
+	with _indexes_lock:
+		if key in _pending:
+			return
+		_pending.add(key)
+
+	def run():
+		try:
+			subdomain_index(user["pd_subdomain"]).refresh(user["pd_userid"], user["pd_token"], kind)
+		finally:
+			with _indexes_lock:
+				_pending.discard(key)
+
+	if not refresher.submit(run, label="refresh {} {}".format(user["pd_subdomain"], kind)):
+		with _indexes_lock:
+			_pending.discard(key)
+
+def hot(user, kind):
+	# counts a search by a user without an index, True once there were
+	# HOT_QUERIES of them within the refresh interval
+	key = (user["pd_subdomain"], user["pd_userid"], kind)
+	now = time.monotonic()
+	(searches, since) = _searches.get(key) or (0, now)
+	if now - since > refresh_intervals[kind]:
+		(searches, since) = (0, now)
+	searches += 1
+	_searches.set(key, (searches, since))
+	return searches >= HOT_QUERIES
+
+def search(user, kind, query, limit=OPTIONS_LIMIT):
+	# Answers a select menu query from the local index of the user's subdomain,
+	# limited to the objects the user's own token returned. Returns None when
+	# the user has no index for this kind, in which case the caller should
+	# query PD directly. Building one means crawling the whole list with the
+	# user's token, so that only starts once they search a lot
+	# (HOT_QUERIES), and it is refreshed in the background while they keep
+	# searching; users who stop are dropped on a later refresh.
+	index = subdomain_index(user["pd_subdomain"])
+	refreshed = index.refreshed.get((user["pd_userid"], kind))
+	if refreshed is None:
+		if hot(user, kind):
+			schedule_refresh(user, kind)
+		return None
+	if time.monotonic() - refreshed > refresh_intervals[kind]:
+		schedule_refresh(user, kind)
+	return index.search(user["pd_userid"], kind, query or "", limit)
@@ -0,0 +1,108 @@
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+import metrics
+
+pools = []
+
+
+class WorkerPool:
+	# fixed number of threads behind a bounded queue; submit() returns None
+	# instead of queueing when the pool is saturated so callers can shed load
+
+	def __init__(self, name="worker", workers=8, queue_size=100):
+		self.name = name
+		self.workers = workers
+		self.queue_size = queue_size
+		self._queue = queue.Queue(maxsize=queue_size)
+		self._lock = threading.Lock()
+		self._threads = []
+		self._pid = None
+		self._active = 0
+		self._submitted = 0
+		self._rejected = 0
+		self._completed = 0
+		self._failed = 0
+		self._wait_total = 0.0
+		self._wait_max = 0.0
+		pools.append(self)
+
+	def _start(self):
+		# started lazily, and again after a fork, since threads don't survive
+		# gunicorn forking its workers
+		with self._lock:
+			if self._pid == os.getpid():
+				return
+			self._pid = os.getpid()
+			self._threads = []
+			for i in range(self.workers):
+				thread = threading.Thread(target=self._run, name="{}-{}".format(self.name, i), daemon=True)
+				thread.start()
+				self._threads.append(thread)
+
+	def submit(self, fn, *args, label=None, **kwargs):
+		if self._pid != os.getpid():
+			self._start()
+		future = Future()
+		try:
+			self._queue.put_nowait((future, fn, args, kwargs, label or getattr(fn, "__qualname__", repr(fn)), time.monotonic()))
+		except queue.Full:
+			with self._lock:
+				self._rejected += 1
+			return None
+		with self._lock:
+			self._submitted += 1
+		return future
+
+	def _run(self):
+		while True:
+			(future, fn, args, kwargs, label, queued_at) = self._queue.get()
+			wait = time.monotonic() - queued_at
+			with self._lock:
+				self._active += 1
+				self._wait_total += wait
+				self._wait_max = max(self._wait_max, wait)
+			try:
+				if future.set_running_or_notify_cancel():
+					try:
+						future.set_result(fn(*args, **kwargs))
+					except Exception as e:
+						print("{} task {} failed:".format(self.name, label))
+						traceback.print_exc()
+						with self._lock:
+							self._failed += 1
+						future.set_exception(e)
+			finally:
+				with self._lock:
+					self._active -= 1
+					self._completed += 1
+				self._queue.task_done()
+
+	def stats(self):
+		with self._lock:
+			started = self._completed + self._active
+			return {
+				"name": self.name,
+				"workers": self.workers,
+				"active": self._active,
+				"queue_depth": self._queue.qsize(),
+				"queue_size": self.queue_size,
+				"submitted": self._submitted,
+				"completed": self._completed,
+				"failed": self._failed,
+				"rejected": self._rejected,
+				"wait_avg": self._wait_total / started if started else 0.0,
+				"wait_max": self._wait_max
+			}
+
+
+@metrics.collector
+def collect_pools():
+	for pool in pools:
+		for (stat, value) in pool.stats().items():
+			if stat != "name":
+				metrics.worker_pool.set(value, pool=pool.name, stat=stat)